@@ -0,0 +1,450 @@
+import argparse
+import json
+from collections import OrderedDict
+from collections import Counter
+import subprocess
+import os
+import re
+import shutil
+import random
+import statistics
+import threading
+import time
+import sys
+import glob
+import concurrent.futures
+import http.server
+import urllib.parse
+import looker_deployment
+import looker_benchmark
+from looker_deployment import get_json_prop
+from looker_deployment import get_date_timestamp
+
+_BENCHMARK_RESULT_PREFIX = "looker_api_benchmark"
+_BENCHMARK_API_HOST = "http://127.0.0.1"
+
+# Fake Looker API collections keyed by object name instead of numeric id
+_NAMED_COLLECTIONS = ("connections", "lookml_models", "projects")
+
+
+class FakeLookerApi(object):
+    """
+    In-memory stand-in of Looker REST API endpoints defined in LOOKER_API.
+    Objects are kept per collection, requests are routed by method and LOOKER_API path.
+    Every call waits for configured latency, calls are counted per API call name and per API client.
+    """
+    def __init__(self, api_endpoint, latency=0.0, jitter=0.0, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._collections = dict()
+        self._role_groups = dict()
+        self._next_id = 1
+        self._tokens = dict()
+        self.calls = Counter()
+        self.client_calls = Counter()
+
+        self._routes = list()
+        for api_call_name, (api_uri, api_method) in looker_deployment.LOOKER_API.items():
+            uri_parts = re.split(r'\{[^}]*\}', api_uri.split('?')[0])
+            uri_pattern = '([^/]+)'.join(re.escape(part) for part in uri_parts)
+            self._routes.append((api_method.__name__.upper(),
+                                 re.compile('^' + re.escape(api_endpoint) + uri_pattern + '$'),
+                                 api_call_name))
+
+    def route(self, method, path):
+        """
+        :param method: HTTP method
+        :param path: request path without query
+        :return: LOOKER_API call name and path parameters, (None, None) if no endpoint matches
+        """
+        for route_method, route_pattern, api_call_name in self._routes:
+            if route_method == method:
+                route_match = route_pattern.match(path)
+                if route_match:
+                    return api_call_name, [urllib.parse.unquote(p) for p in route_match.groups()]
+        return None, None
+
+    def handle(self, method, request_path, headers, request_body):
+        """
+        :param method: HTTP method
+        :param request_path: request path with query
+        :param headers: request headers
+        :param request_body: request body bytes
+        :return: HTTP status code and response body - JSON serializable object, text or None
+        """
+        path = urllib.parse.urlsplit(request_path).path
+        api_call_name, params = self.route(method, path)
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)))
+        if api_call_name is None:
+            return 404, {"message": "Not found"}
+
+        with self._lock:
+            if api_call_name == 'LOGIN':
+                login = urllib.parse.parse_qs(request_body.decode('utf-8'))
+                api_client = login.get("client_id", [""])[0]
+                access_token = "fake_token_{}".format(len(self._tokens) + 1)
+                self._tokens[access_token] = api_client
+                self._count(api_call_name, api_client)
+                return 200, {"access_token": access_token, "token_type": "Bearer", "expires_in": 3600}
+
+            access_token = headers.get("Authorization", "").replace("token ", "", 1)
+            if access_token not in self._tokens:
+                return 401, {"message": "Requires authentication."}
+            self._count(api_call_name, self._tokens[access_token])
+            payload = json.loads(request_body.decode('utf-8')) if request_body else None
+            return self._dispatch(api_call_name, method, params, payload)
+
+    def _count(self, api_call_name, api_client):
+        self.calls[api_call_name] += 1
+        self.client_calls[api_client] += 1
+
+    def _dispatch(self, api_call_name, method, params, payload):
+        if api_call_name == 'LOGOUT':
+            return 204, None
+        elif api_call_name == 'TEST_DBCONNECTION':
+            return 200, [{"name": "connect", "status": "success", "message": "Can connect"}]
+        elif api_call_name == 'UPDATE_SESSION':
+            return 200, {"workspace_id": payload.get("workspace_id") if payload else "production"}
+        elif api_call_name in ('CREATE_DEPLOY_KEY', 'GET_DEPLOY_KEY'):
+            return 200, "ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAABAQ fake_deploy_key_{}".format(params[0])
+        elif api_call_name in ('GET_PROJECT', 'UPDATE_PROJECT'):
+            project = self._collection("projects").setdefault(params[0], {"id": params[0], "name": params[0]})
+            project.update(payload or dict())
+            return 200, project
+        elif api_call_name == 'GET_ROLE_GROUPS':
+            return 200, [self._collection("groups")[gi] for gi in self._role_groups.get(params[0], list())
+                         if gi in self._collection("groups")]
+        elif api_call_name == 'UPDATE_ROLE_GROUPS':
+            self._role_groups[params[0]] = [str(gi) for gi in payload]
+            return 200, [self._collection("groups")[gi] for gi in self._role_groups[params[0]]
+                         if gi in self._collection("groups")]
+        elif api_call_name == 'GET_ROLES':
+            return 200, [self._expand_role(role) for role in self._collection("roles").values()]
+
+        collection_name = looker_deployment.LOOKER_API[api_call_name][0].split('/')[0]
+        collection = self._collection(collection_name)
+        if method == 'GET' and not params:
+            return 200, list(collection.values())
+        elif method == 'GET':
+            if params[0] not in collection:
+                return 404, {"message": "Not found"}
+            return 200, collection[params[0]]
+        elif method == 'POST':
+            return self._create(collection_name, collection, payload)
+        elif method == 'PATCH':
+            if params[0] not in collection:
+                return 404, {"message": "Not found"}
+            collection[params[0]].update(payload or dict())
+            return 200, collection[params[0]]
+        elif method == 'DELETE':
+            if collection.pop(params[0], None) is None:
+                return 404, {"message": "Not found"}
+            return 204, None
+        return 200, payload
+
+    def _collection(self, collection_name):
+        return self._collections.setdefault(collection_name, OrderedDict())
+
+    def _create(self, collection_name, collection, payload):
+        name = payload.get("name")
+        if name is not None and any(item.get("name") == name for item in collection.values()):
+            return 422, {"message": "Validation Failed",
+                         "errors": [{"field": "name", "code": "already_exists",
+                                     "message": "{} {} already exists".format(collection_name, name)}]}
+        item = dict(payload)
+        if collection_name in _NAMED_COLLECTIONS:
+            item_id = name
+        else:
+            item_id = str(self._next_id)
+            self._next_id += 1
+        item["id"] = item_id if collection_name in _NAMED_COLLECTIONS else int(item_id)
+        if collection_name == 'lookml_models':
+            item.setdefault("label", name.replace('_', ' ').title())
+        collection[item_id] = item
+        return 200, item
+
+    def _expand_role(self, role):
+        permission_set = self._collection("permission_sets").get(str(role.get("permission_set_id")), dict())
+        model_set = self._collection("model_sets").get(str(role.get("model_set_id")), dict())
+        return dict(role,
+                    permission_set={"id": permission_set.get("id"), "name": permission_set.get("name")},
+                    model_set={"id": model_set.get("id"), "name": model_set.get("name"),
+                               "models": model_set.get("models", list())})
+
+
+class FakeLookerHandler(http.server.BaseHTTPRequestHandler):
+    """
+    HTTP request handler passing requests to FakeLookerApi of the server
+    """
+    protocol_version = "HTTP/1.1"
+
+    def _handle(self):
+        request_body = self.rfile.read(int(self.headers.get("Content-Length", 0) or 0))
+        status, response = self.server.looker_api.handle(self.command, self.path, self.headers, request_body)
+        if response is None:
+            response_body = b''
+        elif isinstance(response, str):
+            response_body = response.encode('utf-8')
+        else:
+            response_body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain" if isinstance(response, str) else "application/json")
+        self.send_header("Content-Length", str(len(response_body)))
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        # Request log would dominate benchmark output
+        pass
+
+def start_fake_looker_server(api_endpoint, latency, jitter, seed):
+    """
+    :param api_endpoint: Looker API endpoint path, e.g. /api/3.0/
+    :param latency: seconds every API call waits
+    :param jitter: maximum random deviation of latency in seconds
+    :param seed: random seed of jitter
+    :return: running http.server.ThreadingHTTPServer with looker_api attribute
+    """
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeLookerHandler)
+    server.daemon_threads = True
+    server.looker_api = FakeLookerApi(api_endpoint, latency, jitter, seed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def get_tenant_client_id(tenant_number, product_prefix):
+    """
+    :param tenant_number:
+    :param product_prefix:
+    :return: benchmark ClientID, unique per tenant and product
+    """
+    return "t{:03d}{}".format(tenant_number, product_prefix)
+
+def write_tenant_properties(client_properties, provision_dir, repositories, product_apps, ClientID, api_port):
+    """
+    :param client_properties: combined internal and client properties
+    :param provision_dir:
+    :param repositories: synthetic repositories of tenant product
+    :param product_apps:
+    :param ClientID:
+    :param api_port: fake Looker API port
+    :return: tenant client properties file name
+    """
+    tenant_properties = looker_benchmark.get_benchmark_properties(client_properties, provision_dir, repositories,
+                                                                  product_apps, 'N')
+    tenant_properties.update({"api_host": _BENCHMARK_API_HOST,
+                              "api_port": str(api_port),
+                              # API client identifies tenant calls on fake Looker API
+                              "ClientID": "api_" + ClientID,
+                              "ClientSecret": "fake_secret"})
+    for location in ("looker_deployment_base", "looker_location", "looker_viz_extn_location"):
+        os.makedirs(tenant_properties[location], exist_ok=True)
+    tenant_properties_file = os.path.join(provision_dir, "properties", ClientID + ".json")
+    os.makedirs(os.path.dirname(tenant_properties_file), exist_ok=True)
+    with open(tenant_properties_file, 'w') as pfh:
+        json.dump(tenant_properties, pfh, indent=3)
+    return tenant_properties_file
+
+def run_tenant_install(ClientID, tenant_properties_file, internal_properties_file, provision_dir):
+    """
+    Function runs install deployment of tenant in a separate process, as it is run in production.
+    :param ClientID:
+    :param tenant_properties_file:
+    :param internal_properties_file:
+    :param provision_dir:
+    :return: tenant result dictionary
+    """
+    deployment_script = os.path.join(os.path.dirname(os.path.abspath(looker_deployment.__file__)), "looker_deployment.py")
+    tenant_env = dict(os.environ, NO_PROXY="127.0.0.1", no_proxy="127.0.0.1")
+    install_start = time.perf_counter()
+    completed = subprocess.run([sys.executable, deployment_script, ClientID,
+                                "-prop_file", tenant_properties_file,
+                                "-internal_prop_file", internal_properties_file,
+                                "-deployment_flag", "install"],
+                               cwd=provision_dir, env=tenant_env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    tenant_result = {"client_id": ClientID,
+                     "status": "completed" if completed.returncode == 0 else "failed",
+                     "wall_seconds": round(time.perf_counter() - install_start, 6)}
+    if completed.returncode != 0:
+        tenant_result["error"] = completed.stderr.decode('utf-8', 'replace')[-2000:]
+    return tenant_result
+
+def get_tenant_stages(client_properties, provision_dir, ClientID):
+    """
+    :param client_properties:
+    :param provision_dir:
+    :param ClientID:
+    :return: top level stages of latest stage report of tenant deployment
+    """
+    log_dir = os.path.join(provision_dir, "deployment", ClientID, client_properties["log_directory"])
+    stage_reports = sorted(glob.glob(os.path.join(log_dir, "*_stages.json")))
+    if not stage_reports:
+        return list()
+    with open(stage_reports[-1], 'r') as rfh:
+        return [stage for stage in json.load(rfh)["stages"] if stage["parent"] is None]
+
+def run_provisioning(client_properties, internal_properties_file, bench_dir, product_repositories,
+                     tenants, concurrency, latency, jitter, seed):
+    """
+    Function provisions tenants of all products concurrently against fresh fake Looker API.
+    :param client_properties:
+    :param internal_properties_file:
+    :param bench_dir:
+    :param product_repositories: dictionary of product to synthetic repositories
+    :param tenants: number of tenants per product
+    :param concurrency: number of tenant deployments running at the same time
+    :param latency: seconds every API call waits
+    :param jitter: maximum random deviation of latency in seconds
+    :param seed:
+    :return: provisioning result dictionary
+    """
+    provision_dir = os.path.join(bench_dir, "provision")
+    shutil.rmtree(provision_dir, ignore_errors=True)
+    os.makedirs(provision_dir)
+
+    server = start_fake_looker_server(client_properties["api_endpoint"], latency, jitter, seed)
+    try:
+        install_jobs = list()
+        for product_prefix, repositories in product_repositories.items():
+            product_apps = client_properties[product_prefix]["apps"]
+            product_properties = dict(client_properties, product_prefix=product_prefix)
+            for tenant_number in range(tenants):
+                ClientID = get_tenant_client_id(tenant_number, product_prefix)
+                tenant_properties_file = write_tenant_properties(product_properties, provision_dir, repositories,
+                                                                 product_apps, ClientID, server.server_address[1])
+                install_jobs.append((ClientID, tenant_properties_file, internal_properties_file, provision_dir))
+
+        provision_start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            tenant_results = list(executor.map(lambda install_job: run_tenant_install(*install_job), install_jobs))
+        wall_seconds = time.perf_counter() - provision_start
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    looker_api = server.looker_api
+    total_calls = sum(looker_api.calls.values())
+    tenant_calls = [looker_api.client_calls["api_" + r["client_id"]] for r in tenant_results]
+    stage_seconds = OrderedDict()
+    for tenant_result in tenant_results:
+        for stage in get_tenant_stages(client_properties, provision_dir, tenant_result["client_id"]):
+            stage_seconds.setdefault(stage["stage"], list()).append(stage["wall_seconds"])
+
+    return OrderedDict([("tenants", len(tenant_results)),
+                        ("concurrency", concurrency),
+                        ("failed", [r["client_id"] for r in tenant_results if r["status"] == 'failed']),
+                        ("wall_seconds", round(wall_seconds, 6)),
+                        ("api_calls", total_calls),
+                        ("api_calls_per_tenant", round(statistics.mean(tenant_calls), 1)),
+                        ("api_calls_per_second", round(total_calls / wall_seconds, 1) if wall_seconds > 0 else None),
+                        ("tenant_wall_seconds", round(statistics.mean(r["wall_seconds"] for r in tenant_results), 6)),
+                        ("tenants_per_minute", round(len(tenant_results) * 60.0 / wall_seconds, 2) if wall_seconds > 0 else None),
+                        ("stage_seconds", OrderedDict((s, round(statistics.mean(v), 6)) for s, v in stage_seconds.items())),
+                        ("calls_by_endpoint", OrderedDict(sorted(looker_api.calls.items()))),
+                        ("errors", {r["client_id"]: r["error"] for r in tenant_results if r["status"] == 'failed'})])
+
+def print_provisioning_results(provisioning_results, latency):
+    """
+    :param provisioning_results: list of provisioning result dictionaries
+    :param latency: seconds every API call waits
+    :return:
+    """
+    print("Fake Looker API latency: {:.0f} ms".format(latency * 1000))
+    print("  {:>7} {:>11} {:>10} {:>11} {:>12} {:>10} {:>12} {:>7}".format(
+        "tenants", "concurrency", "wall", "calls", "calls/tenant", "calls/s", "tenant wall", "failed"))
+    for provisioning_result in provisioning_results:
+        print("  {:>7} {:>11} {:>9.2f}s {:>11} {:>12} {:>10} {:>11.2f}s {:>7}".format(
+            provisioning_result["tenants"], provisioning_result["concurrency"], provisioning_result["wall_seconds"],
+            provisioning_result["api_calls"], provisioning_result["api_calls_per_tenant"],
+            provisioning_result["api_calls_per_second"], provisioning_result["tenant_wall_seconds"],
+            len(provisioning_result["failed"])))
+        stage_seconds = provisioning_result["stage_seconds"]
+        if stage_seconds:
+            print("          mean tenant stages: {}".format(", ".join("{} {:.2f}s".format(s, v) for s, v in stage_seconds.items())))
+
+# ***** Main function ***** #
+def main():
+
+    # Setup parsing command line arguments and app usage help
+    parseArgs = argparse.ArgumentParser(description='Install provisioning benchmark against fake Looker API')
+    parseArgs.add_argument('-bench_dir', type=str, help='Benchmark folder for synthetic content, deployments and results',
+                           required=True)
+    parseArgs.add_argument('-prop_file', type=argparse.FileType('r', encoding='UTF-8'),
+                           help='Please provide json formatted properties file name', required=False,
+                           default='looker_properties.json')
+    parseArgs.add_argument('-internal_prop_file', type=argparse.FileType('r', encoding='UTF-8'),
+                           help='Please provide json formatted properties file name', required=False,
+                           default='internal_looker_properties.json')
+    parseArgs.add_argument('-products', type=str, nargs='+', help='Products every tenant is provisioned for',
+                           default=['gpm'])
+    parseArgs.add_argument('-tenants', type=int, nargs='+', help='Tenant counts per product to provision',
+                           default=[1, 4, 16])
+    parseArgs.add_argument('-concurrency', type=int, nargs='+', help='Concurrent tenant deployments to run',
+                           default=[1, 4])
+    parseArgs.add_argument('-latency_ms', type=float, help='Latency of every fake Looker API call', default=20.0)
+    parseArgs.add_argument('-jitter_ms', type=float, help='Maximum random deviation of API call latency', default=5.0)
+    looker_benchmark.add_generator_arguments(parseArgs)
+    parseArgs.set_defaults(views_per_prefix=10, dashboards_per_model=3, topojson_arcs=200)
+
+    args = parseArgs.parse_args()
+
+    if min(args.tenants) < 1 or min(args.concurrency) < 1:
+        print("Number of tenants and concurrency must be positive")
+        exit(1)
+
+    looker_deployment._DEBUG_LEVEL = looker_benchmark._DEPLOYMENT_DEBUG_LEVEL["QUIET"]
+    client_properties = {**get_json_prop(args.internal_prop_file), **get_json_prop(args.prop_file)}
+    unknown_products = [p for p in args.products if p not in client_properties.get("products", list())]
+    if unknown_products:
+        print("Products {} are not defined in internal properties".format(unknown_products))
+        exit(1)
+
+    bench_dir = os.path.abspath(os.path.expanduser(args.bench_dir))
+    results_dir = os.path.join(bench_dir, "results")
+    os.makedirs(results_dir, exist_ok=True)
+
+    product_repositories = OrderedDict()
+    for product_prefix in args.products:
+        product_repositories[product_prefix] = looker_benchmark.generate_synthetic_repositories(
+            client_properties, os.path.join(bench_dir, "synthetic_" + product_prefix),
+            looker_benchmark.get_generator_params(args, product_prefix))
+
+    latency = args.latency_ms / 1000.0
+    provisioning_results = list()
+    for tenants in args.tenants:
+        for concurrency in args.concurrency:
+            provisioning_result = run_provisioning(client_properties, os.path.abspath(args.internal_prop_file.name),
+                                                   bench_dir, product_repositories, tenants, concurrency,
+                                                   latency, args.jitter_ms / 1000.0, args.seed)
+            for ClientID, error in provisioning_result["errors"].items():
+                print("Tenant {} install failed:\n{}".format(ClientID, error))
+            print("Provisioned {} tenants with concurrency {} in {:.2f} seconds".format(
+                provisioning_result["tenants"], concurrency, provisioning_result["wall_seconds"]))
+            provisioning_results.append(provisioning_result)
+
+    print_provisioning_results(provisioning_results, latency)
+
+    benchmark_result = OrderedDict([("started_at", get_date_timestamp(current_time=True)),
+                                    ("package_revision", looker_benchmark.get_package_revision()),
+                                    ("cpu_count", os.cpu_count()),
+                                    ("products", args.products),
+                                    ("latency_ms", args.latency_ms),
+                                    ("jitter_ms", args.jitter_ms),
+                                    ("generator", looker_benchmark.get_generator_params(args, None)),
+                                    ("results", provisioning_results)])
+    result_file = os.path.join(results_dir, "{}{}.json".format(_BENCHMARK_RESULT_PREFIX, get_date_timestamp()))
+    with open(result_file, 'w') as rfh:
+        json.dump(benchmark_result, rfh, indent=3)
+    print("Benchmark result is written into {}".format(result_file))
+
+    if any(r["failed"] for r in provisioning_results):
+        exit(1)
+
+# Main execution.
+if __name__ == '__main__':
+    main()
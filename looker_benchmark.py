@@ -0,0 +1,645 @@
+import argparse
+import json
+from collections import OrderedDict
+import subprocess
+import os
+import shutil
+import random
+import statistics
+import platform
+import time
+import sys
+import looker_deployment
+from looker_deployment import get_json_prop
+from looker_deployment import get_date_timestamp
+from looker_deployment import deployment_stage
+from looker_deployment import debug
+from looker_deployment import _INFO, _DEBUG, _WARNING, _ERROR
+
+# Deployment log is suppressed during benchmark runs unless requested, printing distorts timings
+_DEPLOYMENT_DEBUG_LEVEL = {
+    "QUIET": _ERROR,
+    "NORMAL": _INFO,
+    "DEBUG": _DEBUG
+}
+
+_BENCHMARK_SCENARIOS = ["single_tenant", "multi_tenant", "batch_render"]
+
+# Bump when synthetic content layout changes, results of different layouts are not compared
+_GENERATOR_VERSION = 1
+
+_BENCHMARK_RESULT_PREFIX = "looker_benchmark"
+_BENCHMARK_TENANT_PREFIX = "bench"
+
+# Stages slower by less than this are timer noise, not regressions
+_REGRESSION_MIN_SECONDS = 0.01
+
+
+def write_text_file(file_name, file_text):
+    """
+    :param file_name:
+    :param file_text:
+    :return: number of bytes written
+    """
+    file_data = file_text.encode('utf-8')
+    with open(file_name, 'wb') as fh:
+        fh.write(file_data)
+    return len(file_data)
+
+def get_product_models(client_properties, product_prefix):
+    """
+    :param client_properties:
+    :param product_prefix:
+    :return: product applications and unique list of their models in definition order
+    """
+    product_apps = client_properties[product_prefix]["apps"]
+    product_models = list()
+    for app in product_apps:
+        for mi in client_properties.get(app, list()):
+            if mi not in product_models:
+                product_models.append(mi)
+    return product_apps, product_models
+
+def generate_view(view_name, view_fields, dashboard_links, rnd):
+    """
+    :param view_name:
+    :param view_fields: number of dimensions in view
+    :param dashboard_links: list of (model, dashboard) html links can point to
+    :param rnd: random.Random
+    :return: LookML view text
+    """
+    lines = ["view: {} {{".format(view_name),
+             "  sql_table_name: {} ;;".format(view_name.upper()),
+             "",
+             "  dimension: id {",
+             "    primary_key: yes",
+             "    type: number",
+             "    sql: ${TABLE}.ID ;;",
+             "  }"]
+    for fi in range(view_fields):
+        lines.append("")
+        lines.append("  dimension: field_{} {{".format(fi))
+        lines.append("    label: \"Field {}\"".format(fi))
+        lines.append("    type: {}".format(rnd.choice(["string", "number", "date"])))
+        lines.append("    sql: ${{TABLE}}.FIELD_{} ;;".format(fi))
+        if dashboard_links and rnd.random() < 0.1:
+            model_name, dashboard_name = rnd.choice(dashboard_links)
+            lines.append("    html: <a href=\"/dashboards/{}::{}?Filter={{{{ value }}}}\">{{{{ value }}}}</a> ;;".format(model_name, dashboard_name))
+        lines.append("  }")
+    lines.append("")
+    lines.append("  measure: count {")
+    lines.append("    type: count")
+    lines.append("    drill_fields: [id]")
+    lines.append("  }")
+    lines.append("}")
+    return '\n'.join(lines) + '\n'
+
+def generate_model(model_name, connection_name, includes, explore_views, rnd):
+    """
+    :param model_name:
+    :param connection_name:
+    :param includes: list of include patterns
+    :param explore_views: list of view names, one explore is generated per view
+    :param rnd: random.Random
+    :return: LookML model text
+    """
+    lines = ["connection: \"{}\"".format(connection_name), ""]
+    lines.extend("include: \"{}\"".format(include) for include in includes)
+    lines.append("")
+    lines.append("label: \"@MODEL_TOKEN@ {}\"".format(model_name))
+    for view_name in explore_views:
+        lines.append("")
+        lines.append("explore: {} {{".format(view_name))
+        lines.append("  label: \"@EXPLORE_TOKEN@ {}\"".format(view_name))
+        lines.append("  hidden: no")
+        for join_view in rnd.sample(explore_views, min(3, len(explore_views))):
+            if join_view == view_name:
+                continue
+            lines.append("  join: {} {{".format(join_view))
+            lines.append("    type: left_outer")
+            lines.append("    sql_on: ${{{}.id}} = ${{{}.id}} ;;".format(view_name, join_view))
+            lines.append("    relationship: many_to_one")
+            lines.append("  }")
+        lines.append("}")
+    return '\n'.join(lines) + '\n'
+
+def generate_dashboard(dashboard_name, model_name, dashboard_elements, explore_views, rnd):
+    """
+    :param dashboard_name:
+    :param model_name:
+    :param dashboard_elements: number of dashboard elements
+    :param explore_views: list of explore names elements query
+    :param rnd: random.Random
+    :return: LookML dashboard text
+    """
+    lines = ["- dashboard: {}".format(dashboard_name),
+             "  title: \"@DASHBOARD_TOKEN@ {}\"".format(dashboard_name),
+             "  layout: newspaper",
+             "  elements:"]
+    for ei in range(dashboard_elements):
+        explore_name = rnd.choice(explore_views)
+        lines.append("  - name: element_{}".format(ei))
+        lines.append("    title: Element {}".format(ei))
+        lines.append("    model: {}".format(model_name))
+        lines.append("    explore: {}".format(explore_name))
+        lines.append("    type: {}".format(rnd.choice(["looker_column", "looker_line", "table", "single_value"])))
+        lines.append("    fields: [{0}.field_0, {0}.count]".format(explore_name))
+        lines.append("    sorts: [{}.count desc]".format(explore_name))
+        lines.append("    limit: 500")
+        lines.append("    listen:")
+        lines.append("      Filter: {}.field_0".format(explore_name))
+        lines.append("    row: {}".format(ei * 6))
+        lines.append("    col: 0")
+        lines.append("    width: 24")
+        lines.append("    height: 6")
+    lines.append("  filters:")
+    lines.append("  - name: Filter")
+    lines.append("    title: Filter")
+    lines.append("    type: field_filter")
+    return '\n'.join(lines) + '\n'
+
+def generate_readme(app_token, dashboard_links):
+    """
+    :param app_token:
+    :param dashboard_links: list of (model, dashboard) readme links to
+    :return: markdown text
+    """
+    lines = ["# {}".format(app_token.replace('_', ' ').title()), ""]
+    for model_name, dashboard_name in dashboard_links:
+        lines.append("* [{0}](/dashboards/{1}::{0})".format(dashboard_name, model_name))
+    return '\n'.join(lines) + '\n'
+
+def generate_topojson(topojson_arcs, rnd):
+    """
+    :param topojson_arcs: number of arcs
+    :param rnd: random.Random
+    :return: TopoJSON text
+    """
+    arcs = list()
+    for ai in range(topojson_arcs):
+        arc = [[rnd.randint(0, 9999), rnd.randint(0, 9999)]]
+        arc.extend([rnd.randint(-50, 50), rnd.randint(-50, 50)] for pi in range(rnd.randint(5, 40)))
+        arcs.append(arc)
+    geometries = [{"type": "Polygon", "arcs": [[ai]], "properties": {"name": "Region {}".format(ai)}}
+                  for ai in range(topojson_arcs)]
+    return json.dumps({"type": "Topology",
+                       "transform": {"scale": [0.036, 0.017], "translate": [-180, -85]},
+                       "objects": {"regions": {"type": "GeometryCollection", "geometries": geometries}},
+                       "arcs": arcs})
+
+def generate_viz_extension(viz_name, viz_functions):
+    """
+    :param viz_name:
+    :param viz_functions: number of generated functions
+    :return: JavaScript text
+    """
+    lines = ["// Visualization extension {}".format(viz_name), "(function() {"]
+    for fi in range(viz_functions):
+        lines.append("  // Draws series {}".format(fi))
+        lines.append("  function drawSeries{0}(element, data, config) {{".format(fi))
+        lines.append("    var values = data.map(function(row) { return row.value; });")
+        lines.append("    return values.length > 0 ? values.reduce(function(a, b) {{ return a + b; }}) / {} : 0;".format(fi + 1))
+        lines.append("  }")
+    lines.append("  looker.plugins.visualizations.add({{id: \"{0}\", label: \"{0}\", create: function() {{}}, update: function() {{}}}});".format(viz_name))
+    lines.append("})();")
+    return '\n'.join(lines) + '\n'
+
+def generate_synthetic_repositories(client_properties, synthetic_dir, generator_params):
+    """
+    Function generates synthetic OOB Prod and PS repositories for product following
+    content naming conventions: base_*_model Model files, views with product view prefixes,
+    application dashboards and readmes, c_ PS content, topojson and visualization extension files.
+    Repositories are reused if generator parameters did not change.
+    :param client_properties:
+    :param synthetic_dir: folder repositories are generated into
+    :param generator_params: dictionary of generator parameters
+    :return: dictionary with prod and ps repository folders, number of files and bytes generated
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+
+    generator_file = os.path.join(synthetic_dir, "generator.json")
+    if os.path.isfile(generator_file):
+        with open(generator_file, 'r') as gfh:
+            generated = json.load(gfh)
+        if generated.get("params") == generator_params:
+            print("Reusing synthetic repositories in {}".format(synthetic_dir))
+            return generated["repositories"]
+
+    shutil.rmtree(synthetic_dir, ignore_errors=True)
+    prod_dir = os.path.join(synthetic_dir, "prod")
+    ps_dir = os.path.join(synthetic_dir, "ps")
+    os.makedirs(prod_dir)
+    os.makedirs(ps_dir)
+
+    rnd = random.Random(generator_params["seed"])
+    product_prefix = generator_params["product"]
+    product_apps, product_models = get_product_models(client_properties, product_prefix)
+    view_prefixes = client_properties[product_prefix + "_views_prefix"]
+    connection_name = "conn_" + product_prefix + "_oracle"
+    generated_files = 0
+    generated_bytes = 0
+
+    def write_repo_file(repo_dir, file_name, file_text):
+        nonlocal generated_files, generated_bytes
+        generated_bytes += write_text_file(os.path.join(repo_dir, file_name), file_text)
+        generated_files += 1
+
+    # Dashboards are named first, so views and readmes can link to them
+    app_dashboards = OrderedDict()
+    for mi in product_models:
+        if mi.find('model') < 0:
+            continue
+        app_token = looker_deployment.get_app_model_token(mi)
+        app_dashboards[mi] = ["{}_dash_{}".format(app_token, di) for di in range(generator_params["dashboards_per_model"])]
+    dashboard_links = [(mi, dashboard_name) for mi, dashboards in app_dashboards.items() for dashboard_name in dashboards]
+
+    view_names = list()
+    for vi in view_prefixes:
+        for ni in range(generator_params["views_per_prefix"]):
+            view_name = "base_{}_v{}".format(vi, ni)
+            view_names.append(view_name)
+            write_repo_file(prod_dir, view_name + ".view.lkml",
+                            generate_view(view_name, generator_params["view_fields"], dashboard_links, rnd))
+
+    for mi in product_models:
+        explore_views = rnd.sample(view_names, min(generator_params["explores_per_model"], len(view_names)))
+        includes = ["base_{}_*.view.lkml".format(vi) for vi in view_prefixes]
+        if mi in app_dashboards:
+            includes.append("base_{}_*.dashboard.lookml".format(looker_deployment.get_app_model_token(mi)))
+        write_repo_file(prod_dir, mi + ".model.lkml", generate_model(mi, connection_name, includes, explore_views, rnd))
+
+    for mi, dashboards in app_dashboards.items():
+        app_token = looker_deployment.get_app_model_token(mi)
+        for dashboard_name in dashboards:
+            write_repo_file(prod_dir, "base_{}.dashboard.lookml".format(dashboard_name),
+                            generate_dashboard(dashboard_name, mi, generator_params["dashboard_elements"], view_names, rnd))
+        write_repo_file(prod_dir, "{}_readme.md".format(app_token), generate_readme(app_token, [(mi, d) for d in dashboards]))
+
+    for ti in range(generator_params["topojson_files"]):
+        write_repo_file(prod_dir, "{}_map_{}.topojson.json".format(product_prefix, ti),
+                        generate_topojson(generator_params["topojson_arcs"], rnd))
+    write_repo_file(prod_dir, "{}_viz.js".format(product_prefix), generate_viz_extension(product_prefix + "_viz", 50))
+    replacement_tokens = {product_prefix: {"replace_token_map": {"MODEL_TOKEN": "Synthetic Model",
+                                                                 "EXPLORE_TOKEN": "Synthetic Explore",
+                                                                 "DASHBOARD_TOKEN": "Synthetic Dashboard"}}}
+    write_repo_file(prod_dir, client_properties["replacement_tokens_file_name"], json.dumps(replacement_tokens, indent=3))
+
+    # PS content extends application models and adds c_ views and dashboards
+    ps_view_names = ["c_{}_v{}".format(product_prefix, ni) for ni in range(generator_params["ps_views"])]
+    for view_name in ps_view_names:
+        write_repo_file(ps_dir, view_name + ".view.lkml",
+                        generate_view(view_name, generator_params["view_fields"], dashboard_links, rnd))
+    for mi in app_dashboards:
+        app_token = looker_deployment.get_app_model_token(mi)
+        includes = [mi + ".model.lkml", "c_{}_*.view.lkml".format(product_prefix)]
+        write_repo_file(ps_dir, "c_{}_model.model.lkml".format(app_token),
+                        generate_model("c_{}_model".format(app_token), connection_name, includes,
+                                       rnd.sample(ps_view_names, min(2, len(ps_view_names))), rnd))
+    for di in range(generator_params["ps_dashboards"]):
+        dashboard_name = "c_{}_dash_{}".format(product_prefix, di)
+        write_repo_file(ps_dir, dashboard_name + ".dashboard.lookml",
+                        generate_dashboard(dashboard_name, rnd.choice(list(app_dashboards) or product_models),
+                                           generator_params["dashboard_elements"], view_names, rnd))
+    write_repo_file(ps_dir, "c_{}_readme.md".format(product_prefix), generate_readme(product_prefix, dashboard_links[:10]))
+
+    repositories = {"prod": prod_dir,
+                    "ps": ps_dir,
+                    "files": generated_files,
+                    "bytes": generated_bytes}
+    with open(generator_file, 'w') as gfh:
+        json.dump({"params": generator_params, "repositories": repositories}, gfh, indent=3, sort_keys=True)
+    print("Generated {} files, {:.1f} MB of synthetic content in {}".format(generated_files, generated_bytes / 2**20, synthetic_dir))
+    return repositories
+
+def get_benchmark_properties(client_properties, bench_dir, repositories, product_apps, single_tenant_deployment):
+    """
+    :param client_properties: combined internal and client properties
+    :param bench_dir:
+    :param repositories: synthetic repositories returned by generate_synthetic_repositories
+    :param product_apps:
+    :param single_tenant_deployment: Y or N
+    :return: client properties deploying synthetic content into benchmark folder
+    """
+    return {**client_properties,
+            "looker_deployment_base": os.path.join(bench_dir, "deployment"),
+            "looker_location": os.path.join(bench_dir, "looker", "models"),
+            "looker_viz_extn_location": os.path.join(bench_dir, "looker", "visualizations"),
+            "project_mode": "offline",
+            "project_name": "bench_project",
+            "product_apps": product_apps,
+            "single_tenant_deployment": single_tenant_deployment,
+            "prod_repo_local_dir": repositories["prod"],
+            "ps_repo_local_dir": repositories["ps"]}
+
+def reset_benchmark_run(client_properties):
+    """
+    Every run starts like a new deployment process: in-memory caches and stage records are dropped.
+    :param client_properties:
+    :return:
+    """
+    looker_deployment._FILE_CATALOG.invalidate()
+    looker_deployment._LOOKML_TREE_CACHES.clear()
+    del looker_deployment._DEPLOYMENT_STAGES[:]
+    for location in ("looker_location", "looker_viz_extn_location"):
+        os.makedirs(client_properties[location], exist_ok=True)
+
+def run_offline_deployment(client_properties, ClientID):
+    """
+    :param client_properties:
+    :param ClientID:
+    :return:
+    """
+    client_deployment_dir = os.path.join(client_properties["looker_deployment_base"], ClientID)
+    os.makedirs(client_deployment_dir, exist_ok=True)
+    os.chdir(client_deployment_dir)
+    db_connection_name = looker_deployment.get_db_connection_name(client_properties, ClientID)
+    with deployment_stage("offline_deployment"):
+        looker_deployment.offline_deployment(client_properties, client_deployment_dir, ClientID, db_connection_name)
+
+def run_benchmark_scenario(scenario, client_properties, bench_dir, repositories, product_apps, tenants):
+    """
+    Function runs one render of scenario and returns aggregated stage records.
+    single_tenant - one Single Tenant offline deployment
+    multi_tenant - Multi Tenant offline deployments of all tenants one after another
+    batch_render - batch render of all tenants, tenant stages run in worker processes and are not reported
+    :param scenario:
+    :param client_properties:
+    :param bench_dir:
+    :param repositories:
+    :param product_apps:
+    :param tenants: number of tenants for multi tenant scenarios
+    :return: dictionary of stage name to aggregated stage timings
+    """
+    tenant_ids = ["{}{:03d}".format(_BENCHMARK_TENANT_PREFIX, ti) for ti in range(tenants)]
+    if scenario == 'single_tenant':
+        scenario_properties = get_benchmark_properties(client_properties, bench_dir, repositories, product_apps, 'Y')
+        reset_benchmark_run(scenario_properties)
+        run_offline_deployment(scenario_properties, tenant_ids[0])
+    elif scenario == 'multi_tenant':
+        scenario_properties = get_benchmark_properties(client_properties, bench_dir, repositories, product_apps, 'N')
+        reset_benchmark_run(scenario_properties)
+        for ClientID in tenant_ids:
+            run_offline_deployment(scenario_properties, ClientID)
+    else:
+        scenario_properties = get_benchmark_properties(client_properties, bench_dir, repositories, product_apps, 'N')
+        reset_benchmark_run(scenario_properties)
+        batch_deployment_dir = os.path.join(scenario_properties["looker_deployment_base"], "batch")
+        os.makedirs(batch_deployment_dir, exist_ok=True)
+        os.chdir(batch_deployment_dir)
+        with deployment_stage("batch_render"):
+            if not looker_deployment.batch_render(scenario_properties, batch_deployment_dir,
+                                                  {"tenants": [{"client_id": ClientID} for ClientID in tenant_ids]}):
+                raise looker_deployment.ProcessException("Batch render failed")
+
+    run_stages = OrderedDict()
+    for stage in looker_deployment._DEPLOYMENT_STAGES:
+        stage_total = run_stages.setdefault(stage["stage"], {"parent": stage["parent"], "renders": 0, "wall_seconds": 0.0,
+                                                             "cpu_seconds": 0.0, "files": 0, "bytes_written": 0})
+        # Number of tenant renders of synthetic content done in stage
+        stage_total["renders"] += tenants if stage["stage"] == 'batch_render' else 1
+        stage_total["wall_seconds"] += stage["wall_seconds"]
+        stage_total["cpu_seconds"] += stage["cpu_seconds"] + stage["children_cpu_seconds"]
+        stage_total["files"] += stage["files"]
+        stage_total["bytes_written"] += stage["bytes_written"] or 0
+    return run_stages
+
+def summarize_scenario_runs(scenario_runs, content_bytes):
+    """
+    :param scenario_runs: list of stage timings returned by run_benchmark_scenario
+    :param content_bytes: size of synthetic content rendered by top level stage
+    :return: dictionary of stage name to median timings and throughput
+    """
+    scenario_summary = OrderedDict()
+    for stage_name, stage_total in scenario_runs[0].items():
+        stage_runs = [run_stages[stage_name] for run_stages in scenario_runs if stage_name in run_stages]
+        wall_seconds = statistics.median(s["wall_seconds"] for s in stage_runs)
+        files = statistics.median(s["files"] for s in stage_runs)
+        # Top level stage throughput is measured on synthetic content, nested stages on bytes they write
+        stage_bytes = content_bytes * stage_total["renders"] if stage_total["parent"] is None \
+            else statistics.median(s["bytes_written"] for s in stage_runs)
+        scenario_summary[stage_name] = {
+            "parent": stage_total["parent"],
+            "wall_seconds": round(wall_seconds, 6),
+            "min_wall_seconds": round(min(s["wall_seconds"] for s in stage_runs), 6),
+            "cpu_seconds": round(statistics.median(s["cpu_seconds"] for s in stage_runs), 6),
+            "files": files,
+            "files_per_second": round(files / wall_seconds, 1) if wall_seconds > 0 else None,
+            "mb_per_second": round(stage_bytes / 2**20 / wall_seconds, 2) if wall_seconds > 0 else None}
+    return scenario_summary
+
+def get_package_revision():
+    """
+    :return: git commit of deployment app folder or None
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=60,
+                              check=True).stdout.decode('utf-8').strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def find_previous_result(results_dir, benchmark_result):
+    """
+    :param results_dir:
+    :param benchmark_result: current benchmark result
+    :return: latest stored result with the same generator parameters and tenants, None if there is no such result
+    """
+    if not os.path.isdir(results_dir):
+        return None
+    for result_file in sorted(os.listdir(results_dir), reverse=True):
+        if not (result_file.startswith(_BENCHMARK_RESULT_PREFIX) and result_file.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(results_dir, result_file), 'r') as rfh:
+                previous_result = json.load(rfh)
+        except (OSError, ValueError):
+            continue
+        if previous_result.get("generator") == benchmark_result["generator"] and \
+                previous_result.get("tenants") == benchmark_result["tenants"]:
+            previous_result["file"] = result_file
+            return previous_result
+    return None
+
+def compare_benchmark_results(benchmark_result, previous_result, regression_threshold):
+    """
+    :param benchmark_result:
+    :param previous_result:
+    :param regression_threshold: wall time increase in percent reported as regression
+    :return: list of (scenario, stage, previous seconds, current seconds, change in percent) for regressed stages
+    """
+    print("Comparison with {} ({})".format(previous_result.get("file"), previous_result.get("started_at")))
+    print("  {:<14} {:<28} {:>10} {:>10} {:>8}".format("scenario", "stage", "previous", "current", "change"))
+    regressions = list()
+    for scenario, scenario_summary in benchmark_result["scenarios"].items():
+        previous_summary = previous_result.get("scenarios", dict()).get(scenario, dict())
+        for stage_name, stage_summary in scenario_summary.items():
+            if stage_name not in previous_summary:
+                continue
+            previous_seconds = previous_summary[stage_name]["wall_seconds"]
+            current_seconds = stage_summary["wall_seconds"]
+            change = (current_seconds - previous_seconds) * 100.0 / previous_seconds if previous_seconds > 0 else 0.0
+            regressed = change > regression_threshold and current_seconds - previous_seconds > _REGRESSION_MIN_SECONDS
+            print("  {:<14} {:<28} {:>9.3f}s {:>9.3f}s {:>+7.1f}%{}".format(scenario, stage_name, previous_seconds,
+                                                                         current_seconds, change,
+                                                                         " REGRESSION" if regressed else ""))
+            if regressed:
+                regressions.append((scenario, stage_name, previous_seconds, current_seconds, change))
+    return regressions
+
+def print_benchmark_result(benchmark_result):
+    """
+    :param benchmark_result:
+    :return:
+    """
+    print("Synthetic content: {} files, {:.1f} MB, tenants: {}, runs per scenario: {}".format(
+        benchmark_result["content"]["files"], benchmark_result["content"]["bytes"] / 2**20,
+        benchmark_result["tenants"], benchmark_result["repeat"]))
+    print("  {:<14} {:<28} {:>10} {:>10} {:>8} {:>10} {:>8}".format("scenario", "stage", "wall", "cpu",
+                                                                  "files", "files/s", "MB/s"))
+    for scenario, scenario_summary in benchmark_result["scenarios"].items():
+        for stage_name, stage_summary in scenario_summary.items():
+            stage_label = stage_name if stage_summary["parent"] is None else "  " + stage_name
+            print("  {:<14} {:<28} {:>9.3f}s {:>9.3f}s {:>8} {:>10} {:>8}".format(
+                scenario, stage_label, stage_summary["wall_seconds"], stage_summary["cpu_seconds"],
+                int(stage_summary["files"]), stage_summary["files_per_second"] or '-', stage_summary["mb_per_second"] or '-'))
+
+def add_generator_arguments(parseArgs):
+    """
+    :param parseArgs: argparse.ArgumentParser synthetic content parameters are added to
+    :return:
+    """
+    parseArgs.add_argument('-views_per_prefix', type=int, help='OOB view files per product view prefix', default=50)
+    parseArgs.add_argument('-view_fields', type=int, help='Dimensions per view', default=20)
+    parseArgs.add_argument('-explores_per_model', type=int, help='Explores per model', default=10)
+    parseArgs.add_argument('-dashboards_per_model', type=int, help='OOB dashboards per application model', default=10)
+    parseArgs.add_argument('-dashboard_elements', type=int, help='Elements per dashboard', default=8)
+    parseArgs.add_argument('-ps_views', type=int, help='PS c_ view files', default=20)
+    parseArgs.add_argument('-ps_dashboards', type=int, help='PS c_ dashboards', default=5)
+    parseArgs.add_argument('-topojson_files', type=int, help='Topojson map files', default=2)
+    parseArgs.add_argument('-topojson_arcs', type=int, help='Arcs per topojson map file', default=2000)
+    parseArgs.add_argument('-seed', type=int, help='Synthetic content random seed', default=1)
+
+def get_generator_params(args, product_prefix):
+    """
+    :param args: parsed command line arguments
+    :param product_prefix:
+    :return: synthetic content generator parameters
+    """
+    return OrderedDict([("version", _GENERATOR_VERSION),
+                        ("product", product_prefix),
+                        ("views_per_prefix", args.views_per_prefix),
+                        ("view_fields", args.view_fields),
+                        ("explores_per_model", args.explores_per_model),
+                        ("dashboards_per_model", args.dashboards_per_model),
+                        ("dashboard_elements", args.dashboard_elements),
+                        ("ps_views", args.ps_views),
+                        ("ps_dashboards", args.ps_dashboards),
+                        ("topojson_files", args.topojson_files),
+                        ("topojson_arcs", args.topojson_arcs),
+                        ("seed", args.seed)])
+
+# ***** Main function ***** #
+def main():
+
+    # Setup parsing command line arguments and app usage help
+    parseArgs = argparse.ArgumentParser(description='Offline deployment benchmark on synthetic Looker content')
+    parseArgs.add_argument('-bench_dir', type=str, help='Benchmark folder for synthetic content, deployments and results',
+                           required=True)
+    parseArgs.add_argument('-prop_file', type=argparse.FileType('r', encoding='UTF-8'),
+                           help='Please provide json formatted properties file name', required=False,
+                           default='looker_properties.json')
+    parseArgs.add_argument('-internal_prop_file', type=argparse.FileType('r', encoding='UTF-8'),
+                           help='Please provide json formatted properties file name', required=False,
+                           default='internal_looker_properties.json')
+    parseArgs.add_argument('-product', type=str, help='Product content is generated for', default='gpm')
+    parseArgs.add_argument('-scenarios', type=str, nargs='+', help='Benchmark scenarios to run',
+                           default=_BENCHMARK_SCENARIOS, choices=_BENCHMARK_SCENARIOS)
+    parseArgs.add_argument('-tenants', type=int, help='Number of tenants in multi tenant scenarios', default=4)
+    parseArgs.add_argument('-repeat', type=int, help='Number of runs per scenario, median is reported', default=3)
+
+    add_generator_arguments(parseArgs)
+
+    parseArgs.add_argument('-compare', type=argparse.FileType('r', encoding='UTF-8'),
+                           help='Benchmark result file to compare with. Defaults to latest result of the same content',
+                           required=False, default=None)
+    parseArgs.add_argument('-regression_threshold', type=float,
+                           help='Stage wall time increase in percent reported as regression', default=10.0)
+    parseArgs.add_argument('-fail_on_regression', type=str, help='If = Y - exit with error on regression',
+                           default='N', choices=['Y', 'N'])
+    parseArgs.add_argument('-debug_level', type=str, help='Deployment log level during benchmark runs',
+                           default='QUIET', choices=list(_DEPLOYMENT_DEBUG_LEVEL))
+
+    args = parseArgs.parse_args()
+
+    if args.tenants < 1 or args.repeat < 1:
+        print("Number of tenants and runs must be positive")
+        exit(1)
+
+    looker_deployment._DEBUG_LEVEL = _DEPLOYMENT_DEBUG_LEVEL[args.debug_level]
+    client_properties = {**get_json_prop(args.internal_prop_file), **get_json_prop(args.prop_file)}
+    if args.product not in client_properties.get("products", list()):
+        print("Product {} is not defined in internal properties".format(args.product))
+        exit(1)
+    client_properties["product_prefix"] = args.product
+
+    bench_dir = os.path.abspath(os.path.expanduser(args.bench_dir))
+    results_dir = os.path.join(bench_dir, "results")
+    os.makedirs(results_dir, exist_ok=True)
+
+    generator_params = get_generator_params(args, args.product)
+    repositories = generate_synthetic_repositories(client_properties, os.path.join(bench_dir, "synthetic"),
+                                                   generator_params)
+    product_apps, product_models = get_product_models(client_properties, args.product)
+
+    benchmark_result = OrderedDict([("started_at", get_date_timestamp(current_time=True)),
+                                    ("package_revision", get_package_revision()),
+                                    ("python", platform.python_version()),
+                                    ("platform", platform.platform()),
+                                    ("cpu_count", os.cpu_count()),
+                                    ("generator", generator_params),
+                                    ("content", {"files": repositories["files"], "bytes": repositories["bytes"]}),
+                                    ("tenants", args.tenants),
+                                    ("repeat", args.repeat),
+                                    ("scenarios", OrderedDict())])
+
+    for scenario in args.scenarios:
+        # Deployment output of previous scenario is not reused
+        for scenario_dir in ("deployment", "looker"):
+            shutil.rmtree(os.path.join(bench_dir, scenario_dir), ignore_errors=True)
+        scenario_runs = list()
+        for ri in range(args.repeat):
+            run_start = time.perf_counter()
+            try:
+                scenario_runs.append(run_benchmark_scenario(scenario, client_properties, bench_dir, repositories,
+                                                            product_apps, args.tenants))
+            except (looker_deployment.ProcessException, SystemExit) as e:
+                print("Scenario {} run {} failed: {}".format(scenario, ri + 1, str(e)))
+                exit(1)
+            print("Scenario {} run {} completed in {:.3f} seconds".format(scenario, ri + 1, time.perf_counter() - run_start))
+        benchmark_result["scenarios"][scenario] = summarize_scenario_runs(scenario_runs, repositories["bytes"])
+
+    print_benchmark_result(benchmark_result)
+
+    if args.compare is not None:
+        previous_result = json.load(args.compare)
+        previous_result["file"] = args.compare.name
+    else:
+        previous_result = find_previous_result(results_dir, benchmark_result)
+    regressions = list()
+    if previous_result is not None:
+        regressions = compare_benchmark_results(benchmark_result, previous_result, args.regression_threshold)
+    else:
+        print("There is no previous result of the same synthetic content to compare with")
+
+    result_file = os.path.join(results_dir, "{}{}.json".format(_BENCHMARK_RESULT_PREFIX, get_date_timestamp()))
+    with open(result_file, 'w') as rfh:
+        json.dump(benchmark_result, rfh, indent=3)
+    print("Benchmark result is written into {}".format(result_file))
+
+    if regressions and args.fail_on_regression == 'Y':
+        print("{} stages regressed more than {}%".format(len(regressions), args.regression_threshold))
+        exit(1)
+
+# Main execution.
+if __name__ == '__main__':
+    main()
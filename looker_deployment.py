@@ -8,11 +8,31 @@ import os
 import shutil
 import re
 import logging
-import fileinput
 import sys
 from collections import defaultdict
+from collections import Counter
 import traceback
 import copy
+import hashlib
+import ctypes
+import errno
+import tempfile
+import fcntl
+import concurrent.futures
+import threading
+import io
+import fnmatch
+import time
+import resource
+import contextlib
+import atexit
+import select
+import struct
+import zlib
+import tarfile
+import looker_lookml
+import looker_viz
+import looker_topojson
 
 class ProcessException(Exception):
     pass
@@ -46,6 +66,26 @@ _MESSAGE_TEXT = {
 
 _REQUEST_TIMEOUT = 600
 
+_GIT_REMOTE_URL = "git@github.com:ModelN/{}.git"
+
+# renameat2 flags for atomic folder exchange
+_AT_FDCWD = -100
+_RENAME_EXCHANGE = 2
+# ioctl request to share file extents (reflink) on copy-on-write file systems
+_FICLONE = 0x40049409
+# inotify(7) event masks
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ONLYDIR = 0x01000000
+_INOTIFY_EVENT = struct.Struct('iIII')
+# Directory listings modified within this time are not cached by FileCatalog
+_CATALOG_RACY_NS = 2 * 10**9
+# Bump when rendered output changes for the same inputs, invalidates render cache entries
+_RENDER_CACHE_VERSION = 2
+
 def debug (msg, level = _MESSAGE, json_flag = False):
 
     global _LOGGER
@@ -76,6 +116,101 @@ def get_date_timestamp(current_time=False):
         return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
 
+# Completed deployment stages and stack of running stages
+_DEPLOYMENT_STAGES = list()
+_ACTIVE_STAGES = list()
+
+def get_process_io():
+    """
+    :return: bytes read and written by process read/write system calls, (None, None) if not available
+    """
+    try:
+        with open('/proc/self/io', 'r') as io_fh:
+            io_counters = dict(line.split(': ', 1) for line in io_fh.read().splitlines())
+        return int(io_counters["rchar"]), int(io_counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+@contextlib.contextmanager
+def deployment_stage(stage_name):
+    """
+    Context manager recording named deployment stage: wall time, CPU time of process and
+    git child processes, files processed, bytes read and written and peak RSS.
+    Stages can be nested, files are counted in all running stages.
+    :param stage_name:
+    :return: stage record
+    """
+    stage = {"stage": stage_name,
+             "parent": _ACTIVE_STAGES[-1]["stage"] if _ACTIVE_STAGES else None,
+             "started_at": get_date_timestamp(current_time=True),
+             "status": "running",
+             "files": 0}
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start_read, start_written = get_process_io()
+
+    _ACTIVE_STAGES.append(stage)
+    try:
+        yield stage
+        stage["status"] = "completed"
+    except BaseException:
+        stage["status"] = "failed"
+        raise
+    finally:
+        _ACTIVE_STAGES.remove(stage)
+        end_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        end_read, end_written = get_process_io()
+        stage["wall_seconds"] = round(time.perf_counter() - start_wall, 6)
+        stage["cpu_seconds"] = round(time.process_time() - start_cpu, 6)
+        stage["children_cpu_seconds"] = round(end_children.ru_utime + end_children.ru_stime
+                                              - start_children.ru_utime - start_children.ru_stime, 6)
+        stage["bytes_read"] = end_read - start_read if start_read is not None else None
+        stage["bytes_written"] = end_written - start_written if start_written is not None else None
+        # ru_maxrss is in kilobytes on Linux
+        stage["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        stage["children_peak_rss_kb"] = end_children.ru_maxrss
+        _DEPLOYMENT_STAGES.append(stage)
+        debug("Stage {} {} in {:.3f} seconds, CPU {:.3f} seconds, {} files".format(
+            stage_name, stage["status"], stage["wall_seconds"], stage["cpu_seconds"], stage["files"]), _INFO)
+
+def add_stage_files(file_count=1):
+    """
+    :param file_count: number of files processed by running stages
+    :return:
+    """
+    for stage in _ACTIVE_STAGES:
+        stage["files"] += file_count
+
+def add_stage_transform_time(transform_name, seconds):
+    """
+    Function accumulates time spent by content transform in the innermost running stage.
+    :param transform_name:
+    :param seconds:
+    :return:
+    """
+    if _ACTIVE_STAGES:
+        transform_stats = _ACTIVE_STAGES[-1].setdefault("transforms", dict()).setdefault(transform_name, {"files": 0, "seconds": 0.0})
+        transform_stats["files"] += 1
+        transform_stats["seconds"] += seconds
+
+def write_stage_report(stage_report_file, report_attributes):
+    """
+    Function writes JSON report of completed deployment stages.
+    :param stage_report_file:
+    :param report_attributes: dictionary of deployment attributes added to report
+    :return:
+    """
+    stage_report = dict(report_attributes,
+                        completed_at=get_date_timestamp(current_time=True),
+                        stages=_DEPLOYMENT_STAGES)
+    try:
+        with open(stage_report_file, 'w') as rfh:
+            json.dump(stage_report, rfh, indent=3, sort_keys=True)
+        debug("Stage report is written into {}".format(stage_report_file), _INFO)
+    except OSError as e:
+        debug("Cannot write stage report {}: {}".format(stage_report_file, str(e)), _WARNING)
+
 # Define Looker API endpoints
 LOOKER_API = {
     "LOGIN":("login", requests.post),
@@ -139,7 +274,7 @@ def get_json_prop(in_json_file):
             json.decoder.JSONDecodeError: if config file is not valid JSON document
     """
     try:
-        out_json_properties = json.load(in_json_file, encoding='utf-8', object_pairs_hook=OrderedDict)
+        out_json_properties = json.load(in_json_file, object_pairs_hook=OrderedDict)
         return out_json_properties
     except json.decoder.JSONDecodeError as json_err:
         debug("Provided config file {} is not valid JSON document".format(in_json_file), _ERROR)
@@ -204,6 +339,31 @@ def get_response_code(in_raw_response):
     status_response_code = int(status_response_code_d["Response"])
     return status_response_code
 
+# Looker objects created or updated by deployment and deployed content, listed in JSON build manifest
+_DEPLOYED_API_OBJECTS = list()
+_DEPLOYED_CONTENT = dict()
+
+def record_api_object(object_type, object_name, resp_code, action="create"):
+    """
+    :param object_type: connection, lookml_model, model_set, permission_set, role, group, role_groups, user_attribute
+    :param object_name:
+    :param resp_code: Looker REST API response code
+    :param action: create or update
+    :return:
+    """
+    if resp_code == 200:
+        status = "created" if action == "create" else "updated"
+    elif resp_code in (409, 422) and action == "create":
+        # Looker rejects creation of existing object
+        status = "exists"
+    else:
+        status = "failed"
+    _DEPLOYED_API_OBJECTS.append({"type": object_type,
+                                  "name": object_name,
+                                  "action": action,
+                                  "status": status,
+                                  "response_code": resp_code})
+
 # Function generates acess token
 def get_access_token(client_properties):
     """
@@ -329,21 +489,27 @@ def looker_update_project(client_properties, in_access_token):
         debug("Response code {}".format(resp_code))
 
 # Function creates new Looker database connection
-def looker_create_dbconnection(client_properties, in_access_token, ClientID):
+def get_db_connection_name(client_properties, ClientID):
     """
     :param client_properties:
-    :param in_access_token:
-    :return:
+    :param ClientID:
+    :return: database connection name based on type of tenant deployment
     """
-    debug("Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
-    # Construct connection name based on type of tenant deployment
     if client_properties["single_tenant_deployment"] == 'Y':
         debug("Single tenant db connection format: conn_product_dbtype", _INFO)
-        dbconn_name = 'conn_' + client_properties["product_prefix"] + '_' + client_properties["dbconn_db_type"]
+        return 'conn_' + client_properties["product_prefix"] + '_' + client_properties["dbconn_db_type"]
     else:
         debug("Multi tenant db connection format: conn_product_ClientID", _INFO)
-        dbconn_name = 'conn_' + client_properties["product_prefix"] + '_' + ClientID
+        return 'conn_' + client_properties["product_prefix"] + '_' + ClientID
 
+def looker_create_dbconnection(client_properties, in_access_token, ClientID):
+    """
+    :param client_properties:
+    :param in_access_token:
+    :return:
+    """
+    debug("Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+    dbconn_name = get_db_connection_name(client_properties, ClientID)
 
     debug("Creating database connection type {}: {}".format(client_properties["dbconn_db_type"], dbconn_name), _INFO)
     payload = {
@@ -362,6 +528,7 @@ def looker_create_dbconnection(client_properties, in_access_token, ClientID):
     r = LOOKER_API["CREATE_DBCONNECTION"][1](create_dbconnection_url, headers=header_content, json=payload, verify=False)
 
     resp_code = get_response_code(r)
+    record_api_object("connection", dbconn_name, resp_code)
 
     body = r.json()
     if resp_code == 200:
@@ -488,6 +655,7 @@ def looker_create_lookml_model(client_properties,
                   }
         r = run_looker_restapi(client_properties, in_access_token, "CREATE_LOOKML_MODEL", in_payload=payload)
         resp_code = get_response_code(r)
+        record_api_object("lookml_model", mi, resp_code)
         body = r.json()
         if resp_code == 200:
             debug("Successfully configured model {}".format(mi), _INFO)
@@ -668,6 +836,7 @@ def looker_create_model_set(client_properties, in_access_token, lookml_models, C
             r = LOOKER_API["CREATE_MODEL_SET"][1](create_model_set_url, headers=header_content, json=payload, verify=False)
 
             resp_code = get_response_code(r)
+            record_api_object("model_set", modelset_name, resp_code)
             body = r.json()
 
             if resp_code == 200:
@@ -751,6 +920,7 @@ def looker_create_permission_set(client_properties, in_access_token):
 
                 r = run_looker_restapi(client_properties, in_access_token, "CREATE_PERMISSION_SET", in_payload=payload)
                 resp_code = get_response_code(r)
+                record_api_object("permission_set", permset_name, resp_code)
                 body = r.json()
                 # debug("Response code: {}".format(resp_code))
                 if resp_code == 200:
@@ -848,6 +1018,7 @@ def looker_create_role(client_properties, in_access_token, looker_models, model_
 
                 r = run_looker_restapi(client_properties, in_access_token, "CREATE_ROLE", in_payload=payload)
                 resp_code = get_response_code(r)
+                record_api_object("role", role_name, resp_code)
                 body = r.json()
 
                 if resp_code == 200:
@@ -977,6 +1148,7 @@ def looker_create_group(client_properties, in_access_token, ClientID, group_name
 
         r = run_looker_restapi(client_properties, in_access_token, "CREATE_GROUP", in_payload=payload)
         resp_code = get_response_code(r)
+        record_api_object("group", group_name, resp_code)
         body = r.json()
 
         # debug("REST API Response code: {}".format(resp_code), _DEBUG)
@@ -1057,6 +1229,7 @@ def looker_update_role_groups(client_properties, in_access_token, CliendID, curr
                 payload = [group_id]
                 r_role_update = run_looker_restapi(client_properties, in_access_token, "UPDATE_ROLE_GROUPS", role_id, in_payload=payload)
                 resp_code = get_response_code(r_role_update)
+                record_api_object("role_groups", "{}/{}".format(role_name, group_name), resp_code)
                 body = r_role_update.json()
                 #uncomment for debugging
                 #debug("Updating Role with Group REST API Response code: {}".format(resp_code), _DEBUG)
@@ -1093,6 +1266,7 @@ def looker_update_role_groups_user(client_properties, in_access_token, ClientID,
     r_role_update = run_looker_restapi(client_properties, in_access_token, "UPDATE_ROLE_GROUPS", role_id,
                                        in_payload=payload)
     resp_code = get_response_code(r_role_update)
+    record_api_object("role_groups", "{}/{}".format(role_name, group_name), resp_code)
     body = r_role_update.json()
 
     if resp_code == 200:
@@ -1191,6 +1365,7 @@ def looker_create_user_attribute(client_properties, in_access_token, ClientID):
 
             r_create_user_attr = run_looker_restapi(client_properties, in_access_token, "CREATE_USER_ATTRIBUTE", in_payload=payload)
             resp_code = get_response_code(r_create_user_attr)
+            record_api_object("user_attribute", _attr_name, resp_code)
             body = r_create_user_attr.json()
 
             # debug("REST API Response code: {}".format(resp_code), _DEBUG)
@@ -1265,6 +1440,7 @@ def looker_update_user_attribute(client_properties, in_access_token, in_server_u
                     r_update_user_attr = run_looker_restapi(client_properties, in_access_token, "UPDATE_USER_ATTRIBUTE", user_attr_id,
                                            in_payload=payload)
                     resp_code = get_response_code(r_update_user_attr)
+                    record_api_object("user_attribute", user_attr_name, resp_code, action="update")
                     body = r_update_user_attr.json()
                     if resp_code == 200:
                         debug("* Successfully updated User Attribute: {}".format(user_attr_name), _INFO)
@@ -1306,15 +1482,27 @@ def initiate_customer_repository(client_properties, customer_dir):
     #"cd revvy-analytics.git"
     #"git push --mirror git@github.com:ModelN/looker-gpm.git"
 
+    git_timeout = int(client_properties.get("git_timeout", 60))
+
+    if client_properties.get("git_mirror_cache", "N") == 'Y':
+        # Push Production default branch and tags straight from local mirror
+        prod_mirror_dir = update_git_mirror(client_properties, prod_repo)
+        prod_branch = run_git_command(["symbolic-ref", "--short", "HEAD"], cwd=prod_mirror_dir, timeout=git_timeout).strip()
+        debug("Push Production branch {} from local mirror to Customer git".format(prod_branch), _INFO)
+        run_git_command(["push", _GIT_REMOTE_URL.format(cust_repo),
+                         "refs/heads/{0}:refs/heads/{0}".format(prod_branch), "--tags"],
+                        cwd=prod_mirror_dir, timeout=git_timeout)
+        return
+
     git_clone = "git clone --bare git@github.com:ModelN/"+prod_repo+".git --single-branch"
     git_mirror_push = "git push --mirror git@github.com:ModelN/"+cust_repo+".git"
 
     debug("Cloning Production repo", _INFO)
-    subprocess.run(git_clone.split(), timeout=60)
+    subprocess.run(git_clone.split(), timeout=git_timeout)
   # TO DO - check for subprocess status before proceed
     os.chdir(os.path.join(customer_dir, prod_repo_dir))
     debug("Mirror push to Customer git", _INFO)
-    subprocess.run(git_mirror_push.split(), timeout=60)
+    subprocess.run(git_mirror_push.split(), timeout=git_timeout)
   # TO DO - check for subprocess status before proceed
 
 # Update Customer GitHub repository
@@ -1332,14 +1520,223 @@ def update_customer_repository(client_properties):
     cust_repo = client_properties["customer_repo"]
 
     debug("Syncing Prod repository {} into Customer repository {}".format(prod_repo, cust_repo))
+    git_timeout = int(client_properties.get("git_timeout", 60))
+
+    if client_properties.get("git_mirror_cache", "N") == 'Y':
+        # Checkouts are created from local mirrors, only new objects are fetched from GitHub
+        for repo_iter in (prod_repo, cust_repo):
+            if os.path.isdir(repo_iter):
+                debug("Repository {} checkout exists. Removing it".format(repo_iter), _INFO)
+                shutil.rmtree(repo_iter)
+            git_checkout_from_mirror(client_properties, repo_iter, None, os.path.abspath(repo_iter))
+        return
 
     clone_prod_str = "git clone git@github.com:ModelN/"+prod_repo+".git --single-branch"
     clone_cust_str = "git clone git@github.com:ModelN/"+cust_repo+".git --single-branch"
 
-    subprocess.run(clone_prod_str.split(), timeout=60)
-    subprocess.run(clone_cust_str.split(), timeout=60)
+    subprocess.run(clone_prod_str.split(), timeout=git_timeout)
+    subprocess.run(clone_cust_str.split(), timeout=git_timeout)
     # TO DO - use Popen, implement parallel execution and error handling
 
+def run_git_command(git_args, cwd=None, timeout=60):
+    """
+    :param git_args: list of git command arguments
+    :param cwd: folder to run git command in
+    :param timeout: seconds
+    :return: command standard output
+    Raises:
+        ProcessException: if git command fails or times out
+    """
+    debug("Running git {}".format(' '.join(git_args)), _DEBUG)
+    try:
+        git_result = subprocess.run(["git"] + git_args, cwd=cwd, timeout=timeout,
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    except subprocess.TimeoutExpired:
+        raise ProcessException("git {} timed out after {} seconds".format(' '.join(git_args), timeout))
+
+    if git_result.returncode != 0:
+        raise ProcessException("git {} failed with exit code {}: {}".format(' '.join(git_args),
+                                                                           git_result.returncode,
+                                                                           git_result.stderr.strip()))
+    return git_result.stdout
+
+def get_git_command_timeout(client_properties, deadline=None):
+    """
+    :param client_properties:
+    :param deadline: time repository job has to finish by, None if job has no deadline
+    :return: timeout in seconds for next git command, git_timeout limited by time remaining to deadline
+    Raises:
+        ProcessException: if job deadline has passed
+    """
+    git_timeout = int(client_properties.get("git_timeout", 60))
+    if deadline is None:
+        return git_timeout
+    remaining = (deadline - datetime.datetime.now()).total_seconds()
+    if remaining <= 0:
+        raise ProcessException("Repository job deadline has passed")
+    # Command timing out at the deadline is reported as job timeout
+    return min(git_timeout, round(remaining + 0.05, 1))
+
+def get_git_mirror_dir(client_properties, repo):
+    """
+    :param client_properties:
+    :param repo: GitHub repository name
+    :return: local bare mirror folder under Looker deployment base
+    """
+    return os.path.join(os.path.expanduser(client_properties["looker_deployment_base"]),
+                        client_properties.get("git_mirror_directory", "git_mirrors"),
+                        repo + ".git")
+
+def update_git_mirror(client_properties, repo, deadline=None):
+    """
+    Function creates local bare mirror of GitHub repository on first use and
+    fetches only new objects on subsequent runs. Mirror is locked while updated,
+    so concurrent deployments for other ClientIDs share the same mirror.
+    :param client_properties:
+    :param repo: GitHub repository name
+    :param deadline: time repository job has to finish by, None if job has no deadline
+    :return: local mirror folder
+    Raises:
+        ProcessException: if git command fails or job deadline passes
+    """
+    mirror_dir = get_git_mirror_dir(client_properties, repo)
+    os.makedirs(os.path.dirname(mirror_dir), exist_ok=True)
+
+    with open(mirror_dir + ".lock", 'w') as lock_fh:
+        if deadline is None:
+            fcntl.flock(lock_fh, fcntl.LOCK_EX)
+        else:
+            # Mirror may be updated by deployment of another ClientID, wait for it until deadline only
+            while True:
+                try:
+                    fcntl.flock(lock_fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if datetime.datetime.now() >= deadline:
+                        raise ProcessException("Repository job deadline has passed while waiting for mirror {} lock".format(mirror_dir))
+                    time.sleep(0.5)
+        if os.path.isdir(mirror_dir):
+            debug("Fetching new objects into local mirror {}".format(mirror_dir), _INFO)
+            run_git_command(["remote", "update", "--prune"], cwd=mirror_dir,
+                            timeout=get_git_command_timeout(client_properties, deadline))
+        else:
+            debug("Creating local mirror {} of repository {}".format(mirror_dir, repo), _INFO)
+            temp_mirror_dir = mirror_dir + ".tmp"
+            if os.path.isdir(temp_mirror_dir):
+                shutil.rmtree(temp_mirror_dir)
+            run_git_command(["clone", "--mirror", _GIT_REMOTE_URL.format(repo), temp_mirror_dir],
+                            timeout=get_git_command_timeout(client_properties, deadline))
+            # Allow partial clones with blob filters from local mirror
+            run_git_command(["config", "uploadpack.allowFilter", "true"], cwd=temp_mirror_dir,
+                            timeout=get_git_command_timeout(client_properties, deadline))
+            os.rename(temp_mirror_dir, mirror_dir)
+
+    return mirror_dir
+
+def git_checkout_from_mirror(client_properties, repo, branch, checkout_dir, sparse_patterns=None, deadline=None):
+    """
+    Function updates local mirror and creates checkout of the branch from it.
+    Local clone hardlinks mirror objects, no data is transferred from GitHub.
+    :param client_properties:
+    :param repo: GitHub repository name
+    :param branch: branch name, default branch if not defined
+    :param checkout_dir:
+    :param sparse_patterns: list of files patterns for sparse clone mode
+    :param deadline: time repository job has to finish by, None if job has no deadline
+    :return:
+    """
+    mirror_dir = update_git_mirror(client_properties, repo, deadline)
+
+    debug("Creating checkout {} from local mirror {}".format(checkout_dir, mirror_dir), _INFO)
+    if client_properties.get("git_clone_mode", "full") == 'full':
+        git_clone_checkout(client_properties, mirror_dir, branch, checkout_dir, deadline=deadline)
+    else:
+        # depth and filter are ignored for local path clones
+        git_clone_checkout(client_properties, "file://" + mirror_dir, branch, checkout_dir, sparse_patterns, deadline)
+
+def git_clone_checkout(client_properties, repo_url, branch, checkout_dir, sparse_patterns=None, deadline=None):
+    """
+    Function clones a single branch according to git_clone_mode property:
+        full    - complete history
+        shallow - depth 1 clone, latest commit only
+        sparse  - depth 1 partial clone without blobs, only files matching sparse_patterns are checked out
+    :param client_properties:
+    :param repo_url:
+    :param branch: branch name, default branch if not defined
+    :param checkout_dir:
+    :param sparse_patterns: list of files patterns for sparse clone mode
+    :param deadline: time repository job has to finish by, None if job has no deadline
+    :return:
+    """
+    clone_mode = client_properties.get("git_clone_mode", "full")
+    if clone_mode == 'sparse' and not sparse_patterns:
+        debug("No sparse checkout patterns defined. Using shallow clone", _WARNING)
+        clone_mode = 'shallow'
+
+    clone_args = ["clone", "--single-branch"]
+    if branch:
+        clone_args += ["-b", branch]
+    if clone_mode in ('shallow', 'sparse'):
+        clone_args += ["--depth", "1"]
+    if clone_mode == 'sparse':
+        clone_args += ["--filter=blob:none", "--no-checkout"]
+
+    debug("Cloning {} into {} in {} mode".format(repo_url, checkout_dir, clone_mode), _INFO)
+    run_git_command(clone_args + [repo_url, checkout_dir], timeout=get_git_command_timeout(client_properties, deadline))
+
+    if clone_mode == 'sparse':
+        debug("Sparse checkout patterns: {}".format(sparse_patterns), _DEBUG)
+        run_git_command(["sparse-checkout", "set", "--no-cone"] + sparse_patterns, cwd=checkout_dir,
+                        timeout=get_git_command_timeout(client_properties, deadline))
+        # Only blobs matching sparse patterns are fetched
+        run_git_command(["checkout"], cwd=checkout_dir, timeout=get_git_command_timeout(client_properties, deadline))
+
+def get_sparse_checkout_patterns(client_properties, ps_content=False):
+    """
+    Function derives sparse checkout patterns from applications selected,
+    product views prefixes and PS c_ naming convention. Content is processed
+    from repository root only.
+    :param client_properties:
+    :param ps_content: True - patterns for PS repository, False - for OOB Prod repository
+    :return: list of patterns
+    """
+    # replacement tokens and topojson files
+    sparse_patterns = ["/*.json"]
+
+    if ps_content:
+        # PS content files start with c_, PS model files without app token are deployed as well
+        sparse_patterns += ["/c_*", "/*model.lkml"]
+        return sparse_patterns
+
+    # Visualization extension files
+    sparse_patterns.append("/*.js")
+    for mi in get_application_models(client_properties, None):
+        app_model_token = get_app_model_token(mi)
+        sparse_patterns.append("/*{}*.model.lkml".format(app_model_token))
+        # Dashboards and documents are deployed for application models only
+        if mi.find('model') >= 0:
+            sparse_patterns += ["/base_*{}*dashboard.lookml".format(app_model_token),
+                                "/{}_readme.md".format(app_model_token)]
+
+    for vi in get_product_view_prefix(client_properties):
+        sparse_patterns.append("/base_{}*view.lkml".format(vi))
+
+    # Remove duplicates keeping order
+    dup_values = set()
+    return [x for x in sparse_patterns if x not in dup_values and not dup_values.add(x)]
+
+def get_app_model_token(model_name):
+    """
+    Function extracts app-model token from model name base_<app-model-token>_model
+    :param model_name:
+    :return: app-model token. Common models without base_ or model parts are returned unchanged
+    """
+    _model_pos = model_name.find('model')
+    _base_pos = model_name.find('base')
+    if _model_pos < 0 or _base_pos < 0:
+        return model_name
+    return model_name[_base_pos + len('base') + 1:_model_pos - 1]
+
 def check_prod_apps_models(client_properties):
     """
     :param client_properties:
@@ -1432,7 +1829,7 @@ def get_application_models(client_properties, client_proj_deployment_dir, proces
         # Process files on Looker Server file system
         debug("Processing Models based on Looker content model files", _INFO)
 
-        _app_models = [f for f in get_files(client_proj_deployment_dir, fpath=False) if re.findall('\S+(model[.]lkml)', f)]
+        _app_models = _FILE_CATALOG.list_files(client_proj_deployment_dir, [r'\S+(model[.]lkml)'])
         app_models = [f[0:f.find('.')] for f in _app_models]
         debug("***** Found Application Models from processed content: \n{}".format('\n'.join(app_models)), _DEBUG)
         return app_models
@@ -1451,11 +1848,25 @@ def get_product_view_prefix(client_properties):
     debug("These views prefixes will be used for deployment: {}".format(prod_views_prefixes))
     return prod_views_prefixes
 
-def offline_ps_git_repo_clone(client_properties, client_deployment_dir):
+def get_looker_project_name(client_properties, ClientID):
+    """
+    :param client_properties:
+    :param ClientID:
+    :return: Looker Project name - project_name for Single Tenant and ClientID for Multi Tenant deployment
+    """
+    if client_properties["single_tenant_deployment"] == 'Y':
+        return client_properties["project_name"]
+    else:
+        return ClientID
+
+def offline_ps_git_repo_clone(client_properties, client_deployment_dir, deadline=None):
     """
     :param client_properties:
     :param client_deployment_dir:
+    :param deadline: time repository job has to finish by, None if job has no deadline
     :return: ps_repo_location
+    Raises:
+        ProcessException: if PS repository was not cloned
     """
 
     debug("Checking PS repository properties", _INFO)
@@ -1463,40 +1874,34 @@ def offline_ps_git_repo_clone(client_properties, client_deployment_dir):
 
         ps_repo = client_properties["ps_repo"]
 
-        # Construct git statement to clone from PS master or branch
+        # Clone folder is repository name for master and branch name for branch
         if not client_properties["ps_repo_branch"]:
             # Clone from maser
             ps_repo_location = ps_repo
             debug("Cloning PS repository {} from master".format(ps_repo), _INFO)
-            clone_ps_str = "git clone git@github.com:ModelN/" + ps_repo + ".git --single-branch"
-            if os.path.isdir(os.path.join(client_deployment_dir, ps_repo)):
-                debug("PS Repository {} clone exists. Removing it".format(ps_repo))
-                shutil.rmtree(ps_repo)
         else:
             # Clone from branch
-            ps_branch = client_properties["ps_repo_branch"]
-            ps_repo_location = ps_branch
-            debug("Cloning PS repository {} from branch {}".format(ps_repo, ps_branch), _INFO)
-            clone_ps_str = "git clone -b " + ps_branch + " git@github.com:ModelN/" + ps_repo + ".git " + ps_branch + " --single-branch"
-            if os.path.isdir(os.path.join(client_deployment_dir, ps_branch)):
-                debug("PS repository {} clone exists. Removing it".format(ps_branch))
-                shutil.rmtree(ps_branch)
-        debug("Cloning PS repository {}".format(ps_repo), _INFO)
-        subprocess.run(clone_ps_str.split(), timeout=60)
-        # Check if cloning was successful
+            ps_repo_location = client_properties["ps_repo_branch"]
+            debug("Cloning PS repository {} from branch {}".format(ps_repo, ps_repo_location), _INFO)
+
         _ps_repo_folder = os.path.join(client_deployment_dir, ps_repo_location)
         if os.path.isdir(_ps_repo_folder):
-            debug("PS repository was successfully cloned into folder {}".format(_ps_repo_folder), _INFO)
+            debug("PS repository {} clone exists. Removing it".format(ps_repo_location))
+            shutil.rmtree(_ps_repo_folder)
+
+        sparse_patterns = get_sparse_checkout_patterns(client_properties, ps_content=True) \
+            if client_properties.get("git_clone_mode", "full") == 'sparse' else None
+        if client_properties.get("git_mirror_cache", "N") == 'Y':
+            git_checkout_from_mirror(client_properties, ps_repo, client_properties["ps_repo_branch"],
+                                     _ps_repo_folder, sparse_patterns, deadline)
         else:
-            debug("PS repository {} was not cloned".format(ps_repo), _ERROR)
-            debug("Aborting deployment", _ERROR)
-            exit(1)
-
-        debug("Getting Looker PS content files from: {}".format(ps_repo_location), _INFO)
+            git_clone_checkout(client_properties, _GIT_REMOTE_URL.format(ps_repo), client_properties["ps_repo_branch"],
+                               _ps_repo_folder, sparse_patterns, deadline)
 
-        # debug("Only files with c_ prefix and related to defined applications will be deployed", _INFO)
-        # ps_files = [f for f in get_files(os.path.join(ps_repo_location), fpath=False) if re.search('^(c_)+', f)]
-        # debug("Files from PS repository: {}".format(ps_files), _DEBUG)
+        # Check if cloning was successful
+        if not os.path.isdir(_ps_repo_folder):
+            raise ProcessException("PS repository {} was not cloned".format(ps_repo))
+        debug("PS repository was successfully cloned into folder {}".format(_ps_repo_folder), _INFO)
 
         return ps_repo_location
 
@@ -1506,63 +1911,225 @@ def offline_ps_git_repo_clone(client_properties, client_deployment_dir):
         # End of Process PS repository branch
 
 
-def offline_oob_git_repo_clone(client_properties, client_deployment_dir):
+def offline_oob_git_repo_clone(client_properties, client_deployment_dir, deadline=None):
     """
     :param client_properties:
     :param client_deployment_dir:
+    :param deadline: time repository job has to finish by, None if job has no deadline
     :return: prod_repo_location
+    Raises:
+        ProcessException: if OOB Prod repository was not cloned
     """
 
     debug("Checking OOB Prod repository properties", _INFO)
     # Process OOB Product branch (mandatory)
     prod_repo = client_properties["prod_repo"]
 
-    # Construct git statement to clone from PROD master of branch
+    # Clone folder is repository name for master and branch name for branch
     if not client_properties["prod_repo_branch"]:
         # Clone from master
         prod_repo_location = prod_repo
-
         debug("Cloning Product OOB repository {} from master".format(prod_repo_location), _INFO)
-        clone_prod_str = "git clone git@github.com:ModelN/" + prod_repo_location + ".git --single-branch"
-        if os.path.isdir(os.path.join(client_deployment_dir, prod_repo_location)):
-            debug("Product Repository {} clone folder exists. Removing it".format(prod_repo_location), _INFO)
-            shutil.rmtree(prod_repo_location)
     else:
         # Clone from branch
-        prod_branch = client_properties["prod_repo_branch"]
-        prod_repo_location = prod_branch
+        prod_repo_location = client_properties["prod_repo_branch"]
+        debug("Cloning Product OOB repository {} from branch {}".format(prod_repo, prod_repo_location), _INFO)
 
-        debug("Cloning Product OOB repository {} from branch {}".format(prod_repo, prod_branch), _INFO)
-        clone_prod_str = "git clone -b " + prod_branch + " git@github.com:ModelN/" + prod_repo + ".git " + prod_branch + " --single-branch"
-        if os.path.isdir(os.path.join(client_deployment_dir, prod_branch)):
-            debug("Product repository {} clone exists. Removing it".format(prod_branch), _INFO)
-            shutil.rmtree(prod_branch)
-
-    debug("Cloning Product OOB repository", _INFO)
-    subprocess.run(clone_prod_str.split(), timeout=60)
-    # Check if cloning was successful
     _prod_repo_folder = os.path.join(client_deployment_dir, prod_repo_location)
-
     if os.path.isdir(_prod_repo_folder):
-        debug("Product repository was successfully cloned into folder {}".format(_prod_repo_folder), _INFO)
+        debug("Product repository {} clone exists. Removing it".format(prod_repo_location), _INFO)
+        shutil.rmtree(_prod_repo_folder)
+
+    sparse_patterns = get_sparse_checkout_patterns(client_properties) \
+        if client_properties.get("git_clone_mode", "full") == 'sparse' else None
+    if client_properties.get("git_mirror_cache", "N") == 'Y':
+        git_checkout_from_mirror(client_properties, prod_repo, client_properties["prod_repo_branch"],
+                                 _prod_repo_folder, sparse_patterns, deadline)
     else:
-        debug("Product repository {} was not cloned".format(prod_repo_location), _ERROR)
+        git_clone_checkout(client_properties, _GIT_REMOTE_URL.format(prod_repo), client_properties["prod_repo_branch"],
+                           _prod_repo_folder, sparse_patterns, deadline)
+
+    # Check if cloning was successful
+    if not os.path.isdir(_prod_repo_folder):
+        raise ProcessException("Product repository {} was not cloned".format(prod_repo_location))
+    debug("Product repository was successfully cloned into folder {}".format(_prod_repo_folder), _INFO)
+
+    return prod_repo_location
+
+def offline_ps_git_content_source(client_properties, client_deployment_dir, deadline=None):
+    """
+    Function updates local mirror of PS repository and returns content source
+    reading PS branch files directly from git objects
+    :param client_properties:
+    :param client_deployment_dir: not used, no checkout is created
+    :param deadline: time repository job has to finish by, None if job has no deadline
+    :return: GitContentSource or None if PS repository is not defined
+    """
+    if not client_properties["ps_repo"]:
+        debug("No PS repository defined. Will not process PS content", _INFO)
+        return None
+
+    ps_branch = client_properties["ps_repo_branch"]
+    mirror_dir = update_git_mirror(client_properties, client_properties["ps_repo"], deadline)
+    ps_source = GitContentSource(mirror_dir, "refs/heads/" + ps_branch if ps_branch else "HEAD",
+                                 int(client_properties.get("git_timeout", 60)))
+    debug("PS content will be read from git objects {}".format(ps_source), _INFO)
+    return ps_source
+
+def offline_oob_git_content_source(client_properties, client_deployment_dir, deadline=None):
+    """
+    Function updates local mirror of OOB Prod repository and returns content source
+    reading Prod branch files directly from git objects
+    :param client_properties:
+    :param client_deployment_dir: not used, no checkout is created
+    :param deadline: time repository job has to finish by, None if job has no deadline
+    :return: GitContentSource
+    """
+    prod_branch = client_properties["prod_repo_branch"]
+    mirror_dir = update_git_mirror(client_properties, client_properties["prod_repo"], deadline)
+    prod_source = GitContentSource(mirror_dir, "refs/heads/" + prod_branch if prod_branch else "HEAD",
+                                   int(client_properties.get("git_timeout", 60)))
+    debug("OOB Prod content will be read from git objects {}".format(prod_source), _INFO)
+    return prod_source
+
+def run_repository_job(repository_job, client_properties, client_deployment_dir):
+    """
+    Function runs repository job with deadline of git_job_timeout seconds from job start.
+    Every git command of the job is limited by git_timeout and by time remaining to the deadline.
+    :param repository_job: clone or content source function of PS or OOB Prod repository
+    :param client_properties:
+    :param client_deployment_dir:
+    :return: result of repository job
+    Raises:
+        ProcessException: if job fails or does not finish by its deadline
+    """
+    job_timeout = int(client_properties.get("git_job_timeout", 0))
+    if job_timeout <= 0:
+        return repository_job(client_properties, client_deployment_dir)
+
+    deadline = datetime.datetime.now() + datetime.timedelta(seconds=job_timeout)
+    try:
+        return repository_job(client_properties, client_deployment_dir, deadline=deadline)
+    except ProcessException as e:
+        if datetime.datetime.now() >= deadline:
+            raise ProcessException("job did not finish within git_job_timeout of {} seconds: {}".format(job_timeout, str(e)))
+        raise
+
+def offline_git_repo_acquisition(client_properties, client_deployment_dir):
+    """
+    Function clones PS and OOB Prod repositories as concurrent jobs. Each git command
+    has its own timeout (git_timeout), each job has a deadline (git_job_timeout),
+    exit status and stderr are checked by run_git_command.
+    Progress of running jobs is reported every git_progress_interval seconds.
+    With content_source git_objects no checkout is created, content is read from local mirrors.
+    :param client_properties:
+    :param client_deployment_dir:
+    :return: ps_source, prod_source
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+
+    progress_interval = int(client_properties.get("git_progress_interval", 10))
+    clone_start_dt = datetime.datetime.now()
+
+    ps_job, prod_job = offline_ps_git_repo_clone, offline_oob_git_repo_clone
+    if client_properties.get("content_source", "checkout") == 'git_objects':
+        if client_properties.get("git_mirror_cache", "N") == 'Y':
+            ps_job, prod_job = offline_ps_git_content_source, offline_oob_git_content_source
+        else:
+            debug("Content source git_objects requires git_mirror_cache. Repositories will be checked out", _WARNING)
+
+    # Clone folder is branch name or repository name. Jobs cloning into the same folder run one after another
+    max_workers = 2
+    if ps_job == offline_ps_git_repo_clone and client_properties["ps_repo"] and \
+            (client_properties["ps_repo_branch"] or client_properties["ps_repo"]) == \
+            (client_properties["prod_repo_branch"] or client_properties["prod_repo"]):
+        debug("PS and OOB Prod repositories are cloned into the same folder. Jobs will not run concurrently", _WARNING)
+        max_workers = 1
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        clone_jobs = {executor.submit(run_repository_job, ps_job, client_properties, client_deployment_dir): "PS",
+                      executor.submit(run_repository_job, prod_job, client_properties, client_deployment_dir): "OOB Prod"}
+        pending_jobs = set(clone_jobs)
+        while pending_jobs:
+            done_jobs, pending_jobs = concurrent.futures.wait(pending_jobs, timeout=progress_interval,
+                                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            elapsed = (datetime.datetime.now() - clone_start_dt).total_seconds()
+            for job in done_jobs:
+                debug("{} repository job finished after {:.1f} seconds".format(clone_jobs[job], elapsed), _INFO)
+            if pending_jobs:
+                debug("Waiting for {} repository job(s): {:.1f} seconds elapsed".format(
+                    ', '.join(clone_jobs[job] for job in pending_jobs), elapsed), _INFO)
+
+    repo_locations = dict()
+    clone_errors = list()
+    for job, repo_type in clone_jobs.items():
+        try:
+            repo_locations[repo_type] = job.result()
+        except (ProcessException, OSError) as e:
+            clone_errors.append("{} repository: {}".format(repo_type, str(e)))
+
+    if clone_errors:
+        for error in clone_errors:
+            debug("Error: {}".format(error), _ERROR)
         debug("Aborting deployment", _ERROR)
         exit(1)
 
-    return prod_repo_location
+    return get_content_source(client_deployment_dir, repo_locations["PS"]), \
+           get_content_source(client_deployment_dir, repo_locations["OOB Prod"])
+
+def get_content_source(client_deployment_dir, repo_location):
+    """
+    :param client_deployment_dir:
+    :param repo_location: repository folder relative to client deployment folder or content source
+    :return: ContentSource or None if repository location is not defined
+    """
+    if repo_location is None or isinstance(repo_location, ContentSource):
+        return repo_location
+    return DirectoryContentSource(os.path.join(client_deployment_dir, repo_location))
+
+def prepare_project_deployment_dir(client_properties, ClientID, project_name, project_deployment_dir):
+    """
+    Function creates empty Project deployment folder. Content of existing folder
+    is kept as snapshot in content store.
+    :param client_properties:
+    :param ClientID:
+    :param project_name: Looker Project name
+    :param project_deployment_dir:
+    :return:
+    """
+    if not os.path.isdir(project_deployment_dir):
+        debug("Client Project Deployment directory does not exist and will be created", _INFO)
+        os.mkdir(project_deployment_dir)
+    else:
+        debug("Client Project Deployment directory exists, will snapshot it into content store", _INFO)
+        # Previous render might have been exported into bundle only, it is not recorded as deployed
+        create_deployment_snapshot(client_properties, ClientID, project_name, project_deployment_dir, deployed=False)
+        shutil.rmtree(project_deployment_dir)
+        os.mkdir(project_deployment_dir)
+
+def is_valid_client_id(ClientID):
+    """
+    ClientID naming convention:
+        1. It cannot contain special characters and slashes
+        2. It cannot be longer than 30 characters
+    :param ClientID:
+    :return: True/False
+    """
+    return not (re.search(r'[/@#%^\\\-]+', ClientID) or (len(ClientID) > 30))
 
 # Function performs offline (no customer github repo) Looker project deployment
 def offline_deployment(client_properties,
                        client_deployment_dir,
                        ClientID,
-                       db_connection_name
+                       db_connection_name,
+                       bundle_file=None
                       ):
     """
     :param - client properties
     :param - client_deployment_dir
     :param - ClientID
     :param - database connection name
+    :param - bundle_file: if defined, rendered content is exported into deployment bundle instead of publishing it
     :return:
     """
     debug("Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
@@ -1578,31 +2145,157 @@ def offline_deployment(client_properties,
     # Check if multi tenant deployment is selected
     if client_properties["single_tenant_deployment"] =='Y':
         debug("Single Tenant deployment is selected.", _INFO)
-        LOOKER_PROJECT_NAME = client_properties["project_name"]
     else:
         debug("Multi Tenant deployment is selected", _INFO)
         debug("Project, Connections and Models will be renamed", _INFO)
-        LOOKER_PROJECT_NAME = ClientID
+    LOOKER_PROJECT_NAME = get_looker_project_name(client_properties, ClientID)
 
     CONTENT_TARGET_DIR = os.path.join(client_properties["looker_location"], LOOKER_PROJECT_NAME)
 
     CLIENT_PROJECT_DEPLOYMENT_DIR = os.path.join(client_deployment_dir, LOOKER_PROJECT_NAME)
     debug("Looker Project Name {}".format(LOOKER_PROJECT_NAME), _INFO)
 
-    if not os.path.isdir(CLIENT_PROJECT_DEPLOYMENT_DIR):
-        debug("Client Project Deployment directory does not exist and will be created", _INFO)
-        os.mkdir(CLIENT_PROJECT_DEPLOYMENT_DIR)
-    else:
-        debug("Client Project Deployment directory exists, will back it up", _INFO)
-        backup_proj_deployemnt_dir = os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR + get_date_timestamp())
-        shutil.move(CLIENT_PROJECT_DEPLOYMENT_DIR, backup_proj_deployemnt_dir)
-        os.mkdir(CLIENT_PROJECT_DEPLOYMENT_DIR)
+    with deployment_stage("prepare_deployment_dir"):
+        prepare_project_deployment_dir(client_properties, ClientID, LOOKER_PROJECT_NAME, CLIENT_PROJECT_DEPLOYMENT_DIR)
+
+    # Reuse previous render of the same inputs without cloning and transforming content
+    render_context = None
+    render_cache = client_properties.get("render_cache", "N") == 'Y'
+    if render_cache:
+        with deployment_stage("render_cache_lookup"):
+            try:
+                ps_revision, prod_revision = get_offline_content_revisions(client_properties, client_deployment_dir)
+                if client_properties.get("prod_repo_local_dir"):
+                    replacement_tokens_hashes = get_replacement_tokens_hashes(
+                        client_properties, get_content_source(client_deployment_dir, client_properties.get("ps_repo_local_dir")),
+                        get_content_source(client_deployment_dir, client_properties["prod_repo_local_dir"]))
+                else:
+                    replacement_tokens_hashes = get_replacement_tokens_hashes(client_properties, None, None)
+                render_cache_key = get_render_cache_key(client_properties, ps_revision, prod_revision,
+                                                        replacement_tokens_hashes, ClientID, db_connection_name)
+                if render_cache_key is not None:
+                    render_context = restore_render_cache(client_properties, render_cache_key, CLIENT_PROJECT_DEPLOYMENT_DIR)
+            except (ProcessException, OSError, ValueError) as e:
+                debug("Render cache lookup failed, content will be rendered: {}".format(str(e)), _WARNING)
+
+    if render_context is None:
 
 #***** Process PS and OOB repositories section.
 
-    # Initialize placeholder for PS and OOB content files. PS content files does not have to exist.
-    prod_files = list()
+        with deployment_stage("acquire_content"):
+            ps_source, prod_source = get_offline_content_sources(client_properties, client_deployment_dir)
+            replacement_tokens = get_replacement_tokens(client_properties, ps_source, prod_source)
+
+#***** End of Process PS and OOB repositories section.
+
+        debug("*********************************************************************")
+        debug("***** Rendering Looker content", _INFO)
+        try:
+            with deployment_stage("render_content"):
+                render_context = render_content(client_properties, ps_source, prod_source, replacement_tokens,
+                                                ClientID, db_connection_name, CLIENT_PROJECT_DEPLOYMENT_DIR)
+            if render_cache:
+                with deployment_stage("render_cache_store"):
+                    # Cache entry is keyed by revisions actually rendered, branches may have moved since lookup
+                    render_cache_key = get_render_cache_key(client_properties,
+                                                            get_content_source_revision(ps_source),
+                                                            get_content_source_revision(prod_source),
+                                                            get_replacement_tokens_hashes(client_properties, ps_source, prod_source),
+                                                            ClientID, db_connection_name)
+                    if render_cache_key is not None:
+                        store_render_cache(client_properties, render_cache_key, render_context, CLIENT_PROJECT_DEPLOYMENT_DIR)
+        except (ProcessException, OSError, UnicodeDecodeError) as e:
+            debug("Unable to render Looker content into folder {}".format(CLIENT_PROJECT_DEPLOYMENT_DIR), _ERROR)
+            debug("Error: {}".format(str(e)), _ERROR)
+            debug("Traceback: {}".format(traceback.format_exc()))
+            exit(1)
+        finally:
+            for content_source in (ps_source, prod_source):
+                if content_source is not None:
+                    content_source.close()
+
+    ps_files = render_context["ps_files"]
+    app_tokens = render_context["app_tokens"]
+
+    debug("*********************************************************************")
+
+    debug("Ready to propagate content to Looker server", _INFO)
+
+    if bundle_file is not None:
+        # Bundle is installed on Looker nodes with -deployment_flag install_bundle
+        with deployment_stage("export_bundle"):
+            export_bundle(client_properties, ClientID, CLIENT_PROJECT_DEPLOYMENT_DIR, bundle_file, render_context)
+    else:
+        debug("Copying content into folder {}".format(CONTENT_TARGET_DIR), _INFO)
+
+        # Copy prepared content under Looker models folder.
+        with deployment_stage("publish_content"):
+            content_published = publish_content_targets(client_properties, CLIENT_PROJECT_DEPLOYMENT_DIR, LOOKER_PROJECT_NAME)
+        if not content_published:
+            debug("Content was not published into folder {}".format(CONTENT_TARGET_DIR), _ERROR)
+            debug("Aborting deployment", _ERROR)
+            exit(1)
+
+    # Keep deployed content in content store for rollback. Exported bundle is not deployed on this host
+    with deployment_stage("snapshot_content"):
+        snapshot_id = create_deployment_snapshot(client_properties, ClientID, LOOKER_PROJECT_NAME, CLIENT_PROJECT_DEPLOYMENT_DIR,
+                                                 deployed=bundle_file is None)
+        apply_snapshot_retention(client_properties, ClientID, LOOKER_PROJECT_NAME)
+
+    _DEPLOYED_CONTENT.update(client_id=ClientID,
+                             snapshot_id=snapshot_id,
+                             content_files=render_context["content_files"],
+                             content_sources=render_context["content_sources"])
+
+    # We need to compare provided PS content with that of deployed.
+    debug("*********************************************************************")
+    if ps_files:
+        debug("PS content was provided, will perform content check", _INFO)
+        debug("Comparing provided PS content vs. deployed PS content", _INFO)
+        debug("PS Model Files will be checked", _INFO)
+        debug("Application tokens processed: \n\t{}".format('\n\t'.join(app_tokens)), _INFO)
+        debug("Checking PS Model files", _INFO)
+
+        ps_models_repo = [f for f in ps_files if re.search('^(c_)\S+model[.]lkml', f)]
+        #ps_models_repo = [f for f in ps_files if re.search('^(c_)\S+model[.]lkml', f)]
+        debug("PS Repository Model Files list: \n\t{}".format('\n\t'.join(ps_models_repo)), _INFO)
+
+        # Retrieve PS deployed content
+        #ps_models = [f for f in ps_files if re.search('^(c_\S*{0})\S+model[.]lkml'.format([tk for tk in app_tokens]), f)]
+        ps_models_deployed = [f for f in get_files(os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR), fpath=False) if re.search('^(c_)\S+model[.]lkml', f)]
+        debug("PS Deployed Model Files list: \n\t{}".format('\n\t'.join(ps_models_deployed)), _INFO)
 
+        # Compare Provided and Deployed Model files and compile a report
+        ps_models_not_deployed = set(ps_models_repo).difference(ps_models_deployed)
+        if ps_models_not_deployed:
+            debug("Some PS Model files were not deployed", _WARNING)
+            debug("Not deployed PS Model files: \n\t{}".format('\n\t'.join(ps_models_not_deployed)), _WARNING)
+            debug("Possible reasons: \n\
+                  1. PS Model file name is missing application token.\n\
+                  2. PS Model File name does not comply with Model File naming convention: \n\
+                      \tc_<zero or more characters><APPLICATION_TOKEN><zero or more characters>.model.lkml", _WARNING)
+            debug("Check PS Model file names", _WARNING)
+        else:
+            debug("All PS Model Files were deployed", _INFO)
+            debug("***** Looker offline project {} deployment completed successfully".format(LOOKER_PROJECT_NAME),
+                  _INFO)
+
+        debug("*********************************************************************")
+    else:
+        # Generate deployment summary.
+        if deployment_summary(client_properties, CLIENT_PROJECT_DEPLOYMENT_DIR):
+            debug("***** Looker offline project {} deployment completed successfully".format(LOOKER_PROJECT_NAME), _INFO)
+        else:
+            debug("***** Not all content was deployed. Check your deployment", _WARNING)
+
+def get_offline_content_sources(client_properties, client_deployment_dir):
+    """
+    Function returns content sources for COPS pre-cloned folders if defined,
+    otherwise PS and OOB Prod repositories are acquired by deployment app.
+    :param client_properties:
+    :param client_deployment_dir:
+    :return: ps_source (None if there is no PS content), prod_source
+    """
     # Check if COPS specific parameters are present in properties file
     debug("Checking if COPS specific parameters are present in deployment properties file", _INFO)
     if 'prod_repo_local_dir' in client_properties:
@@ -1615,685 +2308,2762 @@ def offline_deployment(client_properties,
             ps_repo_local = client_properties["ps_repo_local_dir"]
         else:
             debug(" COPS specific parameter ps_repo_local_dir is NOT present in client properties file", _INFO)
+            ps_repo_local = None
 
         # Process COPS pre-cloned folders - if defined, take the highest priority
         if prod_repo_local:
             debug("COPS pre-cloned Looker OOB Prod content exists", _INFO)
             debug(" Only COPS pre-cloned content will be processed", _INFO)
-            prod_repo_location = prod_repo_local
-            debug("COPS pre-cloned OOB Prod location: {}".format(prod_repo_location), _INFO)
+            prod_source = get_content_source(client_deployment_dir, prod_repo_local)
+            debug("COPS pre-cloned OOB Prod location: {}".format(prod_source), _INFO)
 
             if ps_repo_local:
                 debug("COPS pre-cloned Looker PS content exists")
-                ps_repo_location = ps_repo_local
-                debug(" COPS pre-cloned PS location {}".format(ps_repo_location), _INFO)
+                ps_source = get_content_source(client_deployment_dir, ps_repo_local)
+                debug(" COPS pre-cloned PS location {}".format(ps_source), _INFO)
 
             else:
                 debug(" COPS pre-cloned Looker PS content does not exist", _INFO)
-                ps_repo_location = None
+                ps_source = None
 
         else:
 
             debug("COPS pre-cloned content DOES NOT exist", _INFO)
             debug("Repositories will be cloned by deployment app", _INFO)
 
-            # Process PS repository branch. It is optional.
-            ps_repo_location = offline_ps_git_repo_clone(client_properties, client_deployment_dir)
-
-            prod_repo_location = offline_oob_git_repo_clone(client_properties, client_deployment_dir)
+            # PS repository is optional. Both repositories are cloned concurrently
+            ps_source, prod_source = offline_git_repo_acquisition(client_properties, client_deployment_dir)
 
     else:
         debug(" COPS specific parameter prod_repo_local_dir is NOT present in client properties file")
         debug(" Repositories will be cloned by deployment app", _INFO)
 
-        ps_repo_location = offline_ps_git_repo_clone(client_properties, client_deployment_dir)
-        prod_repo_location = offline_oob_git_repo_clone(client_properties, client_deployment_dir)
+        ps_source, prod_source = offline_git_repo_acquisition(client_properties, client_deployment_dir)
+
+    return ps_source, prod_source
+
+def get_offline_content_revisions(client_properties, client_deployment_dir):
+    """
+    Function resolves commits of PS and OOB Prod content without cloning repositories:
+    COPS pre-cloned folders are resolved locally, repository branches with git ls-remote.
+    :param client_properties:
+    :param client_deployment_dir:
+    :return: ps_revision ('' if there is no PS content), prod_revision. None if revision cannot be resolved
+    Raises:
+        ProcessException: if git ls-remote fails
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+
+    if client_properties.get("prod_repo_local_dir"):
+        ps_repo_local = client_properties.get("ps_repo_local_dir")
+        ps_revision = get_directory_revision(os.path.join(client_deployment_dir, ps_repo_local)) if ps_repo_local else ''
+        prod_revision = get_directory_revision(os.path.join(client_deployment_dir, client_properties["prod_repo_local_dir"]))
+    else:
+        ps_revision = get_remote_revision(client_properties, client_properties["ps_repo"],
+                                          client_properties["ps_repo_branch"]) if client_properties["ps_repo"] else ''
+        prod_revision = get_remote_revision(client_properties, client_properties["prod_repo"],
+                                            client_properties["prod_repo_branch"])
+
+    debug("Content revisions: PS {}, OOB Prod {}".format(ps_revision, prod_revision), _INFO)
+    return ps_revision, prod_revision
+
+def get_remote_revision(client_properties, repo, branch):
+    """
+    :param client_properties:
+    :param repo: GitHub repository name
+    :param branch: branch name, default branch if not defined
+    :return: commit of the branch on GitHub
+    Raises:
+        ProcessException: if git ls-remote fails or branch does not exist
+    """
+    ref = "refs/heads/" + branch if branch else "HEAD"
+    remote_refs = run_git_command(["ls-remote", _GIT_REMOTE_URL.format(repo), ref],
+                                  timeout=int(client_properties.get("git_timeout", 60)))
+    for remote_ref in remote_refs.splitlines():
+        commit, ref_name = remote_ref.split('\t', 1)
+        if ref_name == ref:
+            return commit
+    raise ProcessException("Reference {} does not exist in repository {}".format(ref, repo))
+
+def get_directory_revision(directory):
+    """
+    :param directory: checkout or COPS pre-cloned folder
+    :return: HEAD commit of clean git working tree, None if folder is not a git working tree or has local changes
+    """
+    try:
+        if run_git_command(["status", "--porcelain"], cwd=directory).strip():
+            debug("Folder {} has local changes".format(directory), _DEBUG)
+            return None
+        return run_git_command(["rev-parse", "HEAD"], cwd=directory).strip()
+    except (ProcessException, OSError):
+        debug("Folder {} is not a git working tree".format(directory), _DEBUG)
+        return None
+
+def get_content_source_revision(content_source):
+    """
+    :param content_source: ContentSource or None
+    :return: commit content source was read from ('' if there is no content source), None if it cannot be resolved
+    """
+    if content_source is None:
+        return ''
+    elif isinstance(content_source, GitContentSource):
+        return content_source.commit
+    elif isinstance(content_source, DirectoryContentSource):
+        return get_directory_revision(content_source.directory)
+    return None
 
+def get_content_source_info(content_source):
+    """
+    :param content_source: ContentSource
+    :return: dictionary with location and commit of content source, commit is None if it cannot be resolved
+    """
+    location = content_source.git_dir if isinstance(content_source, GitContentSource) else str(content_source)
+    return {"location": location, "commit": get_content_source_revision(content_source)}
 
-    # Collect OOB and PS content section
-    # 1. Collect optional PS content
+def get_replacement_tokens(client_properties, ps_source, prod_source):
+    """
+    Function reads replacement tokens file from PS and OOB Prod content.
+    PS tokens take priority over OOB tokens.
+    :param client_properties:
+    :param ps_source: PS ContentSource or None
+    :param prod_source: OOB Prod ContentSource
+    :return: replacement tokens configuration or None if no tokens file exists
+    """
     replacement_tokens_file_name = client_properties["replacement_tokens_file_name"]
     # initialize placeholders for OOB and PS replacement tokens content
     _ps_replacement_tokens = dict()
     _oob_replacement_tokens = dict()
 
-    if ps_repo_location is not None:
-        debug("Only files with c_ prefix and *.json files will be deployed", _INFO)
-        # Include the following files:
-        # 1. All files starting with c_
-        # 2. All files which have extension .json
-        # 3. All Model files containing token "map". Need to re-evaluate this
-        #ps_files = [f for f in get_files(os.path.join(ps_repo_location), fpath=False) if re.search('(^(c_).+|\S+.json|\S+map\S+model[.]lkml)', f)]
-        match_ps_content = re.compile(r'(^(c_).+|\S+.json|\S+map\S+model[.]lkml)')
-        ps_files = [f for f in get_files(os.path.join(ps_repo_location), fpath=False) if match_ps_content.search(f)]
-
-        debug("Files from PS repository:\n{}".format('\n'.join(ps_files)), _DEBUG)
-
+    if ps_source is not None:
         # Need to check if custom tokens were defined for replacement
-        ps_replacement_tokens_file = os.path.join(client_deployment_dir, ps_repo_location+'/'+replacement_tokens_file_name)
-
-        if os.path.isfile(ps_replacement_tokens_file):
-            debug("Found PS tokens file: {}. Will use it for Custom tokens replacement".format(ps_replacement_tokens_file), _INFO)
-            # open file for reading
-            ps_replacement_tokens_file_fh = open(ps_replacement_tokens_file, 'r')
+        if ps_source.has_file(replacement_tokens_file_name):
+            debug("Found PS tokens file: {} in {}. Will use it for Custom tokens replacement".format(replacement_tokens_file_name, ps_source), _INFO)
+            ps_replacement_tokens_file_fh = io.StringIO(ps_source.read_file(replacement_tokens_file_name).decode('utf-8'))
             _ps_replacement_tokens = get_json_prop(ps_replacement_tokens_file_fh)
         else:
             debug("No PS replacement tokens file {}. Will use OOB config for tokens replacement".format(replacement_tokens_file_name), _INFO)
 
-    else:
-        debug("There is no PS Looker content files", _INFO)
-        # Initialise empty list to avoid more complex checks later in the code.
-        # Empty ps_files list means there is no PS content to deploy
-        ps_files = list()
-
-    # 2. Collect all OOB Product content
-    debug("Getting OOB Looker content files from: {}".format(prod_repo_location), _INFO)
-    prod_files = get_files(os.path.join(prod_repo_location), fpath=False)
-
-    oob_replacement_tokens_file = os.path.join(client_deployment_dir, prod_repo_location+'/'+replacement_tokens_file_name)
-    if os.path.isfile(oob_replacement_tokens_file):
-        debug("Found OOB tokens file: {}. Will use it for Custom tokens replacement".format(oob_replacement_tokens_file), _INFO)
-        oob_replacement_tokens_file_fh = open(oob_replacement_tokens_file, 'r')
+    if prod_source.has_file(replacement_tokens_file_name):
+        debug("Found OOB tokens file: {} in {}. Will use it for Custom tokens replacement".format(replacement_tokens_file_name, prod_source), _INFO)
+        oob_replacement_tokens_file_fh = io.StringIO(prod_source.read_file(replacement_tokens_file_name).decode('utf-8'))
         _oob_replacement_tokens = get_json_prop(oob_replacement_tokens_file_fh)
     else:
         debug("No OOB replacement tokens file {}. Token replacement will not be performed".format(replacement_tokens_file_name), _INFO)
 
-    # Combine PS and OOB content into a single object for unified processing
-    all_content_files = ps_files + prod_files
-    #uncomment for debugging
-    #debug("Combined content files: {}\n".format(all_content_files), _DEBUG)
-
-#***** End of Process PS and OOB repositories section.
-
+    if _ps_replacement_tokens:
+        debug("Looker content will be customized with PS tokens", _INFO)
+        return _ps_replacement_tokens
+    elif _oob_replacement_tokens:
+        debug("Looker content will be customized with OOB tokens", _INFO)
+        return _oob_replacement_tokens
+    else:
+        debug("Product {} does not require content replacement, no OOB/PS tokens".format(client_properties["product_prefix"]), _INFO)
+        return None
+
+def render_content(client_properties, ps_source, prod_source, replacement_tokens, ClientID, db_connection_name,
+                   client_project_deployment_dir):
+    """
+    Render pipeline: discover -> select -> prune -> transform -> write.
+    Every file is read once from content source, transformed in memory
+    and written once into Project deployment folder.
+    :param client_properties:
+    :param ps_source: PS ContentSource or None
+    :param prod_source: OOB Prod ContentSource
+    :param replacement_tokens: replacement tokens configuration or None
+    :param ClientID:
+    :param db_connection_name:
+    :param client_project_deployment_dir:
+    :return: render context
+    Raises:
+        ProcessException: if content cannot be selected or transformed
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+
+    render_context = plan_render(client_properties, ps_source, prod_source, replacement_tokens, ClientID,
+                                 db_connection_name, client_project_deployment_dir)
+    # Link output mode shares identical rendered files of all tenants through content store
+    content_store_dir = get_content_store_dir(client_properties) \
+        if client_properties.get("output_mode", "copy") == 'link' else None
+    lookml_trees = get_lookml_tree_cache(client_properties) \
+        if client_properties.get("lookml_transforms", "line") == 'parsed' else None
+    with deployment_stage("transform_write_content"):
+        write_content(transform_content(render_context["render_plan"].values(), lookml_trees),
+                      client_project_deployment_dir, content_store_dir)
+
+    # Origin of every rendered file is kept for build manifest
+    render_context["content_files"] = get_content_files_origin(render_context["render_plan"])
+    render_context["content_sources"] = dict()
+    for content_record in render_context["render_plan"].values():
+        if content_record["origin"] not in render_context["content_sources"]:
+            render_context["content_sources"][content_record["origin"]] = get_content_source_info(content_record["source"])
+
+    debug("Content is rendered into folder {}".format(client_project_deployment_dir), _INFO)
+    return render_context
+
+def plan_render(client_properties, ps_source, prod_source, replacement_tokens, ClientID, db_connection_name,
+                client_project_deployment_dir):
+    """
+    Discover, select and prune stages of render pipeline with transforms assigned to selected files.
+    No content file is written.
+    :param client_properties:
+    :param ps_source: PS ContentSource or None
+    :param prod_source: OOB Prod ContentSource
+    :param replacement_tokens: replacement tokens configuration or None
+    :param ClientID:
+    :param db_connection_name:
+    :param client_project_deployment_dir:
+    :return: render context
+    Raises:
+        ProcessException: if content cannot be selected
+    """
+    token_transforms = match_replace_token(client_properties, replacement_tokens) if replacement_tokens else list()
+
     debug("Getting Models for initial Model files processing", _INFO)
-    app_models = get_application_models(client_properties, CLIENT_PROJECT_DEPLOYMENT_DIR)
+    app_models = get_application_models(client_properties, client_project_deployment_dir)
+
+    with deployment_stage("select_content"):
+        render_context = select_content(client_properties, discover_content(ps_source, prod_source), app_models, ClientID)
+    if client_properties.get("prune_unreachable_content", "N") == 'Y':
+        with deployment_stage("prune_content"):
+            # Report is kept next to Project deployment folder, it is not published
+            prune_content(render_context, get_lookml_tree_cache(client_properties),
+                          client_project_deployment_dir.rstrip(os.sep) + '_prune_report.json')
+    assign_content_transforms(client_properties, render_context, ClientID, db_connection_name, token_transforms)
+    if client_properties.get("viz_build", "N") == 'Y':
+        plan_viz_build(client_properties, render_context)
+    if client_properties.get("topojson_build", "N") == 'Y':
+        plan_topojson_build(client_properties, render_context)
+    return render_context
+
+def get_content_files_origin(render_plan):
+    """
+    :param render_plan:
+    :return: dictionary deployed file name: origin, source file name and names of applied transforms
+    """
+    return {content_record["name"]: {"origin": content_record["origin"],
+                                     "source_name": content_record["source_name"],
+                                     "transforms": [transform_name for transform_name, line_transform, node_transform
+                                                    in content_record["transforms"]]}
+            for content_record in render_plan.values()}
+
+def get_render_cache_dir(client_properties):
+    """
+    :param client_properties:
+    :return: folder holding render cache manifests in content store
+    """
+    return os.path.join(get_content_store_dir(client_properties), "render_cache")
+
+def get_replacement_tokens_hashes(client_properties, ps_source, prod_source):
+    """
+    Replacement tokens file of COPS pre-cloned folder may be untracked or ignored by git,
+    so it is not covered by folder revision. Tokens file read from git objects is covered by commit.
+    :param client_properties:
+    :param ps_source: PS ContentSource or None
+    :param prod_source: OOB Prod ContentSource or None
+    :return: [PS hash, OOB Prod hash] of replacement tokens files in folders, None if there is no such file
+    """
+    replacement_tokens_file_name = client_properties["replacement_tokens_file_name"]
+    replacement_tokens_hashes = list()
+    for content_source in (ps_source, prod_source):
+        if isinstance(content_source, DirectoryContentSource) and content_source.has_file(replacement_tokens_file_name):
+            replacement_tokens_hashes.append(get_file_hash(os.path.join(content_source.directory, replacement_tokens_file_name)))
+        else:
+            replacement_tokens_hashes.append(None)
+    return replacement_tokens_hashes
+
+def get_render_cache_key(client_properties, ps_revision, prod_revision, replacement_tokens_hashes, ClientID, db_connection_name):
+    """
+    Render cache key covers all inputs of rendered content. Replacement tokens map is read
+    from PS or OOB Prod content, it is covered by content revisions and by hashes of tokens files
+    in folders. Visualization extensions from central d3 folder are not versioned, they are covered
+    by hashes of their content.
+    :param client_properties:
+    :param ps_revision: PS commit, '' if there is no PS content
+    :param prod_revision: OOB Prod commit
+    :param replacement_tokens_hashes: result of get_replacement_tokens_hashes
+    :param ClientID:
+    :param db_connection_name:
+    :return: cache key or None if content revisions are not known
+    """
+    if ps_revision is None or prod_revision is None:
+        debug("Content revisions are not known, render cache is not used", _WARNING)
+        return None
+
+    d3_files_hashes = dict()
+    d3_files_dir = get_d3_files_dir(client_properties)
+    if d3_files_dir is not None and os.path.isdir(d3_files_dir):
+        for fi in sorted(get_files(d3_files_dir, fpath=False)):
+            d3_files_hashes[fi] = get_file_hash(os.path.join(d3_files_dir, fi))
+    visual_ext_files = client_properties[client_properties["product_prefix"]].get("visual_ext_files")
+
+    render_inputs = {"render_cache_version": _RENDER_CACHE_VERSION,
+                     "deployment_app_hash": get_file_hash(os.path.abspath(__file__)),
+                     # Transforms are implemented in helper modules as well
+                     "helper_module_hashes": {module.__name__: get_file_hash(os.path.abspath(module.__file__))
+                                              for module in (looker_lookml, looker_viz, looker_topojson)},
+                     "d3_files_hashes": d3_files_hashes,
+                     "visual_ext_files": sorted(visual_ext_files) if visual_ext_files is not None else None,
+                     "ps_revision": ps_revision,
+                     "prod_revision": prod_revision,
+                     "product_prefix": client_properties["product_prefix"],
+                     "app_models": sorted(get_application_models(client_properties, None)),
+                     "views_prefixes": get_product_view_prefix(client_properties),
+                     "single_tenant_deployment": client_properties["single_tenant_deployment"],
+                     "ClientID": ClientID,
+                     "db_connection_name": db_connection_name,
+                     "hide_oob_explores": client_properties.get("hide_oob_explores"),
+                     "existing_model_deployment_id": client_properties.get("existing_model_deployment_id"),
+                     "replacement_tokens_file_name": client_properties["replacement_tokens_file_name"],
+                     "replacement_tokens_hashes": replacement_tokens_hashes,
+                     "token_indicator": client_properties["token_indicator"],
+                     "lookml_transforms": client_properties.get("lookml_transforms", "line"),
+                     "prune_unreachable_content": client_properties.get("prune_unreachable_content", "N"),
+                     "viz_build": [client_properties.get("viz_build", "N"), looker_viz._VIZ_BUILD_VERSION,
+                                   client_properties.get("viz_build_hash_names", "N"),
+                                   looker_viz.get_viz_encodings(client_properties.get("viz_build_encodings", list()))],
+                     "topojson_build": [client_properties.get("topojson_build", "N"),
+                                        looker_topojson._TOPOJSON_SIMPLIFY_VERSION,
+                                        client_properties.get("topojson_quantization"),
+                                        client_properties.get("topojson_simplify_tolerance")]}
+    render_cache_key = hashlib.sha256(json.dumps(render_inputs, sort_keys=True).encode('utf-8')).hexdigest()
+    debug("Render cache key {} for inputs: {}".format(render_cache_key, render_inputs), _DEBUG)
+    return render_cache_key
+
+def restore_render_cache(client_properties, render_cache_key, project_deployment_dir):
+    """
+    Function re-materializes cached render into Project deployment folder using hardlinks.
+    :param client_properties:
+    :param render_cache_key:
+    :param project_deployment_dir: empty Project deployment folder
+    :return: render context of cached render, None if there is no cache entry
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+
+    render_cache_file = os.path.join(get_render_cache_dir(client_properties), render_cache_key + '.json')
+    if not os.path.isfile(render_cache_file):
+        debug("Render cache miss for key {}".format(render_cache_key), _INFO)
+        return None
+
+    with open(render_cache_file, 'r') as rfh:
+        render_cache_entry = json.load(rfh)
+
+    content_store_dir = get_content_store_dir(client_properties)
+    for fi, file_attr in render_cache_entry["files"].items():
+        link_content_object(content_store_dir, file_attr["hash"], os.path.join(project_deployment_dir, fi))
+        add_stage_files()
+    # Entry modification time orders entries for retention
+    os.utime(render_cache_file)
+
+    debug("Render cache hit for key {}: restored {} files rendered at {}".format(
+        render_cache_key, len(render_cache_entry["files"]), render_cache_entry["created_at"]), _INFO)
+    return render_cache_entry["render_context"]
+
+def store_render_cache(client_properties, render_cache_key, render_context, project_deployment_dir):
+    """
+    Function stores rendered Project deployment folder in content store and writes render cache manifest.
+    :param client_properties:
+    :param render_cache_key:
+    :param render_context: render context, only values used after render are kept
+    :param project_deployment_dir:
+    :return:
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+
+    content_store_dir = get_content_store_dir(client_properties)
+    render_cache_dir = get_render_cache_dir(client_properties)
+    os.makedirs(render_cache_dir, exist_ok=True)
+
+    render_cache_files = dict()
+    for fi in get_files(project_deployment_dir, fpath=False):
+        file_name = os.path.join(project_deployment_dir, fi)
+        render_cache_files[fi] = {"hash": store_content_object(content_store_dir, file_name),
+                                  "size": os.path.getsize(file_name)}
+
+    render_cache_entry = {"render_cache_key": render_cache_key,
+                          "created_at": get_date_timestamp(current_time=True),
+                          "render_context": {"ps_files": render_context["ps_files"],
+                                             "app_tokens": render_context["app_tokens"],
+                                             "content_files": render_context["content_files"],
+                                             "content_sources": render_context["content_sources"]},
+                          "files": render_cache_files}
+    render_cache_file = os.path.join(render_cache_dir, render_cache_key + '.json')
+    temp_file = render_cache_file + '.tmp{}'.format(os.getpid())
+    with open(temp_file, 'w') as rfh:
+        json.dump(render_cache_entry, rfh, indent=3, sort_keys=True)
+    os.replace(temp_file, render_cache_file)
+    debug("Stored render of {} files in render cache with key {}".format(len(render_cache_files), render_cache_key), _INFO)
+
+    apply_render_cache_retention(client_properties)
+
+def apply_render_cache_retention(client_properties):
+    """
+    Function removes least recently used render cache entries above render_cache_max_entries.
+    :param client_properties:
+    :return:
+    """
+    render_cache_dir = get_render_cache_dir(client_properties)
+    max_entries = int(client_properties.get("render_cache_max_entries", 50))
+
+    render_cache_files = sorted([os.path.join(render_cache_dir, f) for f in get_files(render_cache_dir, fpath=False)
+                                 if f.endswith('.json')], key=os.path.getmtime)
+    expired_entries = render_cache_files[:-max(max_entries, 1)]
+    for fi in expired_entries:
+        debug("Removing render cache entry {}".format(os.path.basename(fi)), _INFO)
+        os.remove(fi)
+
+    if expired_entries:
+        collect_content_store_garbage(client_properties)
+
+# Parsed LookML trees shared by all renders of the process
+_LOOKML_TREE_CACHES = dict()
+
+def get_lookml_tree_cache(client_properties):
+    """
+    :param client_properties:
+    :return: LookmlTreeCache storing parsed trees in content store
+    """
+    lookml_trees_dir = os.path.join(get_content_store_dir(client_properties), "lookml_trees")
+    if lookml_trees_dir not in _LOOKML_TREE_CACHES:
+        _LOOKML_TREE_CACHES[lookml_trees_dir] = looker_lookml.LookmlTreeCache(lookml_trees_dir)
+    return _LOOKML_TREE_CACHES[lookml_trees_dir]
+
+# Simplified topologies shared by all renders of the process
+_TOPOLOGY_CACHES = dict()
+
+def get_topology_cache(client_properties):
+    """
+    :param client_properties:
+    :return: TopologyCache storing simplified topologies in content store
+    """
+    topologies_dir = os.path.join(get_content_store_dir(client_properties), "topojson")
+    if topologies_dir not in _TOPOLOGY_CACHES:
+        _TOPOLOGY_CACHES[topologies_dir] = looker_topojson.TopologyCache(topologies_dir)
+    return _TOPOLOGY_CACHES[topologies_dir]
+
+# Product content shared by batch render worker processes
+_BATCH_RENDER_CONTENT = None
+
+def batch_render(client_properties, batch_deployment_dir, tenant_manifest):
+    """
+    Function renders the same product for all tenants defined in tenant manifest.
+    Product content is acquired, loaded and classified once, tenant variants are
+    rendered in parallel worker processes into their own Project deployment folders.
+    Tenant manifest format:
+        {"tenants": [{"client_id": "acme",
+                      "properties": {<client properties overrides>},
+                      "db_connection_name": "<optional connection name>",
+                      "replace_token_map": {<optional replacement tokens overrides>}}]}
+    :param client_properties:
+    :param batch_deployment_dir: folder repositories are acquired into
+    :param tenant_manifest: tenant manifest dictionary
+    :return: True if all tenants were rendered, False otherwise
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+
+    tenants = tenant_manifest.get("tenants", list())
+    if not tenants:
+        debug("Tenant manifest does not define any tenants", _ERROR)
+        return False
+
+    tenant_ids = [str(tenant.get("client_id", "")).lower() for tenant in tenants]
+    invalid_ids = [tid for tid in tenant_ids if not tid or not is_valid_client_id(tid)]
+    if invalid_ids:
+        debug("Tenant manifest contains invalid ClientIDs: {}".format(invalid_ids), _ERROR)
+        return False
+    if len(set(tenant_ids)) != len(tenant_ids):
+        debug("Tenant manifest contains duplicate ClientIDs", _ERROR)
+        return False
+
+    # Product content is acquired and loaded into memory once for all tenants
+    ps_source, prod_source = get_offline_content_sources(client_properties, batch_deployment_dir)
+    try:
+        replacement_tokens = get_replacement_tokens(client_properties, ps_source, prod_source)
+        batch_content = (MemoryContentSource.load(ps_source) if ps_source is not None else None,
+                         MemoryContentSource.load(prod_source))
+    except (ProcessException, OSError) as e:
+        debug("Unable to load product content", _ERROR)
+        debug("Error: {}".format(str(e)), _ERROR)
+        return False
+    finally:
+        for content_source in (ps_source, prod_source):
+            if content_source is not None:
+                content_source.close()
+    debug("Loaded {} product content files".format(sum(len(c.files) for c in batch_content if c is not None)), _INFO)
+
+    deployment_base = os.path.expanduser(client_properties["looker_deployment_base"])
+    render_jobs = list()
+    for tenant, ClientID in zip(tenants, tenant_ids):
+        tenant_properties = {**client_properties, **tenant.get("properties", dict())}
+        db_connection_name = tenant.get("db_connection_name") or get_db_connection_name(tenant_properties, ClientID)
+        tenant_tokens = get_tenant_replacement_tokens(tenant_properties, replacement_tokens, tenant.get("replace_token_map"))
+        render_jobs.append((tenant_properties, ClientID, db_connection_name, tenant_tokens,
+                            os.path.join(deployment_base, ClientID)))
+
+    batch_workers = int(client_properties.get("batch_render_workers", 0)) or os.cpu_count() or 1
+    batch_workers = min(batch_workers, len(render_jobs))
+    debug("Rendering {} tenants with {} worker processes".format(len(render_jobs), batch_workers), _INFO)
+
+    render_results = list()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=batch_workers, initializer=init_batch_render_worker,
+                                                initargs=(batch_content, build_start_dt)) as executor:
+        render_futures = {executor.submit(render_tenant, *render_job): render_job[1] for render_job in render_jobs}
+        for render_future in concurrent.futures.as_completed(render_futures):
+            try:
+                render_result = render_future.result()
+            except Exception as e:
+                render_result = {"client_id": render_futures[render_future], "status": "failed", "error": str(e)}
+            if render_result["status"] == 'failed':
+                debug("Tenant {} failed: {}".format(render_result["client_id"], render_result["error"]), _ERROR)
+            else:
+                debug("Tenant {} {}: {} files in {}".format(render_result["client_id"], render_result["status"],
+                                                          render_result["files"], render_result["folder"]), _INFO)
+            render_results.append(render_result)
+
+    failed_tenants = [r["client_id"] for r in render_results if r["status"] == 'failed']
+    debug("Batch render completed. Tenants rendered: {}, failed: {}".format(len(render_results) - len(failed_tenants),
+                                                                          len(failed_tenants)), _INFO)
+    return not failed_tenants
+
+def get_tenant_replacement_tokens(client_properties, replacement_tokens, tenant_token_map):
+    """
+    :param client_properties:
+    :param replacement_tokens: product replacement tokens configuration or None
+    :param tenant_token_map: tenant replacement tokens overrides or None
+    :return: tenant replacement tokens configuration
+    """
+    if not tenant_token_map:
+        return replacement_tokens
+
+    product_deployed = client_properties["product_prefix"]
+    tenant_tokens = copy.deepcopy(replacement_tokens) if replacement_tokens else OrderedDict()
+    product_tokens = tenant_tokens.setdefault(product_deployed, OrderedDict())
+    replace_token_map = product_tokens.get("replace_token_map") or OrderedDict()
+    replace_token_map.update(tenant_token_map)
+    product_tokens["replace_token_map"] = replace_token_map
+    return tenant_tokens
+
+def init_batch_render_worker(batch_content, build_started_at):
+    """
+    Batch render worker process initializer. Product content is received once per worker.
+    :param batch_content: tuple of PS and OOB Prod MemoryContentSource
+    :param build_started_at: build start timestamp of batch render, written into JSON build manifests
+    :return:
+    """
+    global _BATCH_RENDER_CONTENT
+    global build_start_dt
+    _BATCH_RENDER_CONTENT = batch_content
+    build_start_dt = build_started_at
+
+def render_tenant(tenant_properties, ClientID, db_connection_name, replacement_tokens, client_deployment_dir):
+    """
+    Function renders tenant variant of product content in batch render worker process.
+    Content is published into Looker Project folder if batch_publish property is Y.
+    :param tenant_properties: client properties with tenant overrides
+    :param ClientID:
+    :param db_connection_name:
+    :param replacement_tokens: tenant replacement tokens configuration or None
+    :param client_deployment_dir:
+    :return: render result dictionary
+    """
+    ps_source, prod_source = _BATCH_RENDER_CONTENT
+    project_name = get_looker_project_name(tenant_properties, ClientID)
+    project_deployment_dir = os.path.join(client_deployment_dir, project_name)
+    render_result = {"client_id": ClientID, "folder": project_deployment_dir}
+
+    try:
+        os.makedirs(client_deployment_dir, exist_ok=True)
+        prepare_project_deployment_dir(tenant_properties, ClientID, project_name, project_deployment_dir)
+        render_context = render_content(tenant_properties, ps_source, prod_source, replacement_tokens,
+                                        ClientID, db_connection_name, project_deployment_dir)
+        render_result.update(status='rendered', files=len(render_context["render_plan"]))
+
+        if tenant_properties.get("batch_publish", "N") == 'Y':
+            content_target_dir = os.path.join(tenant_properties["looker_location"], project_name)
+            if not publish_content_targets(tenant_properties, project_deployment_dir, project_name):
+                raise ProcessException("Content was not published into folder {}".format(content_target_dir))
+            snapshot_id = create_deployment_snapshot(tenant_properties, ClientID, project_name, project_deployment_dir)
+            apply_snapshot_retention(tenant_properties, ClientID, project_name)
+            # Worker process deploys no Looker objects, manifest globals belong to the parent process
+            write_json_build_manifests(tenant_properties, get_date_timestamp(), project_name,
+                                       {"client_id": ClientID,
+                                        "snapshot_id": snapshot_id,
+                                        "content_files": render_context["content_files"],
+                                        "content_sources": render_context["content_sources"]},
+                                       list())
+            render_result.update(status='published')
+    except (ProcessException, OSError, UnicodeDecodeError) as e:
+        render_result.update(status='failed', error=str(e))
+
+    return render_result
+
+def new_content_record(file_name, origin, source):
+    """
+    :param file_name: file name in repository root folder
+    :param origin: PS, OOB or VIZ
+    :param source: ContentSource the file is read from
+    :return: render pipeline content record
+    """
+    return {"name": file_name,
+            "origin": origin,
+            "source": source,
+            "source_name": file_name,
+            "kind": None,
+            "data": None,
+            "transforms": list()}
+
+def discover_content(ps_source, prod_source):
+    """
+    Discover stage of render pipeline. Generates content records for PS files
+    followed by all OOB Prod files. Only PS files with c_ prefix, *.json files
+    and Model files containing token "map" are deployed.
+    :param ps_source: PS ContentSource or None if there is no PS content
+    :param prod_source: OOB Prod ContentSource
+    :return: generator of content records
+    """
+    if ps_source is not None:
+        match_ps_content = re.compile(r'(^(c_).+|\S+.json|\S+map\S+model[.]lkml)')
+        for fi in ps_source.list_files():
+            if match_ps_content.search(fi):
+                yield new_content_record(fi, 'PS', ps_source)
+    else:
+        debug("There is no PS Looker content files", _INFO)
+
+    debug("Getting OOB Looker content files from: {}".format(prod_source), _INFO)
+    for fi in prod_source.list_files():
+        yield new_content_record(fi, 'OOB', prod_source)
+
+def plan_content_file(render_plan, content_index, origin, file_name, kind):
+    """
+    Function selects discovered file for deployment. File selected again replaces
+    the previous selection with the same name, the same way file copy overwrites it.
+    :param render_plan: ordered dictionary of selected content records by deployed file name
+    :param content_index: discovered content records by (origin, file name)
+    :param origin: PS or OOB
+    :param file_name:
+    :param kind: model, custom_model, dashboard, document, view, viz or json
+    :return:
+    Raises:
+        ProcessException: if file was not discovered in content of given origin
+    """
+    if (origin, file_name) not in content_index:
+        raise ProcessException("File {} does not exist in {} content".format(file_name, origin))
+    content_record = dict(content_index[(origin, file_name)], kind=kind, transforms=list())
+    render_plan.pop(file_name, None)
+    render_plan[file_name] = content_record
+
+def plan_rename(render_plan, file_name, new_file_name):
+    """
+    :param render_plan:
+    :param file_name: selected file name
+    :param new_file_name: deployed file name
+    :return:
+    Raises:
+        ProcessException: if file was not selected for deployment
+    """
+    if file_name not in render_plan:
+        raise ProcessException("Cannot rename file {} to {}. File was not selected for deployment".format(file_name, new_file_name))
+    content_record = render_plan.pop(file_name)
+    content_record["name"] = new_file_name
+    render_plan.pop(new_file_name, None)
+    render_plan[new_file_name] = content_record
+
+def plan_transform(render_plan, file_name, content_transform):
+    """
+    :param render_plan:
+    :param file_name: deployed file name
+    :param content_transform: tuple of transform name, function applied to every line of file
+                              and function applied to every LookML tree node
+    :return:
+    Raises:
+        ProcessException: if file was not selected for deployment
+    """
+    if file_name not in render_plan:
+        raise ProcessException("Cannot apply {} to file {}. File was not selected for deployment".format(content_transform[0], file_name))
+    render_plan[file_name]["transforms"].append(content_transform)
+
+def select_content(client_properties, content_records, app_models, ClientID):
+    """
+    Select stage of render pipeline. Function chooses Model, Dashboard, Document, View,
+    Visualization extension and topojson files for deployed applications and renames
+    Model files in Multi Tenant mode. No file is read or written.
+    :param client_properties:
+    :param content_records: discovered content records
+    :param app_models: list of application models
+    :param ClientID:
+    :return: render context dictionary with render_plan and file lists used by transform stage
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+
+    ps_files = list()
+    prod_files = list()
+    content_index = dict()
+    for content_record in content_records:
+        if content_record["origin"] == 'PS':
+            ps_files.append(content_record["name"])
+        else:
+            prod_files.append(content_record["name"])
+        content_index[(content_record["origin"], content_record["name"])] = content_record
+    debug("Files from PS repository:\n{}".format('\n'.join(ps_files)), _DEBUG)
+
+    # Combine PS and OOB content into a single object for unified processing
+    all_content_files = ps_files + prod_files
+    render_plan = OrderedDict()
 
     # Process Model files.
     debug("*********************************************************************")
-    debug(" *****  Processing Looker Model files...", _INFO)
+    debug(" *****  Selecting Looker Model files...", _INFO)
 
     # Initialize lists to separately hold processed OOB and Custom model files.
     # need it for renaming
     _model_files = list()
     _custom_model_files = list()
-
-    # Need this list for processing models in view/document files.
-    old_model_name = list()
+    model_files = list()
+    custom_model_files = list()
 
     # Create list to hold application tokens processed. We need it for PS content validation
     app_tokens = list()
 
     for mi in app_models:
         debug("Processing Model: {}".format(mi), _INFO)
-        debug("*********************************************************************")
-
-        # ***** obsolete section. Need to remove and re-test
         # first part of IF handles Custom Models developed by PS and defined in internal properties file
         if re.search('^(c_)\S+', mi):
             debug("Found Customized Model: {}".format(mi))
-            #shutil.copy2(os.path.join(all_content_files, mi + ".model.lkml"), CLIENT_PROJECT_DEPLOYMENT_DIR)
-            shutil.copy2(os.path.join(ps_repo_location, mi + ".model.lkml"), CLIENT_PROJECT_DEPLOYMENT_DIR)
-        else:
-            debug("Process Model files based on application token extracted from application name", _INFO)
-    # ***** end of obsolete section
+            plan_content_file(render_plan, content_index, 'PS', mi + ".model.lkml", 'custom_model')
+            continue
 
         # process model files based on application token extracted from application name.
         # this part processes OOB and PS content solely based on app-model token extracted
         # from string base_<app-model-token>_model
-            _model_pos = mi.find('model')
-            _base_pos = mi.find('base')
-
-                # uncomment for debugging token extraction
-            #debug(" base pos {}, model pos {} ".format(_model_pos, _base_pos), _DEBUG)
-            if _model_pos < 0 or _base_pos < 0: # common models don't have _model prefix
-                debug("This is Common Model intended for extension", _INFO)
-                app_model_token = mi
-                app_tokens.append(app_model_token)
-            else:
-                app_model_token = mi[_base_pos + len('base') + 1:_model_pos - 1]
-                app_tokens.append(app_model_token)
-            debug("Extracted app-model token: {}".format(app_model_token), _DEBUG)
-
-            debug("Processing Model files from PS repository based on app-model token: {}".format(app_model_token), _INFO)
-            debug(" There might not be any PS Model files as PS content is optional", _INFO)
-            for fi in ps_files:
-                #if re.search('^(c_\S*{0}|\S+map)\S+model[.]lkml'.format(app_model_token), fi):
-                if re.search('^(c_\S*{0})\S+model[.]lkml'.format(app_model_token), fi):
-                    debug(" Copying PS Model file: {} to {}".format(fi, CLIENT_PROJECT_DEPLOYMENT_DIR), _INFO)
-                    shutil.copy2(os.path.join(ps_repo_location, fi), CLIENT_PROJECT_DEPLOYMENT_DIR)
-                    # Collect model files names for renaming if needed
-                    _custom_model_files.append(fi)
-
-                # Search for PS Model files files without app token (negative lookahead)
-                if re.search('^((?!{0}).)*model[.]lkml$'.format(app_model_token), fi):
-                    debug("Found PS Model file {} without app token: {}".format(fi, app_model_token))
-                    shutil.copy2(os.path.join(ps_repo_location, fi), CLIENT_PROJECT_DEPLOYMENT_DIR)
-                    # List might contain duplicates due to multiple negative lookahead matches
-                    _custom_model_files.append(fi)
-            # Remove duplicates resulting from multiple negative (not matching token) matches while iterating through app tokens
-            dup_values= set()
-            custom_model_files = [x for x in _custom_model_files if x not in dup_values and not dup_values.add(x)]
-
-            debug("Processing Model files from Prod repository based on app-model token: {}".format(app_model_token), _INFO)
-            for fi in prod_files:
-                if re.search('\S*({0})\S*[.]model[.]lkml'.format(app_model_token), fi):
-                    debug(" Copying OOB Prod model file: {} to {}".format(fi, CLIENT_PROJECT_DEPLOYMENT_DIR), _INFO)
-                    shutil.copy2(os.path.join(prod_repo_location, fi), CLIENT_PROJECT_DEPLOYMENT_DIR)
-                    # Collect model file names to be renamed and parsed for connection
-                    _model_files.append(fi)
-            # Dedup OOB model file names
-            dup_values= set()
-            model_files = [x for x in _model_files if x not in dup_values and not dup_values.add(x)]
-
-        debug("*********************************************************************")
+        app_model_token = get_app_model_token(mi)
+        if app_model_token == mi: # common models don't have _model prefix
+            debug("This is Common Model intended for extension", _INFO)
+        app_tokens.append(app_model_token)
+        debug("Extracted app-model token: {}".format(app_model_token), _DEBUG)
+
+        for fi in ps_files:
+            if re.search('^(c_\S*{0})\S+model[.]lkml'.format(app_model_token), fi):
+                debug(" Selecting PS Model file: {}".format(fi), _INFO)
+                plan_content_file(render_plan, content_index, 'PS', fi, 'custom_model')
+                # Collect model files names for renaming if needed
+                _custom_model_files.append(fi)
+
+            # Search for PS Model files files without app token (negative lookahead)
+            if re.search('^((?!{0}).)*model[.]lkml$'.format(app_model_token), fi):
+                debug("Found PS Model file {} without app token: {}".format(fi, app_model_token))
+                plan_content_file(render_plan, content_index, 'PS', fi, 'custom_model')
+                # List might contain duplicates due to multiple negative lookahead matches
+                _custom_model_files.append(fi)
+        # Remove duplicates resulting from multiple negative (not matching token) matches while iterating through app tokens
+        dup_values = set()
+        custom_model_files = [x for x in _custom_model_files if x not in dup_values and not dup_values.add(x)]
+
+        for fi in prod_files:
+            if re.search('\S*({0})\S*[.]model[.]lkml'.format(app_model_token), fi):
+                debug(" Selecting OOB Prod model file: {}".format(fi), _INFO)
+                plan_content_file(render_plan, content_index, 'OOB', fi, 'model')
+                # Collect model file names to be renamed and parsed for connection
+                _model_files.append(fi)
+        # Dedup OOB model file names
+        dup_values = set()
+        model_files = [x for x in _model_files if x not in dup_values and not dup_values.add(x)]
 
     debug("Application tokens processed: {}".format(app_tokens), _INFO)
 
-    debug("Completed Model files processing", _INFO)
-    debug("*********************************************************************")
-    debug("*********************************************************************")
+    # Rename model files for every new Customer deployment in Multi Tenant mode
+    model_file_extension = '.model.lkml'
+    old_model_name = list()
+    renamed_model_files = list()
+    renamed_custom_model_files = list()
+    if client_properties["single_tenant_deployment"] == 'N':
+        debug("These OOB Model files will be renamed: \n {}".format('\n'.join(model_files)), _INFO)
+        for fi in model_files:
+            file_part = fi.split('.')[0]
+            old_model_name.append(file_part)
+            new_model_file_name_part = file_part + '_' + ClientID + model_file_extension
+            debug("Renaming OOB Model file {} to {}".format(fi, new_model_file_name_part), _INFO)
+            plan_rename(render_plan, fi, new_model_file_name_part)
+            # Collect renamed OOB Model file names for processing extended models
+            renamed_model_files.append(new_model_file_name_part)
+
+        # Process and rename Custom Model files if required
+        existing_model_deployment_id = client_properties.get("existing_model_deployment_id", None)
+        if existing_model_deployment_id and custom_model_files:
+            debug(" Existing deployment id _{} will be replaced with _{}".format(existing_model_deployment_id, ClientID), _INFO)
+            match_model_file_part = re.compile(r'_({0})$'.format(existing_model_deployment_id))
+            for cfi in custom_model_files:
+                file_part = cfi.split('.')[0]
+                # Check if file part contains existing custom model token or not
+                if match_model_file_part.search(file_part):
+                    new_custom_model_file_name_part = file_part.replace(existing_model_deployment_id, ClientID) + model_file_extension
+                else:
+                    new_custom_model_file_name_part = file_part + '_' + ClientID + model_file_extension
+                debug("Renaming Custom Model file {} to {}".format(cfi, new_custom_model_file_name_part), _INFO)
+                plan_rename(render_plan, cfi, new_custom_model_file_name_part)
+                # Collect renamed Custom Model files for renaming referenced models
+                renamed_custom_model_files.append(new_custom_model_file_name_part)
+        elif existing_model_deployment_id is None:
+            debug("Parameter existing_model_deployment_id is not defined. Custom Models won't be renamed", _INFO)
+        else:
+            debug("Custom Model files will not be renamed", _INFO)
+
+    # Process Dashboard and Document files based on Model name
+    debug("***** Selecting Dashboard and Document files", _INFO)
+    document_files = list()
+    for mi in app_models:
+        _model_pos = mi.find('model')
+        _base_pos = mi.find('base')
+        # ignore models with no dashboards - common models (base_cpq_clm_base_explores)
+        # they do not contain _model suffix, only base_
+        if _model_pos < 0: continue
+
+        dashboard_document_token = mi[_base_pos + len('base') + 1:_model_pos - 1]
+        debug("Dashboard and Document token - {}".format(dashboard_document_token), _DEBUG)
+
+        for fi in all_content_files:
+            if re.search('^c_\S+[.]dashboard[.]lookml', fi):
+                plan_content_file(render_plan, content_index, 'PS', fi, 'dashboard')
+            if re.search('^c_\S+readme[.]md', fi):
+                document_files.append(fi)
+                plan_content_file(render_plan, content_index, 'PS', fi, 'document')
+
+        for fi in all_content_files:
+            if re.search('^(base_\S*{0}\S+)dashboard[.]lookml'.format(dashboard_document_token), fi):
+                plan_content_file(render_plan, content_index, 'OOB', fi, 'dashboard')
+            if re.search('^({0})[_]readme[.]md'.format(dashboard_document_token), fi):
+                document_files.append(fi)
+                plan_content_file(render_plan, content_index, 'OOB', fi, 'document')
+
+    # Select View files
+    debug("*** Selecting Views files based on Product {} view prefix".format(client_properties["product_prefix"]))
+    view_files = list()
+    for vi in get_product_view_prefix(client_properties):
+        for fi in all_content_files:
+            if re.search('^c_\S+[.]view[.]lkml', fi):
+                plan_content_file(render_plan, content_index, 'PS', fi, 'view')
+
+        for fi in all_content_files:
+            if re.search('^base_({0})\S+view[.]lkml'.format(vi), fi):
+                view_files.append(fi)
+                plan_content_file(render_plan, content_index, 'OOB', fi, 'view')
 
-    # Rename model files for every new Customer deployment if needed
+    # Select Visualization Extension files
+    debug("*** Selecting Visualization Extension files for Product {} ".format(client_properties["product_prefix"]))
+    product_deployed = client_properties["product_prefix"]
+    visual_ext_files = client_properties[product_deployed].get("visual_ext_files")
+
+    d3_files_dir = get_d3_files_dir(client_properties)
+    if d3_files_dir is None:
+        debug("Parameter d3_files_location does not exist in internal properties file", _WARNING)
+
+    if d3_files_dir is not None and os.path.isdir(d3_files_dir):
+        debug("Get Visualisation extension files from central location: {}".format(d3_files_dir), _INFO)
+        viz_source = DirectoryContentSource(d3_files_dir)
+        d3_files = viz_source.list_files()
+        if visual_ext_files is not None:
+            debug("Selected Visual Extension files will be deployed for Product: {}".format(product_deployed), _INFO)
+            d3_files = [f for f in d3_files if f in visual_ext_files]
+        for fi in d3_files:
+            if re.search('\S+[.]js$', fi):
+                content_record = new_content_record(fi, 'VIZ', viz_source)
+                content_record["kind"] = 'viz'
+                render_plan.pop(fi, None)
+                render_plan[fi] = content_record
+    else:
+        debug("Get Visualisation extension files from PD repo content", _INFO)
+        for fi in all_content_files:
+            if re.search('\S+[.]js$', fi):
+                plan_content_file(render_plan, content_index, 'OOB', fi, 'viz')
+
+    # Select other files - e.g Looker topojson file for various dashboards with maps
+    for fi in ps_files:
+        if re.search('\S+.json$', fi):
+            plan_content_file(render_plan, content_index, 'PS', fi, 'json')
+    for fi in prod_files:
+        if re.search('\S+.json$', fi):
+            plan_content_file(render_plan, content_index, 'OOB', fi, 'json')
+
+    debug("Files selected for deployment:\n{}".format('\n'.join(render_plan)), _DEBUG)
+
+    return {"render_plan": render_plan,
+            "ps_files": ps_files,
+            "prod_files": prod_files,
+            "app_tokens": app_tokens,
+            "model_files": model_files,
+            "renamed_model_files": renamed_model_files,
+            "renamed_custom_model_files": renamed_custom_model_files,
+            "old_model_name": old_model_name,
+            "document_files": document_files,
+            "view_files": view_files}
+
+def get_d3_files_dir(client_properties):
+    """
+    :param client_properties:
+    :return: central folder of Visualization extension files or None if d3_files_location is not defined
+    """
+    d3_files_location = client_properties.get("d3_files_location")
+    if d3_files_location is None:
+        return None
+    return os.path.join(client_properties.get("looker_deployment_base"), d3_files_location)
+
+def prune_content(render_context, lookml_trees, prune_report_file=None):
+    """
+    Prune stage of render pipeline. Function computes include graph from selected Model files
+    and removes View and Dashboard files which are not included by any Model. Included View files
+    are removed as well if none of their views is used by an explore, extended, or referenced
+    in SQL of a used view. Files which cannot be parsed are treated as used.
+    :param render_context: render context returned by select_content
+    :param lookml_trees: LookmlTreeCache
+    :param prune_report_file: JSON file for report of pruned files, None - no report is written
+    :return: list of pruned file names
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+
+    render_plan = render_context["render_plan"]
+    content_trees = dict()
+    unparsed_files = list()
+
+    def get_content_tree(file_name):
+        if file_name not in content_trees:
+            content_record = render_plan[file_name]
+            content_text = content_record["source"].read_file(content_record["source_name"]).decode('utf-8')
+            try:
+                content_trees[file_name] = lookml_trees.parse(''.join(split_content_lines(content_text)))
+            except looker_lookml.LookmlSyntaxError as e:
+                debug("File {} cannot be parsed, it will not be pruned: {}".format(file_name, str(e)), _WARNING)
+                content_trees[file_name] = None
+                unparsed_files.append(file_name)
+        return content_trees[file_name]
+
+    # Includes reference file names before Model files are renamed
+    source_names = dict()
+    for fi, content_record in render_plan.items():
+        source_names.setdefault(content_record["source_name"], list()).append(fi)
+
+    # Include graph from selected Model files
+    model_files = [fi for fi, content_record in render_plan.items() if content_record["kind"] in ('model', 'custom_model')]
+    included_files = set(model_files)
+    pending_files = list(model_files)
+    while pending_files:
+        content_tree = get_content_tree(pending_files.pop())
+        if content_tree is None:
+            continue
+        for parent, include_node in looker_lookml.find_lookml_nodes(content_tree, 'include'):
+            for include_pattern in looker_lookml.get_node_values(include_node):
+                for fi in match_include_pattern(include_pattern, source_names):
+                    if fi not in included_files:
+                        included_files.add(fi)
+                        if fi.endswith('.lkml'):
+                            pending_files.append(fi)
+
+    # Views used by explores of included files and by used views
+    lookml_files = [fi for fi in render_plan if fi in included_files and fi.endswith('.lkml')]
+    view_blocks = dict()
+    used_views = set()
+    for fi in lookml_files:
+        content_tree = get_content_tree(fi)
+        if content_tree is None:
+            continue
+        for parent, view_node in looker_lookml.find_lookml_nodes(content_tree, 'view'):
+            if view_node.kind == 'block' and view_node.name:
+                view_blocks.setdefault(view_node.name.lstrip('+'), list()).append(view_node)
+        for parent, explore_node in looker_lookml.find_lookml_nodes(content_tree, 'explore'):
+            used_views.update(get_explore_views(explore_node))
+
+    pending_views = list(used_views)
+    while pending_views:
+        for view_node in view_blocks.get(pending_views.pop(), list()):
+            for view_name in get_view_references(view_node):
+                if view_name not in used_views:
+                    used_views.add(view_name)
+                    pending_views.append(view_name)
+
+    pruned_files = list()
+    for fi, content_record in render_plan.items():
+        if content_record["kind"] not in ('view', 'dashboard'):
+            continue
+        if fi not in included_files:
+            pruned_files.append({"name": fi, "kind": content_record["kind"], "origin": content_record["origin"],
+                                 "reason": "not included by deployed models"})
+        elif content_record["kind"] == 'view' and get_content_tree(fi) is not None:
+            content_tree = get_content_tree(fi)
+            defined_views = [view_node.name.lstrip('+') for parent, view_node in looker_lookml.find_lookml_nodes(content_tree, 'view')
+                             if view_node.kind == 'block' and view_node.name]
+            if defined_views and not set(defined_views) & used_views \
+                    and not looker_lookml.find_lookml_nodes(content_tree, 'explore'):
+                pruned_files.append({"name": fi, "kind": content_record["kind"], "origin": content_record["origin"],
+                                     "reason": "views {} are not used".format(', '.join(defined_views))})
+
+    for pruned_file in pruned_files:
+        debug(" Pruned {} file {}: {}".format(pruned_file["origin"], pruned_file["name"], pruned_file["reason"]), _DEBUG)
+        del render_plan[pruned_file["name"]]
+    pruned_file_names = [pruned_file["name"] for pruned_file in pruned_files]
+    render_context["view_files"] = [fi for fi in render_context["view_files"] if fi not in pruned_file_names]
+    debug("Pruned {} of {} selected files, {} views are used".format(len(pruned_files), len(render_plan) + len(pruned_files),
+                                                                     len(used_views)), _INFO)
+
+    if prune_report_file is not None:
+        prune_report = {"created_at": get_date_timestamp(current_time=True),
+                        "deployed_files": len(render_plan),
+                        "model_files": sorted(model_files),
+                        "used_views": sorted(used_views),
+                        "unparsed_files": sorted(unparsed_files),
+                        "pruned_files": pruned_files}
+        with open(prune_report_file, 'w') as rfh:
+            json.dump(prune_report, rfh, indent=3, sort_keys=True)
+        debug("Prune report is written into {}".format(prune_report_file), _INFO)
+
+    return pruned_file_names
+
+def match_include_pattern(include_pattern, source_names):
+    """
+    :param include_pattern: value of LookML include, may contain wildcards and omit .lkml/.lookml extension
+    :param source_names: dictionary of deployed file names by file name in repository
+    :return: list of deployed file names matching include
+    """
+    if include_pattern.startswith('//'):
+        # Files of imported projects are not deployed
+        return list()
+    # Content is deployed into flat Project folder
+    file_pattern = include_pattern.split('/')[-1]
+    file_patterns = [file_pattern] if file_pattern.endswith(('.lkml', '.lookml')) \
+        else [file_pattern + '.lkml', file_pattern + '.lookml']
+    return [fi for source_name, file_names in source_names.items()
+            if any(fnmatch.fnmatchcase(source_name, fp) for fp in file_patterns) for fi in file_names]
+
+def get_explore_views(explore_node):
+    """
+    :param explore_node: explore block LookmlNode
+    :return: set of view names used by explore - base view, joined views and views referenced in SQL
+    """
+    explore_views = set()
+    view_name_nodes = looker_lookml.find_lookml_nodes(explore_node, 'view_name') + \
+                      [(parent, node) for parent, node in looker_lookml.find_lookml_nodes(explore_node, 'from')
+                       if parent is explore_node]
+    if view_name_nodes:
+        for parent, node in view_name_nodes:
+            explore_views.update(looker_lookml.get_node_values(node))
+    elif explore_node.name:
+        explore_views.add(explore_node.name.lstrip('+'))
+
+    for parent, join_node in looker_lookml.find_lookml_nodes(explore_node, 'join'):
+        join_from = [node for node in join_node.children() if node.key == 'from']
+        if join_from:
+            explore_views.update(looker_lookml.get_node_values(join_from[0]))
+        elif join_node.name:
+            explore_views.add(join_node.name)
+
+    explore_views.update(re.findall(r'\$\{(\w+)\.', looker_lookml.get_node_text(explore_node)))
+    return explore_views
+
+def get_view_references(view_node):
+    """
+    :param view_node: view block LookmlNode
+    :return: set of view names extended or referenced in SQL of the view
+    """
+    view_references = set()
+    for parent, extends_node in looker_lookml.find_lookml_nodes(view_node, 'extends'):
+        view_references.update(looker_lookml.get_node_values(extends_node))
+    view_references.update(re.findall(r'\$\{(\w+)\.', looker_lookml.get_node_text(view_node)))
+    return view_references
+
+def assign_content_transforms(client_properties, render_context, ClientID, db_connection_name, token_transforms):
+    """
+    Function assigns line transforms to selected files in the order they have to be applied:
+    connection rename and hidden OOB explores, extended model renames, dashboard links
+    model rename and replacement tokens.
+    :param client_properties:
+    :param render_context: render context returned by select_content
+    :param ClientID:
+    :param db_connection_name:
+    :param token_transforms: list of replacement token transforms
+    :return:
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+
+    render_plan = render_context["render_plan"]
+    ps_files = render_context["ps_files"]
     model_file_extension = '.model.lkml'
-    hide_oob_model_explores = client_properties.get("hide_oob_explores","N")
-    replace_hide_explore_condition = 'hidden: yes'
+    hide_oob_model_explores = client_properties.get("hide_oob_explores", "N")
     replace_db_conn_name = 'connection: "' + db_connection_name + '"'
 
-    if client_properties["single_tenant_deployment"] =='Y':
+    if client_properties["single_tenant_deployment"] == 'Y':
         debug("Deployment is in Single tenant mode. Will rename connections only", _INFO)
-        debug("Connection name: {}".format(db_connection_name), _INFO)
+        for fi in render_context["model_files"]:
+            # Search for OOB model files extended by PS to hide the explores in OOB model
+            hide_explores_in_model = any(fi[5:] == ps_fi[2:] for ps_fi in ps_files)
+            if hide_oob_model_explores == 'Y' and hide_explores_in_model:
+                debug("Hiding OOB explore(s) in {} model file as it is extended by PS model".format(fi), _INFO)
+            plan_transform(render_plan, fi, get_connection_transform(replace_db_conn_name, r'^connection[:].+',
+                                                                     hide_oob_model_explores == 'Y' and hide_explores_in_model))
+    else:
+        debug("Deployment is in Multi tenant mode.", _INFO)
+        for fi in render_context["renamed_model_files"]:
+            hide_explores_in_model = any(fi[5:] == ps_fi[2:].split('.')[0] + model_file_extension for ps_fi in ps_files)
+            if hide_oob_model_explores == 'Y' and hide_explores_in_model:
+                debug("Hiding OOB explore(s) in {} model file as it is extended by PS model".format(fi), _INFO)
+            plan_transform(render_plan, fi, get_connection_transform(replace_db_conn_name, r'^\s*connection[:].+',
+                                                                     hide_oob_model_explores == 'Y' and hide_explores_in_model))
 
-        debug("Renaming connections for models: \n {}".format(model_files), _INFO)
-			
-        for fi in model_files:
-			# Search for OOB model files extended by PS to hide the explores in OOB model
-            hide_explores_in_model = 0
-            prod_file = fi[5:]
-            for ps_fi in ps_files:
-                ps_file = ps_fi[2:]
-                if prod_file == ps_file:
-                    hide_explores_in_model = 1
-                    ps_model_file_name = os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR, ps_fi)
-                    break
+        # Rename extended models in renamed model files
+        for fi in render_context["renamed_model_files"]:
+            plan_transform(render_plan, fi, get_extended_model_transform(ClientID))
+
+        existing_model_deployment_id = client_properties.get("existing_model_deployment_id", None)
+        renamed_custom_model_files = render_context["renamed_custom_model_files"]
+        for rfi in renamed_custom_model_files:
+            plan_transform(render_plan, rfi, get_custom_model_id_transform(existing_model_deployment_id, ClientID))
+        for rfi in renamed_custom_model_files:
+            plan_transform(render_plan, rfi, get_connection_transform(replace_db_conn_name, r'^\s*connection[:].+', False))
+        for rfi in renamed_custom_model_files:
+            plan_transform(render_plan, rfi, get_custom_model_no_id_transform(ClientID))
+
+        # Search through document and view files for dashboard links and replace all model names in one pass
+        if render_context["old_model_name"]:
+            dashboard_links_transform = get_dashboard_links_transform(render_context["old_model_name"], ClientID)
+            for fi in render_context["document_files"] + render_context["view_files"]:
+                plan_transform(render_plan, fi, dashboard_links_transform)
+
+    # Replace tokens in model and dashboard files
+    if token_transforms:
+        process_files = list()
+        for fnp in ["model.lkml", "dashboard.lookml"]:
+            match_prefix = re.compile('.*({0}).*'.format(fnp))
+            process_files += [fi for fi in render_plan if match_prefix.match(fi)]
+        for token_transform in token_transforms:
+            for fi in process_files:
+                plan_transform(render_plan, fi, token_transform)
+
+def get_connection_transform(replace_db_conn_name, connection_pattern, hide_explores):
+    """
+    :param replace_db_conn_name: connection line
+    :param connection_pattern: regex of connection line to replace
+    :param hide_explores: True - explores with hidden: no are hidden
+    :return: content transform
+    """
+    def connection_transform(line):
+        if hide_explores and line.lstrip().rstrip() == 'hidden: no':
+            return re.sub(r'hidden: no', 'hidden: yes', line)
+        return re.sub(connection_pattern, replace_db_conn_name, line)
+    def connection_node_transform(parent, node):
+        if hide_explores and node.key == 'hidden' and parent.kind == 'block' and parent.key == 'explore':
+            for token in node.value_tokens():
+                if token.text == 'no':
+                    token.text = 'yes'
+        elif node.key == 'connection' and node.kind == 'pair' and parent.kind == 'root':
+            node.tokens = looker_lookml.tokenize_lookml(replace_db_conn_name)
+    return ("hide_explores_connection" if hide_explores else "connection", connection_transform, connection_node_transform)
+
+def get_extended_model_transform(ClientID):
+    """
+    :param ClientID:
+    :return: content transform renaming included OOB model files
+    """
+    def extended_model_transform(line):
+        return re.sub(r'^\s*include.+[.]model[.]lkml', line.split('.')[0] + '_' + ClientID + '.model.lkml', line)
+    def extended_model_node_transform(parent, node):
+        if node.key == 'include':
+            for token in node.value_tokens():
+                if token.type == 'string' and token.text.endswith('.model.lkml"'):
+                    token.text = token.text.split('.')[0] + '_' + ClientID + '.model.lkml"'
+    return ("extended_model", extended_model_transform, extended_model_node_transform)
+
+def get_custom_model_id_transform(existing_model_deployment_id, ClientID):
+    """
+    :param existing_model_deployment_id:
+    :param ClientID:
+    :return: content transform replacing deployment id of included Custom model files
+    """
+    match_ext_cust_model = re.compile(r'(^\s*include:.+_)({0})([.]model[.]lkml)'.format(existing_model_deployment_id))
+    match_ext_cust_model_path = re.compile(r'(^".*_)({0})([.]model[.]lkml"$)'.format(existing_model_deployment_id))
+    def custom_model_id_transform(line):
+        return match_ext_cust_model.sub(r'\1{0}\3'.format(ClientID), line)
+    def custom_model_id_node_transform(parent, node):
+        if node.key == 'include':
+            for token in node.value_tokens():
+                if token.type == 'string':
+                    token.text = match_ext_cust_model_path.sub(r'\1{0}\3'.format(ClientID), token.text)
+    return ("custom_model_id", custom_model_id_transform, custom_model_id_node_transform)
+
+def get_custom_model_no_id_transform(ClientID):
+    """
+    :param ClientID:
+    :return: content transform renaming included Custom model files without deployment id
+    """
+    match_no_dep_id = re.compile('^\s*include:\s\".*(?<!{0})\.model\.lkml\"$'.format(ClientID))
+    match_no_dep_id_path = re.compile(r'^".*(?<!{0})\.model\.lkml"$'.format(ClientID))
+    def custom_model_no_id_transform(line):
+        return match_no_dep_id.sub(line.split('.')[0] + '_' + ClientID + '.model.lkml' + '"', line)
+    def custom_model_no_id_node_transform(parent, node):
+        if node.key == 'include':
+            for token in node.value_tokens():
+                if token.type == 'string' and match_no_dep_id_path.match(token.text):
+                    token.text = token.text.split('.')[0] + '_' + ClientID + '.model.lkml"'
+    return ("custom_model_no_id", custom_model_no_id_transform, custom_model_no_id_node_transform)
+
+def get_dashboard_links_transform(model_names, ClientID):
+    """
+    Function combines dashboard link transforms of all model names into one pattern.
+    Like separate transform per model name, the last link of every model name in a line is
+    replaced (the last n links if model name is listed n times).
+    :param model_names: OOB model names
+    :param ClientID:
+    :return: content transform replacing model names in dashboard links, lines without links are skipped
+    """
+    model_name_counts = Counter(model_names)
+    match_model_names = re.compile(r'[/]dashboards[/]({0})(?=(?:[/]|::)\S)'.format(
+        '|'.join(re.escape(model_name) for model_name in model_name_counts)))
+    client_suffix = '_' + ClientID
+
+    def dashboard_links_transform(line):
+        if '/dashboards/' not in line:
+            return line
+        model_name_ends = dict()
+        for link_match in match_model_names.finditer(line):
+            model_name_ends.setdefault(link_match.group(1), list()).append(link_match.end(1))
+        replace_ends = sorted(pos for model_name, name_ends in model_name_ends.items()
+                              for pos in name_ends[-model_name_counts[model_name]:])
+        if not replace_ends:
+            return line
+        line_parts = list()
+        last_pos = 0
+        for pos in replace_ends:
+            line_parts.append(line[last_pos:pos])
+            line_parts.append(client_suffix)
+            last_pos = pos
+        line_parts.append(line[last_pos:])
+        return ''.join(line_parts)
+    def dashboard_links_node_transform(parent, node):
+        for token in node.tokens:
+            if isinstance(token, looker_lookml.LookmlToken) and token.type in ('string', 'sql', 'text', 'ident', 'comment') \
+                    and '/dashboards/' in token.text:
+                token.text = '\n'.join(dashboard_links_transform(line) for line in token.text.split('\n'))
+    # Files without dashboard links are not transformed at all
+    dashboard_links_transform.prefilter = '/dashboards/'
+    return ("dashboard_links", dashboard_links_transform, dashboard_links_node_transform)
+
+def get_token_transform(replace_token, replace_value):
+    """
+    :param replace_token: token including token indicators
+    :param replace_value:
+    :return: content transform replacing token
+    """
+    match_token = re.compile(r'(.*)({0})(.*)'.format(replace_token))
+    replace_token_value = r'\1{0}\3'.format(replace_value)
+    def token_transform(line):
+        return match_token.sub(replace_token_value, line)
+    def token_node_transform(parent, node):
+        # Tokens are replaced in all node text, the same as in line transform
+        for token in node.tokens:
+            if isinstance(token, looker_lookml.LookmlToken) and token.type != 'ws':
+                token.text = match_token.sub(replace_token_value, token.text)
+    return ("token", token_transform, token_node_transform)
+
+# Visualization extensions and their precompressed siblings are published into Visualization extensions folder
+_VIZ_EXTN_FILE_PATTERN = re.compile(r"\S+[.]js([.](gz|br))?$")
+
+def is_viz_extn_file(file_name):
+    """
+    :param file_name: deployed file name
+    :return: True if file is published into Visualization extensions folder
+    """
+    return _VIZ_EXTN_FILE_PATTERN.search(file_name) is not None
 
-            model_file_name = os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR, fi)
-            debug("     Processing file {} for connection rename in Single Tenant mode".format(model_file_name), _INFO)
-            if (hide_oob_model_explores == 'Y') and (hide_explores_in_model == 1):			
-                debug("     Hiding OOB explore(s) exists in {} model file as it is extended by {}".format(model_file_name,ps_model_file_name), _INFO)
-			
-            with fileinput.input(files=(model_file_name), inplace=True) as modf:
-                for line in modf:
-                    if (hide_oob_model_explores == 'Y') and (hide_explores_in_model == 1) :
-                        if line.lstrip().rstrip() == 'hidden: no':
-                            match_conn_string = re.sub(r'hidden: no', replace_hide_explore_condition, line)
-                        else:
-                            match_conn_string = re.sub(r'^connection[:].+', replace_db_conn_name, line)
+def plan_viz_build(client_properties, render_context):
+    """
+    Build stage of Visualization extensions. Selected extensions are minified. With viz_build_hash_names
+    every extension is also deployed under name with hash of its source for cache busting, the original
+    name is kept for existing references. Every deployed extension gets precompressed siblings in
+    viz_build_encodings - gz, and br if brotli module is installed.
+    :param client_properties:
+    :param render_context: render context with transforms assigned
+    :return:
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+
+    render_plan = render_context["render_plan"]
+    encodings = client_properties.get("viz_build_encodings", list())
+    viz_encodings = looker_viz.get_viz_encodings(encodings)
+    if len(viz_encodings) < len(encodings):
+        debug("Module brotli is not installed, br Visualization extensions will not be built", _WARNING)
+
+    minify_transform = get_viz_minify_transform()
+    for fi, content_record in [(fi, content_record) for fi, content_record in render_plan.items()
+                               if content_record["kind"] == 'viz']:
+        plan_transform(render_plan, fi, minify_transform)
+        viz_file_names = [fi]
+        if client_properties.get("viz_build_hash_names", "N") == 'Y':
+            source_data = content_record["source"].read_file(content_record["source_name"])
+            source_hash = hashlib.sha256(b"%d\0%s" % (looker_viz._VIZ_BUILD_VERSION, source_data)).hexdigest()
+            hashed_file_name = "{}.{}.js".format(fi[:-len('.js')], source_hash[:12])
+            render_plan[hashed_file_name] = dict(content_record, name=hashed_file_name,
+                                                 transforms=list(content_record["transforms"]))
+            viz_file_names.append(hashed_file_name)
+        for viz_file_name in viz_file_names:
+            for encoding in viz_encodings:
+                compressed_file_name = viz_file_name + '.' + encoding
+                render_plan[compressed_file_name] = dict(content_record, name=compressed_file_name,
+                                                         transforms=list(content_record["transforms"]))
+                plan_transform(render_plan, compressed_file_name, get_viz_compress_transform(encoding))
+        debug("Visualization extension {} is built as {}".format(fi, viz_file_names), _DEBUG)
+
+def get_viz_minify_transform():
+    """
+    :return: whole text transform minifying Visualization extension, text which cannot be minified is not changed
+    """
+    def viz_minify_transform(content_text):
+        try:
+            return looker_viz.minify_js(content_text)
+        except looker_viz.JsSyntaxError as e:
+            debug("Visualization extension will not be minified: {}".format(str(e)), _WARNING)
+            return content_text
+    viz_minify_transform.whole_text = True
+    return ("viz_minify", viz_minify_transform, None)
+
+def get_viz_compress_transform(encoding):
+    """
+    :param encoding: gz or br
+    :return: whole text transform compressing Visualization extension, it returns bytes and must be the last one
+    """
+    def viz_compress_transform(content_text):
+        return looker_viz.compress_content(content_text.encode('utf-8'), encoding)
+    viz_compress_transform.whole_text = True
+    return ("viz_compress_" + encoding, viz_compress_transform, None)
+
+def plan_topojson_build(client_properties, render_context):
+    """
+    Build stage of topojson files used by map dashboards. Arcs of every selected TopoJSON Topology are
+    simplified to topojson_simplify_tolerance and positions are quantized to topojson_quantization.
+    Other json files are not changed.
+    :param client_properties:
+    :param render_context: render context with transforms assigned
+    :return:
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+
+    render_plan = render_context["render_plan"]
+    for fi in [fi for fi, content_record in render_plan.items() if content_record["kind"] == 'json']:
+        plan_transform(render_plan, fi, get_topojson_transform(client_properties, fi))
+
+def get_topojson_transform(client_properties, file_name):
+    """
+    :param client_properties:
+    :param file_name: deployed file name, size reduction is reported for it
+    :return: whole text transform simplifying TopoJSON Topology, result is cached by input hash in content store
+    """
+    quantization = int(client_properties.get("topojson_quantization", 0))
+    tolerance = float(client_properties.get("topojson_simplify_tolerance", 0))
+    topology_cache = get_topology_cache(client_properties)
+
+    def topojson_transform(content_text):
+        try:
+            topology_text, topology_stats, cached = topology_cache.simplify(content_text, quantization, tolerance)
+        except looker_topojson.TopologyError as e:
+            debug("File {} will not be simplified: {}".format(file_name, str(e)), _WARNING)
+            return content_text
+        if topology_text is None:
+            debug("File {} is not TopoJSON Topology, it will not be simplified".format(file_name), _DEBUG)
+            return content_text
+        # Topology which would not get smaller is deployed unchanged
+        reduced = topology_stats["output_size"] < topology_stats["input_size"]
+        debug("TopoJSON {}: {} -> {} bytes ({:.1f}% smaller), {} -> {} arc positions{}{}".format(
+            file_name, topology_stats["input_size"], topology_stats["output_size"],
+            100.0 * (topology_stats["input_size"] - topology_stats["output_size"]) / max(topology_stats["input_size"], 1),
+            topology_stats["input_positions"], topology_stats["output_positions"],
+            ", cached" if cached else "", "" if reduced else ", kept unchanged"), _INFO)
+        return topology_text if reduced else content_text
+    topojson_transform.whole_text = True
+    return ("topojson_simplify", topojson_transform, None)
+
+def split_content_lines(content_text):
+    """
+    Function splits text into lines the same way as text mode file read - universal newlines.
+    :param content_text:
+    :return: list of lines with line end
+    """
+    content_lines = content_text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return [line + '\n' for line in content_lines[:-1]] + ([content_lines[-1]] if content_lines[-1] else [])
+
+def transform_content(content_records, lookml_trees=None):
+    """
+    Transform stage of render pipeline. Files with transforms are read once and
+    transformed in memory. Files without transforms are passed through untouched.
+    If LookML tree cache is given, LookML and dashboard files are parsed and all transforms are applied
+    to tree nodes in one traversal. Files which cannot be parsed are transformed line by line.
+    Transforms with prefilter text are skipped for files which do not contain it.
+    Whole text transforms get the whole file text and may return bytes as the last transform.
+    :param content_records: selected content records
+    :param lookml_trees: LookmlTreeCache or None - all files are transformed line by line
+    :return: generator of content records, transformed content in data. Data is not set if content is not changed
+    """
+    for content_record in content_records:
+        if content_record["transforms"]:
+            source_text = content_record["source"].read_file(content_record["source_name"]).decode('utf-8')
+            content_text = ''.join(split_content_lines(source_text))
+            content_transforms = [content_transform for content_transform in content_record["transforms"]
+                                  if getattr(content_transform[1], "prefilter", None) is None
+                                  or content_transform[1].prefilter in content_text]
+            content_tree = None
+            is_dashboard = content_record["name"].endswith('.dashboard.lookml')
+            if content_transforms and lookml_trees is not None and (content_record["name"].endswith('.lkml') or is_dashboard):
+                try:
+                    content_tree = lookml_trees.parse(content_text, is_dashboard)
+                except looker_lookml.LookmlSyntaxError as e:
+                    debug("File {} will be transformed line by line: {}".format(content_record["name"], str(e)), _DEBUG)
+
+            if content_tree is not None:
+                transform_start = time.perf_counter()
+                node_transforms = [node_transform for transform_name, line_transform, node_transform in content_transforms]
+                for parent, node in looker_lookml.walk_lookml(content_tree):
+                    for node_transform in node_transforms:
+                        node_transform(parent, node)
+                content_text = content_tree.dump()
+                add_stage_transform_time("parsed_tree", time.perf_counter() - transform_start)
+            else:
+                for transform_name, line_transform, node_transform in content_transforms:
+                    transform_start = time.perf_counter()
+                    if getattr(line_transform, "whole_text", False):
+                        content_text = line_transform(content_text)
                     else:
-                        match_conn_string = re.sub(r'^connection[:].+', replace_db_conn_name, line)
+                        content_text = ''.join(line_transform(line) for line in split_content_lines(content_text))
+                    add_stage_transform_time(transform_name, time.perf_counter() - transform_start)
+            if isinstance(content_text, bytes):
+                content_record["data"] = content_text
+            elif content_text != source_text:
+                content_record["data"] = content_text.encode('utf-8')
+        yield content_record
+
+def write_content(content_records, client_project_deployment_dir, content_store_dir=None):
+    """
+    Write stage of render pipeline. Every file is written once into Project deployment folder.
+    Files which are not renamed or transformed are copied from content source.
+    If content store is given, every unique file content is stored once and hardlinked
+    into Project deployment folder, so identical files of all tenants share one copy.
+    :param content_records: transformed content records
+    :param client_project_deployment_dir:
+    :param content_store_dir: content store folder for link output mode, None - files are written
+    :return: list of written file names
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+
+    written_files = list()
+    for content_record in content_records:
+        if content_store_dir is not None:
+            content_data = content_record["data"]
+            if content_data is None:
+                content_data = content_record["source"].read_file(content_record["source_name"])
+            file_hash = store_content_data(content_store_dir, content_data)
+            link_content_object(content_store_dir, file_hash, os.path.join(client_project_deployment_dir, content_record["name"]))
+        elif content_record["data"] is None and content_record["name"] == content_record["source_name"]:
+            content_record["source"].copy_file(content_record["name"], client_project_deployment_dir)
+        else:
+            content_data = content_record["data"]
+            if content_data is None:
+                content_data = content_record["source"].read_file(content_record["source_name"])
+            with open(os.path.join(client_project_deployment_dir, content_record["name"]), 'wb') as content_fh:
+                content_fh.write(content_data)
+        written_files.append(content_record["name"])
+        add_stage_files()
+        debug(" Deployed {} file {} from {}".format(content_record["origin"], content_record["name"], content_record["source"]), _DEBUG)
+
+    return written_files
+
+def publish_content(client_properties, client_project_deployment_dir, content_target_dir):
+    """
+    Function propagates prepared content into Looker Project folder and Visualization extension folder.
+    Publish mode is controlled by publish_mode property:
+        copy    - files are copied one by one into live Looker Project folder
+        delta   - files are transferred into live Looker Project folder rsync style, only changed blocks are written
+        rename  - content is staged in a sibling folder, verified and swapped in with directory rename
+        symlink - content is staged as a new release, verified and Project folder symlink is flipped to it
+    :param client_properties:
+    :param client_project_deployment_dir: folder with prepared content
+    :param content_target_dir: Looker Project folder
+    :return: True/False
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
 
-                    print(match_conn_string, end='')
+    publish_mode = client_properties.get("publish_mode", "copy")
+    link_files = client_properties.get("output_mode", "copy") == 'link'
+    debug("Publishing content in {} mode".format(publish_mode), _INFO)
+
+    combined_content = get_files(os.path.join(client_project_deployment_dir), fpath=True)
+    content_files = [fi for fi in combined_content if not is_viz_extn_file(fi)]
+    viz_extn_files = [fi for fi in combined_content if is_viz_extn_file(fi)]
+    add_stage_files(len(combined_content))
+
+    if not prepare_viz_extn_dir(client_properties):
+        return False
+
+    if publish_mode in ('copy', 'delta'):
+        # Check if Looker Project directory exists, create empty directory if it does not
+        if not os.path.isdir(content_target_dir):
+            debug("Folder {} does not exist. Creating it".format(content_target_dir), _INFO)
+            os.mkdir(content_target_dir)
+
+        content_published = True
+        delta_block_size = int(client_properties.get("publish_delta_block_size", 2048))
+        delta_signatures_dir = os.path.join(get_content_store_dir(client_properties), "delta_signatures")
+        content_bytes, written_bytes = 0, 0
+        for fi in content_files:
+            try:
+                if publish_mode == 'delta':
+                    content_bytes += os.path.getsize(fi)
+                    written_bytes += delta_copy_file(fi, os.path.join(content_target_dir, os.path.basename(fi)),
+                                                     delta_signatures_dir, delta_block_size)
+                else:
+                    link_or_copy_file(fi, os.path.join(content_target_dir, os.path.basename(fi)), link_files)
+            except IOError:
+                debug("Unable to copy file {} to folder {}".format(fi, content_target_dir), _ERROR)
+                content_published = False
+        if publish_mode == 'delta':
+            debug("Delta publish wrote {} of {} bytes into {}".format(written_bytes, content_bytes, content_target_dir), _INFO)
+
+    elif publish_mode in ('rename', 'symlink'):
+        staging_dir = stage_content(client_properties, content_files, content_target_dir)
+        if staging_dir is None:
+            return False
+        if publish_mode == 'rename':
+            content_published = swap_content_rename(staging_dir, content_target_dir)
+        else:
+            content_published = swap_content_symlink(client_properties, staging_dir, content_target_dir)
 
-    # processing for Multi Tenant mode
     else:
-        renamed_model_files = list()
+        debug("Invalid publish_mode {}. Possible values are: copy, delta, rename, symlink".format(publish_mode), _ERROR)
+        return False
 
-        debug("Deployment is in Multi tenant mode.", _INFO)
-        debug("These OOB Model files will be renamed: \n {}".format('\n'.join(model_files)), _INFO)
-        # Rename OOB base model files and replace connection string
+    publish_viz_extn_files(client_properties, viz_extn_files, publish_mode != 'copy')
+    return content_published
 
-        for fi in model_files:
-            debug("Processing OOB Model file {} in Multi Tenant mode".format(fi), _INFO)
-			
-            old_model_file_name = os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR, fi)
-            file_part = fi.split('.')[0]
-            old_model_name.append(file_part)
+_BUNDLE_VERSION = 1
+_BUNDLE_METADATA = "bundle.json"
 
-            new_model_file_name_part = file_part + '_' + ClientID + model_file_extension
+def export_bundle(client_properties, ClientID, client_project_deployment_dir, bundle_file, render_context):
+    """
+    Function exports rendered Project as gzip compressed tar deployment bundle. The first member is
+    bundle.json with build metadata and hash, size and origin of every file, followed by Project files
+    under project/ and Visualization extensions under viz/.
+    :param client_properties:
+    :param ClientID:
+    :param client_project_deployment_dir: folder with prepared content
+    :param bundle_file:
+    :param render_context:
+    :return:
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+
+    bundle_files = dict()
+    for fi in sorted(get_files(client_project_deployment_dir, fpath=False)):
+        file_name = os.path.join(client_project_deployment_dir, fi)
+        bundle_files[fi] = {"target": "viz_extension" if is_viz_extn_file(fi) else "project",
+                            "size": os.path.getsize(file_name),
+                            "hash": get_file_hash(file_name)}
+        bundle_files[fi].update(render_context["content_files"].get(fi, dict()))
+        add_stage_files()
+
+    bundle_metadata = {"bundle_version": _BUNDLE_VERSION,
+                       "hash_algorithm": "sha256",
+                       "created_at": get_date_timestamp(current_time=True),
+                       "build_host": os.uname().nodename,
+                       "build_started_at": build_start_dt,
+                       "client_id": ClientID,
+                       "project_name": LOOKER_PROJECT_NAME,
+                       "product_prefix": client_properties["product_prefix"],
+                       "product_apps": client_properties["product_apps"],
+                       "single_tenant_deployment": client_properties["single_tenant_deployment"],
+                       "repositories": render_context["content_sources"],
+                       "files": bundle_files}
+    metadata_data = json.dumps(bundle_metadata, indent=3, sort_keys=True).encode('utf-8')
+
+    def reset_owner(tar_info):
+        tar_info.uid = tar_info.gid = 0
+        tar_info.uname = tar_info.gname = ''
+        return tar_info
+
+    os.makedirs(os.path.dirname(os.path.abspath(bundle_file)), exist_ok=True)
+    temp_file = bundle_file + '.tmp{}'.format(os.getpid())
+    with tarfile.open(temp_file, 'w:gz', compresslevel=int(client_properties.get("bundle_compress_level", 6))) as bundle:
+        metadata_info = tarfile.TarInfo(_BUNDLE_METADATA)
+        metadata_info.size = len(metadata_data)
+        metadata_info.mtime = int(time.time())
+        metadata_info.mode = 0o644
+        bundle.addfile(metadata_info, io.BytesIO(metadata_data))
+        for fi, file_info in bundle_files.items():
+            member_dir = 'viz/' if file_info["target"] == 'viz_extension' else 'project/'
+            bundle.add(os.path.join(client_project_deployment_dir, fi), arcname=member_dir + fi,
+                       recursive=False, filter=reset_owner)
+    os.replace(temp_file, bundle_file)
+    debug("Exported {} files into deployment bundle {} ({} bytes)".format(len(bundle_files), bundle_file,
+                                                                        os.path.getsize(bundle_file)), _INFO)
+
+def install_bundle(client_properties, bundle_file, ClientID):
+    """
+    Function streams deployment bundle into Looker Project folder and Visualization extensions folder
+    of every publish target in one pass. Every file is verified against bundle.json before it is written.
+    In rename and symlink publish modes Project files are streamed into staging folders, which are swapped
+    in only when the whole bundle was verified. In other modes files are replaced one by one.
+    :param client_properties:
+    :param bundle_file:
+    :param ClientID:
+    :return: True if bundle was installed into all publish targets
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+
+    global LOOKER_PROJECT_NAME
+    global CONTENT_TARGET_DIR
+
+    publish_mode = client_properties.get("publish_mode", "copy")
+    publish_targets = get_publish_targets(client_properties)
+    staging_dirs = list()
+    try:
+        with tarfile.open(bundle_file, 'r|gz') as bundle:
+            metadata_info = bundle.next()
+            if metadata_info is None or metadata_info.name != _BUNDLE_METADATA:
+                raise ProcessException("{} is not a deployment bundle".format(bundle_file))
+            bundle_metadata = json.loads(bundle.extractfile(metadata_info).read().decode('utf-8'))
+            if bundle_metadata.get("bundle_version") != _BUNDLE_VERSION:
+                raise ProcessException("Unsupported bundle version {}".format(bundle_metadata.get("bundle_version")))
+            if bundle_metadata["client_id"] != ClientID:
+                raise ProcessException("Bundle was built for ClientID {}".format(bundle_metadata["client_id"]))
+
+            LOOKER_PROJECT_NAME = bundle_metadata["project_name"]
+            CONTENT_TARGET_DIR = os.path.join(client_properties["looker_location"], LOOKER_PROJECT_NAME)
+            debug("Installing bundle of Project {} built at {} on {}".format(
+                LOOKER_PROJECT_NAME, bundle_metadata["created_at"], bundle_metadata["build_host"]), _INFO)
+
+            project_dirs = list()
+            for publish_target in publish_targets:
+                if not prepare_viz_extn_dir(publish_target):
+                    raise ProcessException("Visualization extensions folder cannot be created")
+                content_target_dir = os.path.join(publish_target["looker_location"], LOOKER_PROJECT_NAME)
+                if publish_mode in ('rename', 'symlink'):
+                    staging_dir = create_staging_dir(publish_target, content_target_dir)
+                    if staging_dir is None:
+                        raise ProcessException("Staging folder cannot be created for {}".format(content_target_dir))
+                    staging_dirs.append(staging_dir)
+                    project_dirs.append(staging_dir)
+                else:
+                    os.makedirs(content_target_dir, exist_ok=True)
+                    project_dirs.append(content_target_dir)
+
+            bundle_files = bundle_metadata["files"]
+            installed_files = set()
+            # Iterating the archive would yield bundle.json again, stream continues with next member
+            for member_info in iter(bundle.next, None):
+                member_dir, fi = os.path.split(member_info.name)
+                if not member_info.isfile() or fi not in bundle_files or member_dir not in ('project', 'viz'):
+                    raise ProcessException("Unexpected bundle member {}".format(member_info.name))
+                file_data = bundle.extractfile(member_info).read()
+                if hashlib.sha256(file_data).hexdigest() != bundle_files[fi]["hash"]:
+                    raise ProcessException("Bundle file {} does not match its hash".format(member_info.name))
+
+                for publish_target, project_dir in zip(publish_targets, project_dirs):
+                    if member_dir == 'project':
+                        target_file = os.path.join(project_dir, fi)
+                    elif publish_target.get("looker_viz_extn_location", "None") != "None":
+                        target_file = os.path.join(publish_target["looker_viz_extn_location"], fi)
+                    else:
+                        debug("Visualization extension file {} will not be copied".format(fi), _WARNING)
+                        continue
+                    # Files are written next to target and renamed over it, readers never see partial file
+                    temp_file = os.path.join(os.path.dirname(target_file), '.' + fi + '.tmp')
+                    with open(temp_file, 'wb') as temp_fh:
+                        temp_fh.write(file_data)
+                    os.utime(temp_file, (member_info.mtime, member_info.mtime))
+                    os.replace(temp_file, target_file)
+                installed_files.add(fi)
+                add_stage_files()
+
+            missing_files = set(bundle_files) - installed_files
+            if missing_files:
+                raise ProcessException("Bundle is incomplete, missing files: {}".format(sorted(missing_files)))
+    except (ProcessException, OSError, tarfile.TarError, ValueError, KeyError) as e:
+        debug("Unable to install deployment bundle {}".format(bundle_file), _ERROR)
+        debug("Error: {}".format(str(e)), _ERROR)
+        for staging_dir in staging_dirs:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        return False
+
+    bundle_installed = True
+    for publish_target, staging_dir in zip(publish_targets, staging_dirs):
+        content_target_dir = os.path.join(publish_target["looker_location"], LOOKER_PROJECT_NAME)
+        if publish_mode == 'symlink':
+            bundle_installed = swap_content_symlink(publish_target, staging_dir, content_target_dir) and bundle_installed
+        else:
+            bundle_installed = swap_content_rename(staging_dir, content_target_dir) and bundle_installed
+    if not bundle_installed:
+        return False
+
+    _DEPLOYED_CONTENT.update(client_id=ClientID, snapshot_id=None, bundle_files=bundle_files,
+                             content_files=bundle_files, content_sources=bundle_metadata["repositories"])
+    write_json_build_manifests(client_properties, get_date_timestamp())
+    debug("***** Deployment bundle {} was installed into Project {}".format(bundle_file, LOOKER_PROJECT_NAME), _INFO)
+    return True
+
+def prepare_viz_extn_dir(client_properties):
+    """
+    :param client_properties:
+    :return: False if Visualization extensions folder is defined and cannot be created, True otherwise
+    """
+    visualization_extn_dir = client_properties.get("looker_viz_extn_location", "None")
+    if visualization_extn_dir != "None":
+        try:
+            os.makedirs(visualization_extn_dir, exist_ok=True)
+        except OSError as e:
+            debug("Cannot create Visualization extensions folder {}".format(visualization_extn_dir), _ERROR)
+            debug("Error: {}".format(str(e)), _ERROR)
+            debug("Traceback: {}".format(traceback.format_exc()))
+            return False
+    else:
+        debug("Visualization extension directory is not defined", _WARNING)
+    return True
 
-            debug("OOB Model file name without extension: {}".format(file_part), _DEBUG)
-            new_model_file_name = os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR, new_model_file_name_part)
+def publish_viz_extn_files(client_properties, viz_extn_files, replace_files):
+    """
+    Visualization extensions are shared between projects, each file is copied separately.
+    :param client_properties:
+    :param viz_extn_files: list of fully qualified Visualization extension file names
+    :param replace_files: True - files are replaced with rename, readers never see partially written file
+    :return:
+    """
+    link_files = client_properties.get("output_mode", "copy") == 'link'
+    visualization_extn_dir = client_properties.get("looker_viz_extn_location", "None")
+    for fi in viz_extn_files:
+        # Vizualization extensions files exist
+        debug("Vizualization extension file {} exists".format(fi), _INFO)
+        if visualization_extn_dir != "None":
+            debug("Copying Visualization extension file {} into folder {}".format(fi, visualization_extn_dir), _INFO)
             try:
-                debug("Renaming OOB Model file {} to {}".format(old_model_file_name, new_model_file_name), _INFO)
-                os.rename(old_model_file_name, new_model_file_name)
-            except OSError as e:
-                debug("Cannot rename old file: {} to \n new: {}".format(old_model_file_name, new_model_file_name), _ERROR)
-                debug("Error: {}".format(str(e)), _ERROR)
-                debug("Traceback: {}".format(traceback.format_exc()))
-                exit(1)
+                if replace_files:
+                    replace_file(fi, os.path.join(visualization_extn_dir, os.path.basename(fi)), link_files)
+                else:
+                    link_or_copy_file(fi, os.path.join(visualization_extn_dir, os.path.basename(fi)), link_files)
+            except IOError:
+                debug("Unable to copy file {} to folder {}".format(fi, visualization_extn_dir), _ERROR)
+        else:
+            debug("Visualization extension file {} will not be copied".format(fi), _WARNING)
 
-            # Collect renamed OOB Model file names for processing extended models
-            renamed_model_files.append(new_model_file_name_part)
+def get_publish_targets(client_properties):
+    """
+    Content is published into looker_location and Looker nodes defined in publish_targets property:
+        [{"looker_location": "<node Looker models folder>",
+          "looker_viz_extn_location": "<node Visualization extensions folder>"}]
+    :param client_properties:
+    :return: list of client properties of every publish target, the first one is looker_location
+    """
+    return [client_properties] + [{**client_properties, **publish_target}
+                                  for publish_target in client_properties.get("publish_targets") or list()]
 
-            # Process connection string in model file
-            debug("Renaming connections and extended OOB Model file names in file {}".format(new_model_file_name), _INFO)
-            debug(" New connection name: {}".format(replace_db_conn_name))
-            
-            debug("Search for OOB model files extended by PS to hide the explores in OOB model", _DEBUG)
-            hide_explores_in_model = 0 
-            prod_file = new_model_file_name_part[5:]
-            debug("Checking PROD FILE {} for hiding models ".format(prod_file), _DEBUG)
-            for ps_fi in ps_files:
-                ps_file_part = ps_fi[2:].split('.')[0]			
-                ps_file = ps_file_part + model_file_extension
-                debug("Checking against PS FILE {}".format(ps_file), _DEBUG)
-                if prod_file == ps_file:
-                    hide_explores_in_model = 1
-                    ps_model_file_name = os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR, ps_fi)
-                    break
+def run_publish_step(publish_target, publish_step, *step_args):
+    """
+    Function runs publish step for one publish target and retries it publish_retries times
+    with exponential backoff.
+    :param publish_target: client properties of publish target
+    :param publish_step: function of publish target properties and step arguments, returns false value on failure
+    :param step_args:
+    :return: publish step result
+    """
+    publish_retries = int(publish_target.get("publish_retries", 0))
+    retry_delay = float(publish_target.get("publish_retry_delay", 5))
+    for attempt in range(publish_retries + 1):
+        try:
+            step_result = publish_step(publish_target, *step_args)
+        except OSError as e:
+            debug("Publishing into {} failed: {}".format(publish_target["looker_location"], str(e)), _ERROR)
+            step_result = None
+        if step_result or attempt == publish_retries:
+            return step_result
+        debug("Publishing into {} will be retried in {} seconds, retry {} of {}".format(
+            publish_target["looker_location"], retry_delay * 2 ** attempt, attempt + 1, publish_retries), _WARNING)
+        time.sleep(retry_delay * 2 ** attempt)
+
+def publish_content_targets(client_properties, client_project_deployment_dir, project_name):
+    """
+    Function publishes prepared content into Looker Project folder of every publish target concurrently.
+    Failed targets are retried. If publish_all_or_nothing property is Y, content is staged and verified
+    on all targets first and Project folders are swapped only when every target was staged,
+    otherwise staged folders are removed and no target is changed. Project folders are swapped
+    with rename (or symlink flip in symlink publish mode) on every target.
+    :param client_properties:
+    :param client_project_deployment_dir: folder with prepared content
+    :param project_name: Looker Project name
+    :return: True if content was published into all targets
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
 
-            if (hide_oob_model_explores == 'Y') and (hide_explores_in_model == 1):			
-                debug("Hiding OOB explore(s) exists in {} model file as it is extended by {}".format(new_model_file_name,ps_model_file_name), _INFO)
-				
-            with fileinput.input(files=(new_model_file_name), inplace=True) as modf:
-                for line in modf:
-                    if (hide_oob_model_explores == 'Y') and (hide_explores_in_model == 1) :
-                        if line.lstrip().rstrip() == 'hidden: no':
-                            match_conn_string = re.sub(r'hidden: no', replace_hide_explore_condition, line)
-                        else:
-                            match_conn_string = re.sub(r'^\s*connection[:].+', replace_db_conn_name, line)
+    publish_targets = get_publish_targets(client_properties)
+    content_target_dirs = [os.path.join(publish_target["looker_location"], project_name) for publish_target in publish_targets]
+    all_or_nothing = client_properties.get("publish_all_or_nothing", "N") == 'Y'
+    debug("Publishing content into {} targets{}".format(len(publish_targets), ", all or nothing" if all_or_nothing else ""), _INFO)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(publish_targets)) as executor:
+        if not all_or_nothing:
+            target_results = list(executor.map(
+                lambda publish_target, content_target_dir: run_publish_step(
+                    publish_target, publish_content, client_project_deployment_dir, content_target_dir),
+                publish_targets, content_target_dirs))
+        else:
+            combined_content = get_files(client_project_deployment_dir, fpath=True)
+            content_files = [fi for fi in combined_content if not is_viz_extn_file(fi)]
+            viz_extn_files = [fi for fi in combined_content if is_viz_extn_file(fi)]
+            add_stage_files(len(combined_content))
+
+            # Phase 1 - stage and verify content on every target
+            def stage_target(publish_target, content_target_dir):
+                if not prepare_viz_extn_dir(publish_target):
+                    return None
+                return stage_content(publish_target, content_files, content_target_dir)
+            staging_dirs = list(executor.map(
+                lambda publish_target, content_target_dir: run_publish_step(publish_target, stage_target, content_target_dir),
+                publish_targets, content_target_dirs))
+            if not all(staging_dirs):
+                debug("Content was not staged on all targets. No target is changed", _ERROR)
+                for staging_dir in staging_dirs:
+                    if staging_dir:
+                        shutil.rmtree(staging_dir, ignore_errors=True)
+                target_results = [bool(staging_dir) for staging_dir in staging_dirs]
+            else:
+                # Phase 2 - swap staged content in on every target
+                def commit_target(publish_target, staging_dir, content_target_dir):
+                    if publish_target.get("publish_mode") == 'symlink':
+                        target_committed = swap_content_symlink(publish_target, staging_dir, content_target_dir)
                     else:
-                        match_conn_string = re.sub(r'^\s*connection[:].+', replace_db_conn_name, line)
+                        target_committed = swap_content_rename(staging_dir, content_target_dir)
+                    publish_viz_extn_files(publish_target, viz_extn_files, True)
+                    return target_committed
+                target_results = list(executor.map(commit_target, publish_targets, staging_dirs, content_target_dirs))
+
+    for content_target_dir, target_result in zip(content_target_dirs, target_results):
+        if target_result:
+            debug("Content was published into folder {}".format(content_target_dir), _INFO)
+        else:
+            debug("Content was not published into folder {}".format(content_target_dir), _ERROR)
+    return all(target_results)
 
-                    print(match_conn_string, end='')
+def stage_content(client_properties, content_files, content_target_dir):
+    """
+    Function copies content into staging folder next to Looker Project folder and verifies
+    staged files count and hashes against prepared content.
+    Staging folder is created on the same file system so it can be swapped in with rename.
+    :param client_properties:
+    :param content_files: list of fully qualified file names to stage
+    :param content_target_dir: Looker Project folder
+    :return: staging folder or None if content could not be staged
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
 
-        debug("Renamed OOB Model files: \n {}".format('\n'.join(renamed_model_files)), _INFO)
-        # Rename extended models in renamed model files
-        debug("Renaming OOB extended model file names in OOB Model files", _INFO)
-        for fi in renamed_model_files:
-            model_file_name = os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR, fi)
-            debug(" Processing OOB Model file {} for OOB extended model renaming".format(fi), _INFO)
-            with fileinput.input(files=(model_file_name), inplace=True) as modf:
-                for line in modf:
-                    match_extened_model_string = re.sub(r'^\s*include.+[.]model[.]lkml', line.split('.')[0] + '_' + ClientID + model_file_extension, line)
-                    print(match_extened_model_string, end='')
+    staging_dir = create_staging_dir(client_properties, content_target_dir)
+    if staging_dir is None:
+        return None
 
-        # Process and rename Custom Model files if required
-        rename_cust_models = client_properties.get("existing_model_deployment_id", None)
-        if rename_cust_models is not None:
-            existing_model_deployment_id = client_properties["existing_model_deployment_id"]
-            if existing_model_deployment_id and custom_model_files:
-                # Initialize list for renamed custom Model files. Need it for renaming referenced models
-                renamed_custom_model_files = list()
-
-                debug("Custom Models will be renamed:", _INFO)
-                debug(" Existing deployment id _{} will be replaced with _{}".format(
-                    existing_model_deployment_id, ClientID), _INFO)
-                debug("Custom Model files to be renamed: {}".format(custom_model_files), _DEBUG)
-                for cfi in custom_model_files:
-                    debug("Processing Custom Model file {} in Multi Tenant mode".format(cfi), _INFO)
-                    file_part = cfi.split('.')[0]
-                    debug("Custom Model file part: {}".format(file_part), _DEBUG)
-
-                    # Check if file part contains existing custom model token or not
-                    match_model_file_part = re.compile(r'_({0})$'.format(existing_model_deployment_id))
-                    if match_model_file_part.search(file_part):
-                        debug("Custom Model file {} contains deployment id: {}".format(file_part, existing_model_deployment_id), _DEBUG)
-
-                        new_custom_model_file_name_part = file_part.replace(existing_model_deployment_id, ClientID) + model_file_extension
-                        debug("New Custom Model file name: {}".format(new_custom_model_file_name_part), _DEBUG)
-                        old_custom_model_file_name = os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR, cfi)
-                        new_custom_model_file_name = os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR, new_custom_model_file_name_part)
-                        debug("Renaming Custom Model file {} to {}".format(old_custom_model_file_name, new_custom_model_file_name), _INFO)
-                        os.rename(old_custom_model_file_name, new_custom_model_file_name)
-                        # Collect renamed Custom Model files for renaming referenced models
-                        renamed_custom_model_files.append(new_custom_model_file_name)
-                    else:
-                        debug("Custom Model file {} has no deployment id: {}".format(file_part, existing_model_deployment_id), _DEBUG)
-
-                        new_custom_model_file_name_part = file_part + '_' + ClientID + model_file_extension
-                        debug("New Custom Model file name: {}".format(new_custom_model_file_name_part), _DEBUG)
-                        old_custom_model_file_name = os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR, cfi)
-                        new_custom_model_file_name = os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR, new_custom_model_file_name_part)
-                        debug("Renaming Custom Model file {} to {}".format(old_custom_model_file_name, new_custom_model_file_name), _INFO)
-                        os.rename(old_custom_model_file_name, new_custom_model_file_name)
-                        # Collect renamed Custom Model files for renaming referenced models
-                        renamed_custom_model_files.append(new_custom_model_file_name)
-
-                    debug("********************************************************************************")
-
-                # Rename referenced model files
-                debug("Process in-file references:: Renaming OOB extended Model files in Custom Model files", _INFO)
-                for rfi in renamed_custom_model_files:
-                    debug(" Processing Custom Model file {} for OOB extended model renaming".format(rfi), _INFO)
-                    match_ext_cust_model = re.compile(r'(^\s*include:.+_)({0})([.]model[.]lkml)'.format(existing_model_deployment_id))
-                    with fileinput.input(files=(rfi), inplace=True) as cmodf:
-                        for line in cmodf:
-                            print(match_ext_cust_model.sub(r'\1{0}\3'.format(ClientID), line), end='')
-
-                debug("Renaming connections in Custom Model files", _INFO)
-                for rfi in renamed_custom_model_files:
-                    debug(" Processing Custom Model file {} for connection renaming".format(rfi), _INFO)
-                    with fileinput.input(files=(rfi), inplace=True) as cmodf:
-                        for line in cmodf:
-                            match_conn_string = re.sub(r'^\s*connection[:].+', replace_db_conn_name, line)
-                            print(match_conn_string, end='')
-
-                # Rename referenced models without deployment id
-                for rfi in renamed_custom_model_files:
-                    debug(" Processing Custom Model file {} for renaming Custom extended model without deployment id".format(rfi), _INFO)
-                    match_ext_cust_model = re.compile('^((?!{0}).)*model[.]lkml$'.format(existing_model_deployment_id))
-                    with fileinput.input(files=(rfi), inplace=True) as cmodf:
-                        for line in cmodf:
-                            match_no_dep_id = re.sub('^\s*include:\s\".*(?<!{0})\.model\.lkml\"$'.format(ClientID),
-                                                     line.split('.')[0] + '_' + ClientID + model_file_extension + '"',
-                                                     line)
-                            print(match_no_dep_id, end='')
+    debug("Staging content into folder {}".format(staging_dir), _INFO)
+    try:
+        link_files = client_properties.get("output_mode", "copy") == 'link'
+        for fi in content_files:
+            link_or_copy_file(fi, os.path.join(staging_dir, os.path.basename(fi)), link_files)
+    except OSError as e:
+        debug("Unable to stage content into folder {}".format(staging_dir), _ERROR)
+        debug("Error: {}".format(str(e)), _ERROR)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        return None
+
+    # Verify staged content before it becomes visible to Looker. Staging folder also holds seeded files
+    for fi in content_files:
+        staged_file = os.path.join(staging_dir, os.path.basename(fi))
+        if not os.path.isfile(staged_file) or get_file_hash(staged_file) != get_file_hash(fi):
+            debug("Staged file {} does not match prepared file {}".format(staged_file, fi), _ERROR)
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            return None
+
+    debug("Staged {} files were verified in folder {}".format(len(content_files), staging_dir), _INFO)
+    return staging_dir
+
+def create_staging_dir(client_properties, content_target_dir):
+    """
+    Function creates staging folder on the same file system as Looker Project folder,
+    a new release folder in symlink publish mode. Staging folder is seeded with current content
+    of Looker Project folder, so the swap keeps files not produced by this build.
+    :param client_properties:
+    :param content_target_dir: Looker Project folder
+    :return: staging folder or None if it could not be created
+    """
+    looker_location, project_name = os.path.split(os.path.normpath(content_target_dir))
+    try:
+        if client_properties.get("publish_mode") == 'symlink':
+            # Every staged folder becomes a release the Project folder symlink points to
+            releases_dir = os.path.join(looker_location, '.' + project_name + '.releases')
+            os.makedirs(releases_dir, exist_ok=True)
+            staging_dir = tempfile.mkdtemp(prefix=get_date_timestamp()[1:] + '_', dir=releases_dir)
+        else:
+            staging_dir = tempfile.mkdtemp(prefix='.' + project_name + '.staging' + get_date_timestamp() + '_',
+                                           dir=looker_location)
+        # mkdtemp creates folder accessible by owner only
+        os.chmod(staging_dir, 0o755)
+    except OSError as e:
+        debug("Unable to create staging folder in {}".format(looker_location), _ERROR)
+        debug("Error: {}".format(str(e)), _ERROR)
+        return None
+
+    try:
+        seeded_files = seed_staging_dir(content_target_dir, staging_dir)
+    except OSError as e:
+        debug("Unable to seed staging folder {} from {}".format(staging_dir, content_target_dir), _ERROR)
+        debug("Error: {}".format(str(e)), _ERROR)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        return None
+    debug("Staging folder {} was seeded with {} files of current content".format(staging_dir, seeded_files), _INFO)
+    return staging_dir
+
+def seed_staging_dir(content_target_dir, staging_dir):
+    """
+    Function fills staging folder with current content of Looker Project folder: content of other
+    products, earlier build manifests, .git and hand placed files. Files are hardlinked, staged files
+    are never written in place, they are removed before prepared content is linked or copied over them.
+    :param content_target_dir: Looker Project folder, symlink is followed
+    :param staging_dir: empty staging folder
+    :return: number of seeded files
+    """
+    if not os.path.isdir(content_target_dir):
+        return 0
+
+    current_dir = os.path.realpath(content_target_dir)
+    seeded_files = 0
+    for root, directories, files in os.walk(current_dir):
+        staged_root = os.path.join(staging_dir, os.path.relpath(root, current_dir))
+        for di in directories:
+            current_path = os.path.join(root, di)
+            if os.path.islink(current_path):
+                os.symlink(os.readlink(current_path), os.path.join(staged_root, di))
+            else:
+                os.mkdir(os.path.join(staged_root, di))
+                shutil.copymode(current_path, os.path.join(staged_root, di))
+        for fi in files:
+            current_path = os.path.join(root, fi)
+            if os.path.islink(current_path):
+                os.symlink(os.readlink(current_path), os.path.join(staged_root, fi))
+            else:
+                link_or_copy_file(current_path, os.path.join(staged_root, fi))
+            seeded_files += 1
+    return seeded_files
+
+def swap_content_rename(staging_dir, content_target_dir):
+    """
+    Function swaps verified staging folder with Looker Project folder.
+    Uses atomic exchange of both folders if supported by the OS, otherwise two consecutive renames.
+    Previous content is kept in .<project>.previous folder.
+    :param staging_dir:
+    :param content_target_dir:
+    :return: True/False
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+
+    looker_location, project_name = os.path.split(os.path.normpath(content_target_dir))
+    previous_dir = os.path.join(looker_location, '.' + project_name + '.previous')
 
+    try:
+        if os.path.isdir(previous_dir) and not os.path.islink(previous_dir):
+            shutil.rmtree(previous_dir)
+
+        if os.path.islink(content_target_dir):
+            # Switching from symlink publish mode. Link is replaced, releases are left in place
+            debug("Project folder {} is a symlink. It will be replaced with folder".format(content_target_dir), _INFO)
+            if exchange_paths(staging_dir, content_target_dir):
+                # staging_dir now holds the symlink
+                os.unlink(staging_dir)
+            else:
+                os.unlink(content_target_dir)
+                os.rename(staging_dir, content_target_dir)
+        elif os.path.isdir(content_target_dir):
+            if exchange_paths(staging_dir, content_target_dir):
+                debug("Project folder {} was swapped atomically".format(content_target_dir), _INFO)
             else:
-                debug("Custom Model files will not be renamed", _INFO)
+                debug("Atomic exchange is not supported. Swapping Project folder with rename", _INFO)
+                os.rename(content_target_dir, staging_dir + '.old')
+                os.rename(staging_dir, content_target_dir)
+                staging_dir = staging_dir + '.old'
+            # staging_dir now holds previous content
+            os.rename(staging_dir, previous_dir)
         else:
-            debug(
-                "Parameter existing_model_deployment_id is not defined. Custom Models won't be renamed", _INFO)
+            debug("Folder {} does not exist. Creating it from staged content".format(content_target_dir), _INFO)
+            os.rename(staging_dir, content_target_dir)
+    except OSError as e:
+        debug("Cannot swap staged folder {} with {}".format(staging_dir, content_target_dir), _ERROR)
+        debug("Error: {}".format(str(e)), _ERROR)
+        debug("Traceback: {}".format(traceback.format_exc()))
+        if os.path.isdir(staging_dir) and not os.path.islink(staging_dir):
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        return False
 
-    # Process Dashboard and Document files based on Model name
-    debug("*********************************************************************")
-    debug("***** Processing Dashboard and Document files", _INFO)
-    document_files = list()
-    for mi in app_models:
-        debug("Processing files for Model: {}".format(mi), _DEBUG)
-        debug("Extract token from Model name for Dashboard name matching", _INFO)
+    debug("Content was published into folder {}".format(content_target_dir), _INFO)
+    return True
 
-        _model_pos = mi.find('model')
-        _base_pos = mi.find('base')
-        # ignore models with no dashboards - common models (base_cpq_clm_base_explores)
-        # they do not contain _model suffix, only base_
-        if _model_pos < 0: continue
+def swap_content_symlink(client_properties, release_dir, content_target_dir):
+    """
+    Function flips Looker Project folder symlink to verified release folder.
+    If Project folder is a regular folder it is atomically replaced by symlink and kept as a release.
+    Keeps publish_keep_releases most recent releases for rollback.
+    :param client_properties:
+    :param release_dir:
+    :param content_target_dir:
+    :return: True/False
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
 
-        dashboard_document_token = mi[_base_pos + len('base') + 1:_model_pos - 1]
+    looker_location, project_name = os.path.split(os.path.normpath(content_target_dir))
+    releases_dir = os.path.dirname(release_dir)
+    temp_link = os.path.join(looker_location, '.' + project_name + '.link' + get_date_timestamp())
+    # Relative link keeps project valid if looker_location is mounted under a different path
+    link_value = os.path.relpath(release_dir, looker_location)
+
+    try:
+        os.symlink(link_value, temp_link)
+        if os.path.isdir(content_target_dir) and not os.path.islink(content_target_dir):
+            debug("Project folder {} is a regular folder. It will be replaced with symlink".format(content_target_dir), _INFO)
+            if exchange_paths(temp_link, content_target_dir):
+                # temp_link now holds previous content folder
+                os.rename(temp_link, os.path.join(releases_dir, 'previous' + get_date_timestamp()))
+            else:
+                debug("Atomic exchange is not supported. Replacing Project folder with rename", _INFO)
+                os.rename(content_target_dir, os.path.join(releases_dir, 'previous' + get_date_timestamp()))
+                os.replace(temp_link, content_target_dir)
+        else:
+            # rename over existing symlink is atomic
+            os.replace(temp_link, content_target_dir)
+    except OSError as e:
+        debug("Cannot flip Project folder {} to release {}".format(content_target_dir, release_dir), _ERROR)
+        debug("Error: {}".format(str(e)), _ERROR)
+        debug("Traceback: {}".format(traceback.format_exc()))
+        if os.path.islink(temp_link):
+            os.unlink(temp_link)
+        return False
 
-        # Uncomment below debug commands for troubleshooting
-        debug("Dashboard token - {}".format(dashboard_document_token), _DEBUG)
-        debug("Document token - {}".format(dashboard_document_token), _DEBUG)
+    debug("Project folder {} points to release {}".format(content_target_dir, release_dir), _INFO)
 
-        debug("Processing PS dashboards and documents based on c_ prefix", _INFO)
-        debug("There might not be any PS files as PS content is optional", _INFO)
-        for fi in all_content_files:
-            #if re.search('^c_({0})\S+dashboard[.]lookml'.format(dashboard_document_token), fi):
-            if re.search('^c_\S+[.]dashboard[.]lookml', fi):
-                debug(" Copying PS dashboard file: {} to {}".format(fi, CLIENT_PROJECT_DEPLOYMENT_DIR), _INFO)
-                shutil.copy2(os.path.join(ps_repo_location, fi), CLIENT_PROJECT_DEPLOYMENT_DIR)
+    # Remove old releases
+    keep_releases = int(client_properties.get("publish_keep_releases", 2))
+    releases = sorted([os.path.join(releases_dir, d) for d in os.listdir(releases_dir)], key=os.path.getmtime, reverse=True)
+    for ri in releases[keep_releases:]:
+        if ri != release_dir:
+            debug("Removing old release {}".format(ri), _DEBUG)
+            shutil.rmtree(ri, ignore_errors=True)
 
-            if re.search('^c_\S+readme[.]md'.format(dashboard_document_token), fi):
-                debug(" Copying PS document file: {} to ".format(fi, CLIENT_PROJECT_DEPLOYMENT_DIR), _INFO)
+    return True
 
-                document_file_name = os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR, fi)
-                document_files.append(document_file_name)
-                shutil.copy2(os.path.join(ps_repo_location, fi), CLIENT_PROJECT_DEPLOYMENT_DIR)
+def exchange_paths(path_a, path_b):
+    """
+    Function atomically exchanges two paths using renameat2 RENAME_EXCHANGE (Linux).
+    :param path_a:
+    :param path_b:
+    :return: True if paths were exchanged, False if atomic exchange is not supported
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        renameat2 = libc.renameat2
+    except (OSError, AttributeError):
+        return False
 
-        debug("Processing OOB dashboards and documents based on token: {}".format(dashboard_document_token), _INFO)
-        for fi in all_content_files:
-            if re.search('^(base_\S*{0}\S+)dashboard[.]lookml'.format(dashboard_document_token), fi):
-                debug(" Copying OOB Prod dashboard file: {} to {}".format(fi, CLIENT_PROJECT_DEPLOYMENT_DIR))
-                shutil.copy2(os.path.join(prod_repo_location, fi), CLIENT_PROJECT_DEPLOYMENT_DIR)
+    renameat2.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    if renameat2(_AT_FDCWD, os.fsencode(path_a), _AT_FDCWD, os.fsencode(path_b), _RENAME_EXCHANGE) != 0:
+        err = ctypes.get_errno()
+        if err in (errno.ENOSYS, errno.EINVAL, errno.ENOTSUP):
+            return False
+        raise OSError(err, os.strerror(err), path_a)
+    return True
 
-            if re.search('^({0})[_]readme[.]md'.format(dashboard_document_token), fi):
-                debug(" Copying OOB Prod document file: {} to {}".format(fi, CLIENT_PROJECT_DEPLOYMENT_DIR), _INFO)
+def replace_file(source_file, target_file, link_files=False):
+    """
+    Function copies file next to target file and renames it over target file,
+    so readers never see partially written file.
+    :param source_file:
+    :param target_file:
+    :param link_files: True - hardlink source file instead of copy if possible
+    :return:
+    """
+    temp_file = os.path.join(os.path.dirname(target_file), '.' + os.path.basename(target_file) + '.tmp')
+    link_or_copy_file(source_file, temp_file, link_files)
+    os.replace(temp_file, target_file)
 
-                document_file_name = os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR, fi)
-                document_files.append(document_file_name)
-                shutil.copy2(os.path.join(prod_repo_location, fi), CLIENT_PROJECT_DEPLOYMENT_DIR)
+# Modulus of adler32 weak checksum
+_ADLER_MOD = 65521
 
-        debug("*********************************************************************")
+def get_block_signatures(file_data, block_size):
+    """
+    :param file_data: bytes
+    :param block_size:
+    :return: list of [weak adler32 checksum, strong sha256 hash] of file blocks, the last block may be shorter
+    """
+    return [[zlib.adler32(file_data[offset:offset + block_size]),
+             hashlib.sha256(file_data[offset:offset + block_size]).hexdigest()]
+            for offset in range(0, len(file_data), block_size)]
 
-    # Search through document files for dashboard links and replace model names
-    if client_properties["single_tenant_deployment"] == 'N':
-        debug("Search document files for dashboard links and replace model names", _INFO)
-        for dfi in document_files:
-            for dmodelIter in old_model_name:
-                debug("Searching Document file {} for model name {}".format(dfi, dmodelIter), _DEBUG)
-                replace_model_name = dmodelIter + '_' + ClientID
-                match_model_name = re.compile(r'(.*[/]dashboards[/])({0})(([/]|::)\S+)'.format(dmodelIter))
-                debug(" Replacing model: {} with new model: {}".format(dmodelIter, replace_model_name), _DEBUG)
-                with fileinput.input(files=(dfi), inplace=True) as modf:
-                    for line in modf:
-                        print(match_model_name.sub(r'\1{0}\3'.format(replace_model_name), line), end='')
-
-    # Copy View files
-    debug("*********************************************************************")
-    debug("*** Processing Views files based on Product {} view prefix".format(client_properties["product_prefix"]))
-    view_files = list()
-    prod_views_prefix = get_product_view_prefix(client_properties)
-    for vi in prod_views_prefix:
+def get_delta_instructions(source_data, block_signatures, block_size):
+    """
+    Function matches source data against block signatures of target file the way rsync does:
+    weak adler32 checksum of window rolled over every source offset, confirmed by strong hash.
+    :param source_data: bytes
+    :param block_signatures: signatures of target file blocks
+    :param block_size:
+    :return: list of ('copy', target offset, length) and ('data', source offset, length) instructions
+    """
+    blocks_by_weak = dict()
+    for block_index, (weak, strong) in enumerate(block_signatures):
+        blocks_by_weak.setdefault(weak, list()).append((block_index, strong))
+
+    instructions = list()
+    def add_instruction(kind, offset, length):
+        last = instructions[-1] if instructions else None
+        if last is not None and last[0] == kind and last[1] + last[2] == offset:
+            instructions[-1] = (kind, last[1], last[2] + length)
+        else:
+            instructions.append((kind, offset, length))
+
+    source_size = len(source_data)
+    position = 0
+    literal_start = 0
+    weak = None
+    while position < source_size:
+        window_size = min(block_size, source_size - position)
+        if weak is None:
+            weak = zlib.adler32(source_data[position:position + window_size])
+        matched_block = None
+        for block_index, strong in blocks_by_weak.get(weak, ()):
+            block_length = min(block_size, source_size - position)
+            if hashlib.sha256(source_data[position:position + block_length]).hexdigest() == strong:
+                matched_block = block_index
+                break
+        if matched_block is not None:
+            if literal_start < position:
+                add_instruction('data', literal_start, position - literal_start)
+            add_instruction('copy', matched_block * block_size, window_size)
+            position += window_size
+            literal_start = position
+            weak = None
+            continue
+
+        if window_size < block_size or position + block_size >= source_size:
+            # Window at the end of source is not rolled, it only shrinks
+            position += 1
+            weak = None
+            continue
+        # Roll window by one byte
+        a, b = weak & 0xffff, weak >> 16
+        out_byte, in_byte = source_data[position], source_data[position + block_size]
+        a = (a - out_byte + in_byte) % _ADLER_MOD
+        b = (b - block_size * out_byte + a - 1) % _ADLER_MOD
+        weak = (b << 16) | a
+        position += 1
+
+    if literal_start < source_size:
+        add_instruction('data', literal_start, source_size - literal_start)
+    return instructions
+
+def copy_file_range(source_fd, target_fd, length, source_offset, target_offset):
+    """
+    Function copies range of file with copy_file_range, done by the server on NFS 4.2 and SMB mounts.
+    :return: True if the whole range was copied, False if copy_file_range is not supported
+    """
+    if not hasattr(os, "copy_file_range"):
+        return False
+    try:
+        while length > 0:
+            copied = os.copy_file_range(source_fd, target_fd, length, source_offset, target_offset)
+            if copied == 0:
+                return False
+            length -= copied
+            source_offset += copied
+            target_offset += copied
+    except OSError as e:
+        if e.errno in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL):
+            return False
+        raise
+    return True
+
+def delta_copy_file(source_file, target_file, signatures_dir, block_size=2048):
+    """
+    Function transfers source file into existing target file on slow or remote file system the way rsync does.
+    Block signatures of target file are kept locally, so target file is not read to find changes. Source file
+    is matched against them with rolling checksums. New file is built next to target file: matched blocks are
+    copied from target file with copy_file_range (server side copy on remote mounts), changed data is written.
+    Its hash is verified and it is renamed over target file, so target file is never written in place.
+    Missing or stale signatures (target file size or modification time changed) are computed from target file.
+    :param source_file:
+    :param target_file:
+    :param signatures_dir: local folder of block signatures
+    :param block_size:
+    :return: number of bytes written to target file system
+    """
+    with open(source_file, 'rb') as source_fh:
+        source_data = source_fh.read()
+    source_hash = hashlib.sha256(source_data).hexdigest()
 
-        debug("Processing views with prefix {} from PS content".format(vi), _INFO)
-        debug("There might not be any PS files as PS content is optional", _INFO)
-        for fi in all_content_files:
+    signature_file = os.path.join(signatures_dir,
+                                  hashlib.sha256(os.path.abspath(target_file).encode('utf-8')).hexdigest() + '.json')
+    try:
+        target_stat = os.stat(target_file)
+    except FileNotFoundError:
+        target_stat = None
 
-            if re.search('^c_\S+[.]view[.]lkml', fi):
-                debug("Copying PS view file: {} to {}".format(fi, CLIENT_PROJECT_DEPLOYMENT_DIR), _INFO)
-                shutil.copy2(os.path.join(ps_repo_location, fi), CLIENT_PROJECT_DEPLOYMENT_DIR)
+    bytes_written = len(source_data)
+    if target_stat is None:
+        replace_file(source_file, target_file)
+    else:
+        target_signature = None
+        try:
+            with open(signature_file, 'r') as sfh:
+                target_signature = json.load(sfh)
+        except (OSError, ValueError):
+            pass
+        if target_signature is None or target_signature["block_size"] != block_size or \
+                target_signature["size"] != target_stat.st_size or target_signature["mtime_ns"] != target_stat.st_mtime_ns:
+            debug("Block signatures of {} are computed from target file".format(target_file), _DEBUG)
+            with open(target_file, 'rb') as target_fh:
+                target_data = target_fh.read()
+            target_signature = {"hash": hashlib.sha256(target_data).hexdigest(), "block_size": block_size,
+                                "blocks": get_block_signatures(target_data, block_size)}
+
+        if target_signature["hash"] == source_hash:
+            bytes_written = 0
+        else:
+            bytes_written = 0
+            temp_file = os.path.join(os.path.dirname(target_file), '.' + os.path.basename(target_file) + '.tmp')
+            target_fd = os.open(target_file, os.O_RDONLY)
+            try:
+                temp_fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                try:
+                    output_offset = 0
+                    for kind, offset, length in get_delta_instructions(source_data, target_signature["blocks"], block_size):
+                        if kind == 'data' or not copy_file_range(target_fd, temp_fd, length, offset, output_offset):
+                            # Matched block has the same data as source, it is written from source
+                            data_offset = offset if kind == 'data' else output_offset
+                            os.pwrite(temp_fd, source_data[data_offset:data_offset + length], output_offset)
+                            bytes_written += length
+                        output_offset += length
+                    os.fsync(temp_fd)
+                finally:
+                    os.close(temp_fd)
+            finally:
+                os.close(target_fd)
+
+            if get_file_hash(temp_file) != source_hash:
+                debug("File {} does not match {} after delta transfer. It will be copied".format(target_file, source_file), _WARNING)
+                os.unlink(temp_file)
+                replace_file(source_file, target_file)
+                bytes_written = len(source_data)
+            else:
+                shutil.copystat(source_file, temp_file)
+                os.replace(temp_file, target_file)
+
+    # Signatures of transferred file are computed from local source data
+    target_stat = os.stat(target_file)
+    os.makedirs(signatures_dir, exist_ok=True)
+    temp_signature_file = signature_file + '.tmp{}'.format(os.getpid())
+    with open(temp_signature_file, 'w') as sfh:
+        json.dump({"target_file": os.path.abspath(target_file), "size": target_stat.st_size,
+                   "mtime_ns": target_stat.st_mtime_ns, "hash": source_hash, "block_size": block_size,
+                   "blocks": get_block_signatures(source_data, block_size)}, sfh)
+    os.replace(temp_signature_file, signature_file)
+    return bytes_written
+
+def link_or_copy_file(source_file, target_file, link_files=True):
+    """
+    Function materializes source file as target file with hardlink, falls back to reflink
+    on different file system and to copy if reflinks are not supported.
+    Existing target file is removed first: it might be hardlinked to content store object
+    and must never be written in place.
+    :param source_file:
+    :param target_file:
+    :param link_files: False - always copy
+    :return: link, reflink or copy
+    """
+    try:
+        os.unlink(target_file)
+    except FileNotFoundError:
+        pass
+
+    if link_files:
+        try:
+            os.link(source_file, target_file)
+            return 'link'
+        except OSError:
+            pass
+        try:
+            with open(source_file, 'rb') as source_fh, open(target_file, 'wb') as target_fh:
+                fcntl.ioctl(target_fh.fileno(), _FICLONE, source_fh.fileno())
+            shutil.copystat(source_file, target_file)
+            return 'reflink'
+        except OSError:
+            pass
+
+    shutil.copy2(source_file, target_file)
+    return 'copy'
+
+def get_file_hash(file_name, block_size=65536):
+    """
+    :param file_name:
+    :param block_size:
+    :return: sha256 hex digest of file content
+    """
+    file_hash = hashlib.sha256()
+    with open(file_name, 'rb') as fh:
+        for block in iter(lambda: fh.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+def get_content_store_dir(client_properties):
+    """
+    :param client_properties:
+    :return: content store folder under Looker deployment base
+    """
+    return os.path.join(os.path.expanduser(client_properties["looker_deployment_base"]),
+                        client_properties.get("content_store_directory", "content_store"))
+
+def store_content_object(content_store_dir, file_name):
+    """
+    Function stores file in content store once by its hash. Stored objects are shared
+    by hardlinks between snapshots, so they must never be modified in place.
+    :param content_store_dir:
+    :param file_name:
+    :return: file hash
+    """
+    file_hash = get_file_hash(file_name)
+    object_file = os.path.join(content_store_dir, "objects", file_hash[:2], file_hash)
+
+    if not os.path.isfile(object_file):
+        os.makedirs(os.path.dirname(object_file), exist_ok=True)
+        temp_file = object_file + '.tmp{}'.format(os.getpid())
+        link_or_copy_file(file_name, temp_file)
+        os.replace(temp_file, object_file)
+
+    return file_hash
+
+def store_content_data(content_store_dir, content_data):
+    """
+    Function stores rendered file content in content store once by its hash.
+    :param content_store_dir:
+    :param content_data: file content bytes
+    :return: file hash
+    """
+    file_hash = hashlib.sha256(content_data).hexdigest()
+    object_file = os.path.join(content_store_dir, "objects", file_hash[:2], file_hash)
+
+    if not os.path.isfile(object_file):
+        os.makedirs(os.path.dirname(object_file), exist_ok=True)
+        temp_fd, temp_file = tempfile.mkstemp(prefix=file_hash + '.tmp', dir=os.path.dirname(object_file))
+        with os.fdopen(temp_fd, 'wb') as temp_fh:
+            temp_fh.write(content_data)
+        os.chmod(temp_file, 0o644)
+        os.replace(temp_file, object_file)
 
-        debug("Processing views with prefix {} from OOB PROD content".format(vi), _INFO)
-        for fi in all_content_files:
-            if re.search('^base_({0})\S+view[.]lkml'.format(vi), fi):
+    return file_hash
 
-                debug("Copying OOB Prod view file: {} to {}".format(fi, CLIENT_PROJECT_DEPLOYMENT_DIR), _INFO)
-                view_file_name = os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR, fi)
-                view_files.append(view_file_name)
-                # Copy view files
-                shutil.copy2(os.path.join(prod_repo_location, fi), CLIENT_PROJECT_DEPLOYMENT_DIR)
+def link_content_object(content_store_dir, file_hash, target_file):
+    """
+    Function materializes stored object as target file using hardlink, falls back to reflink or copy.
+    :param content_store_dir:
+    :param file_hash:
+    :param target_file:
+    :return:
+    """
+    object_file = os.path.join(content_store_dir, "objects", file_hash[:2], file_hash)
+    link_or_copy_file(object_file, target_file)
 
-    debug("Content is copied into folder {}".format(CLIENT_PROJECT_DEPLOYMENT_DIR), _INFO)
-    debug("*********************************************************************")
+def get_snapshots_dir(client_properties, ClientID, project_name):
+    """
+    :param client_properties:
+    :param ClientID:
+    :param project_name:
+    :return: folder holding snapshot manifests of Client Project
+    """
+    return os.path.join(get_content_store_dir(client_properties), "snapshots", ClientID, project_name)
 
-    # Search through view files for dashboard links and replace model names
-    if client_properties["single_tenant_deployment"] == 'N':
-        debug("Search view files for dashboard links and replace model names", _INFO)
-
-        for fi in view_files:
-            for modelIter in old_model_name:
-                # uncomment for debugging
-                #debug("Searching view file {} for model name {}".format(fi, modelIter), _DEBUG)
-                replace_model_name = modelIter + '_' + ClientID
-                match_model_name = re.compile(r'(.*[/]dashboards[/])({0})(([/]|::)\S+)'.format(modelIter))
-                #debug(" Replacing model: {} with new model: {}".format(modelIter, replace_model_name), _DEBUG)
-                with fileinput.input(files=(fi), inplace=True) as modf:
-                    for line in modf:
-                        print(match_model_name.sub(r'\1{0}\3'.format(replace_model_name), line), end='')
-
-        debug("Completed view files search and replacement.", _INFO)
-    debug("*********************************************************************")
+def list_deployment_snapshots(client_properties, ClientID, project_name):
+    """
+    :param client_properties:
+    :param ClientID:
+    :param project_name:
+    :return: list of snapshot ids, oldest first
+    """
+    snapshots_dir = get_snapshots_dir(client_properties, ClientID, project_name)
+    if not os.path.isdir(snapshots_dir):
+        return list()
+    return sorted([f[:-len('.json')] for f in get_files(snapshots_dir, fpath=False) if f.endswith('.json')])
 
-	# Copy Visualization Extension files
-    debug("*** Processing Visualization Extension files for Product {} ".format(client_properties["product_prefix"]))
-    app_deployment_base = client_properties.get("looker_deployment_base")
-    product_deployed = client_properties["product_prefix"]
-    visual_ext_files = client_properties[product_deployed].get("visual_ext_files")
+def get_deployed_snapshot(client_properties, ClientID, project_name):
+    """
+    :param client_properties:
+    :param ClientID:
+    :param project_name:
+    :return: id of snapshot deployed by the last deployment or rollback, the latest snapshot if it is not recorded
+    """
+    snapshots = list_deployment_snapshots(client_properties, ClientID, project_name)
+    try:
+        with open(os.path.join(get_snapshots_dir(client_properties, ClientID, project_name), "deployed"), 'r') as dfh:
+            snapshot_id = dfh.read().strip()
+    except OSError:
+        snapshot_id = None
+    if snapshot_id in snapshots:
+        return snapshot_id
+    return snapshots[-1] if snapshots else None
+
+def set_deployed_snapshot(client_properties, ClientID, project_name, snapshot_id):
+    """
+    :param client_properties:
+    :param ClientID:
+    :param project_name:
+    :param snapshot_id: id of snapshot which is deployed
+    :return:
+    """
+    deployed_file = os.path.join(get_snapshots_dir(client_properties, ClientID, project_name), "deployed")
+    temp_file = deployed_file + '.tmp{}'.format(os.getpid())
+    with open(temp_file, 'w') as dfh:
+        dfh.write(snapshot_id)
+    os.replace(temp_file, deployed_file)
 
-    d3_files_location = client_properties.get("d3_files_location")
-    if d3_files_location is None:
-        debug("Parameter d3_files_location does not exist in internal properties file", _WARNING)
-        d3_files_dir = "foo"
-    else:
-        d3_files_dir = os.path.join(app_deployment_base, d3_files_location)
+def read_deployment_snapshot(client_properties, ClientID, project_name, snapshot_id):
+    """
+    :param client_properties:
+    :param ClientID:
+    :param project_name:
+    :param snapshot_id:
+    :return: snapshot manifest dictionary
+    """
+    snapshot_file = os.path.join(get_snapshots_dir(client_properties, ClientID, project_name), snapshot_id + '.json')
+    with open(snapshot_file, 'r') as sfh:
+        return json.load(sfh)
 
-    if os.path.isdir(d3_files_dir):
-        debug("Get Visualisation extension files from central location: {}".format(d3_files_dir), _INFO)
-        if visual_ext_files is None:
-            debug("All Visual Extension files will be deployed for Product: {}".format(product_deployed), _INFO)
-            d3_files = get_files(os.path.join(d3_files_dir), fpath=False)
-        else:
-            debug("Selected Visual Extension files will be deployed for Product: {}".format(product_deployed), _INFO)
-            debug('\n'.join(visual_ext_files))
-            _d3_files = get_files(os.path.join(d3_files_dir), fpath=False)
-            d3_files = [f for f in _d3_files if f in visual_ext_files]
+def create_deployment_snapshot(client_properties, ClientID, project_name, project_deployment_dir, deployed=True):
+    """
+    Function stores Client Project deployment folder content in content store and writes snapshot manifest.
+    Snapshot is not created if content is the same as in the latest or deployed snapshot.
+    :param client_properties:
+    :param ClientID:
+    :param project_name:
+    :param project_deployment_dir:
+    :param deployed: True - returned snapshot is recorded as deployed, content was published into Looker Project folder
+    :return: snapshot id
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
 
-        #debug("Visualization files: \n{}".format('\n'.join(d3_files)))
-        #debug("Copying Visualisation extension files from {} to {}".format(d3_files_dir, CLIENT_PROJECT_DEPLOYMENT_DIR), _INFO)
-        for fi in d3_files:
-            if re.search('\S+[.]js$', fi):
-                debug("Copying Visualization extension file: {} from {} to {}".format(fi, d3_files_dir, CLIENT_PROJECT_DEPLOYMENT_DIR))
-                shutil.copy2(os.path.join(d3_files_dir, fi), CLIENT_PROJECT_DEPLOYMENT_DIR)
-    else:
-        debug("Get Visualisation extension files from PD repo location: {}".format(prod_repo_location))
-        debug("Visualization files .js might not exist", _INFO)
-        for fi in all_content_files:
-            if re.search('\S+[.]js$', fi):
-                debug("Copying Visualization extension file: {} from {} to {}".format(fi, prod_repo_location, CLIENT_PROJECT_DEPLOYMENT_DIR), _INFO)
-                shutil.copy2(os.path.join(prod_repo_location, fi), CLIENT_PROJECT_DEPLOYMENT_DIR)
+    content_store_dir = get_content_store_dir(client_properties)
+    snapshots_dir = get_snapshots_dir(client_properties, ClientID, project_name)
+    os.makedirs(snapshots_dir, exist_ok=True)
+
+    snapshot_files = dict()
+    for fi in get_files(project_deployment_dir, fpath=False):
+        file_name = os.path.join(project_deployment_dir, fi)
+        file_stat = os.stat(file_name)
+        snapshot_files[fi] = {"hash": store_content_object(content_store_dir, file_name),
+                              "size": file_stat.st_size,
+                              "mtime": file_stat.st_mtime}
+        add_stage_files()
+
+    snapshots = list_deployment_snapshots(client_properties, ClientID, project_name)
+    # Content rolled back to is the deployed snapshot, not the latest one
+    for si in sorted({snapshots[-1], get_deployed_snapshot(client_properties, ClientID, project_name)} if snapshots else ()):
+        existing_snapshot = read_deployment_snapshot(client_properties, ClientID, project_name, si)
+        if {k: v["hash"] for k, v in existing_snapshot["files"].items()} == {k: v["hash"] for k, v in snapshot_files.items()}:
+            debug("Content of {} is the same as in snapshot {}".format(project_deployment_dir, si), _INFO)
+            if deployed:
+                set_deployed_snapshot(client_properties, ClientID, project_name, si)
+            return si
+
+    # Snapshot ids sort in creation order
+    snapshot_id = datetime.datetime.now().strftime('%Y_%m_%d_%H_%M_%S_%f')
+    snapshot_file = os.path.join(snapshots_dir, snapshot_id + '.json')
+
+    snapshot = {"snapshot_id": snapshot_id,
+                "created_at": get_date_timestamp(current_time=True),
+                "ClientID": ClientID,
+                "project_name": project_name,
+                "files": snapshot_files}
+    with open(snapshot_file, 'w') as sfh:
+        json.dump(snapshot, sfh, indent=3, sort_keys=True)
+    debug("Created snapshot {} of {} with {} files".format(snapshot_id, project_deployment_dir, len(snapshot_files)), _INFO)
+    if deployed:
+        set_deployed_snapshot(client_properties, ClientID, project_name, snapshot_id)
+    return snapshot_id
+
+def restore_deployment_snapshot(client_properties, ClientID, project_name, snapshot_id, project_deployment_dir):
+    """
+    Function re-materializes snapshot into empty Client Project deployment folder using hardlinks.
+    :param client_properties:
+    :param ClientID:
+    :param project_name:
+    :param snapshot_id:
+    :param project_deployment_dir:
+    :return:
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
 
-    # Copy other files - e.g Looker topojson file for various dashboards with maps
-    debug("*********************************************************************")
-    debug("***** Processing topo json files", _INFO)
-    topojson_files = list()
-    debug("Processing content from PS repository", _INFO)
-    debug(" There might not be any PS files as PS content is optional", _INFO)
-    for fi in ps_files:
-        if re.search('\S+.json$', fi):
-            debug(" Copying PS json file: {} to {}".format(fi, CLIENT_PROJECT_DEPLOYMENT_DIR), _INFO)
-            shutil.copy2(os.path.join(ps_repo_location, fi), CLIENT_PROJECT_DEPLOYMENT_DIR)
-            topojson_files.append(fi)
+    content_store_dir = get_content_store_dir(client_properties)
+    snapshot = read_deployment_snapshot(client_properties, ClientID, project_name, snapshot_id)
+    os.makedirs(project_deployment_dir, exist_ok=True)
+    for fi, file_attr in snapshot["files"].items():
+        link_content_object(content_store_dir, file_attr["hash"], os.path.join(project_deployment_dir, fi))
+    debug("Restored snapshot {} with {} files into {}".format(snapshot_id, len(snapshot["files"]), project_deployment_dir), _INFO)
 
-    debug("Processing content from OOB repository", _INFO)
-    for fi in prod_files:
-        if re.search('\S+.json$', fi):
-            debug(" Copying OOB json file: {} to {}".format(fi, CLIENT_PROJECT_DEPLOYMENT_DIR), _INFO)
-            shutil.copy2(os.path.join(prod_repo_location, fi), CLIENT_PROJECT_DEPLOYMENT_DIR)
-            topojson_files.append(fi)
+def apply_snapshot_retention(client_properties, ClientID, project_name):
+    """
+    Function removes snapshots according to snapshot_retention property and
+    removes stored objects which are not referenced anymore.
+    :param client_properties:
+    :param ClientID:
+    :param project_name:
+    :return:
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
 
-    debug("TOPO json files {} are copied into folder {}".format(topojson_files, CLIENT_PROJECT_DEPLOYMENT_DIR), _INFO)
-    debug("*********************************************************************")
+    retention = client_properties.get("snapshot_retention", dict())
+    keep_last = int(retention.get("keep_last", 10))
+    max_age_days = int(retention.get("max_age_days", 0))
 
-    debug("Content is copied into folder {}".format(CLIENT_PROJECT_DEPLOYMENT_DIR), _INFO)
-    debug("*********************************************************************")
+    snapshots_dir = get_snapshots_dir(client_properties, ClientID, project_name)
+    snapshots = list_deployment_snapshots(client_properties, ClientID, project_name)
 
-    # Replace token in model and dashboard files
-    # before replacing tokens we need to choose whcih config to use: OOB or PS
+    # The latest and the deployed snapshots are never removed
+    deployed_snapshot = get_deployed_snapshot(client_properties, ClientID, project_name)
+    expired_snapshots = [si for si in snapshots[:-max(keep_last, 1)] if si != deployed_snapshot]
+    if max_age_days > 0:
+        min_mtime = datetime.datetime.now().timestamp() - max_age_days * 86400
+        expired_snapshots += [si for si in snapshots[:-1] if si not in expired_snapshots and si != deployed_snapshot
+                              and os.path.getmtime(os.path.join(snapshots_dir, si + '.json')) < min_mtime]
 
-    if _ps_replacement_tokens:
-        debug("Performing Looker content customization with PS tokens", _INFO)
-        replacement_tokens = copy.deepcopy(_ps_replacement_tokens)
-        match_replace_token(client_properties, replacement_tokens, CLIENT_PROJECT_DEPLOYMENT_DIR)
-    elif _oob_replacement_tokens:
-        debug("Performing Looker content replacement with OOB tokens", _INFO)
-        replacement_tokens = copy.deepcopy(_oob_replacement_tokens)
-        match_replace_token(client_properties, replacement_tokens, CLIENT_PROJECT_DEPLOYMENT_DIR)
-    else:
-        debug("Product {} does not require content replacement, no OOB/PS tokens".format(product_deployed), _INFO)
+    for si in expired_snapshots:
+        debug("Removing expired snapshot {}".format(si), _INFO)
+        os.remove(os.path.join(snapshots_dir, si + '.json'))
 
+    if expired_snapshots:
+        collect_content_store_garbage(client_properties)
 
-    debug("Ready to propagate content to Looker server", _INFO)
+def collect_content_store_garbage(client_properties):
+    """
+    Function removes stored objects which are not referenced by any snapshot or render cache manifest
+    in content store and are not hardlinked anywhere else.
+    :param client_properties:
+    :return:
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
 
-    # if client_properties["single_tenant_deployment"] == 'Y':
-    #     looker_project_name = client_properties["project_name"]
-    # else:
-    #     looker_project_name = ClientID
+    content_store_dir = get_content_store_dir(client_properties)
+    referenced_hashes = set()
+    for manifests_dir in ("snapshots", "render_cache"):
+        for root, directories, files in os.walk(os.path.join(content_store_dir, manifests_dir)):
+            for fi in files:
+                if fi.endswith('.json'):
+                    with open(os.path.join(root, fi), 'r') as sfh:
+                        referenced_hashes.update(v["hash"] for v in json.load(sfh)["files"].values())
+
+    removed_objects = 0
+    for root, directories, files in os.walk(os.path.join(content_store_dir, "objects")):
+        for fi in files:
+            object_file = os.path.join(root, fi)
+            if fi not in referenced_hashes and os.stat(object_file).st_nlink == 1:
+                os.remove(object_file)
+                removed_objects += 1
+    debug("Removed {} unreferenced objects from content store".format(removed_objects), _INFO)
+
+def rollback_deployment(client_properties, client_deployment_dir, ClientID, snapshot_id=None):
+    """
+    Function re-materializes previous deployment from content store and publishes it into Looker Project folder.
+    :param client_properties:
+    :param client_deployment_dir:
+    :param ClientID:
+    :param snapshot_id: snapshot to roll back to. If not defined, snapshot before the deployed one is used,
+                        so repeated rollbacks go back one deployment at a time
+    :return:
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
 
-    # CONTENT_TARGET_DIR = os.path.join(client_properties["looker_location"], looker_project_name)
+    global CLIENT_PROJECT_DEPLOYMENT_DIR
+    global LOOKER_PROJECT_NAME
+    global CONTENT_TARGET_DIR
 
-    debug("Copying content into folder {}".format(CONTENT_TARGET_DIR), _INFO)
+    LOOKER_PROJECT_NAME = get_looker_project_name(client_properties, ClientID)
+    CONTENT_TARGET_DIR = os.path.join(client_properties["looker_location"], LOOKER_PROJECT_NAME)
+    CLIENT_PROJECT_DEPLOYMENT_DIR = os.path.join(client_deployment_dir, LOOKER_PROJECT_NAME)
 
-    # Copy prepared content under Looker models folder.
-    combined_content = get_files(os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR), fpath=True)
-    visualization_extn_dir = client_properties.get("looker_viz_extn_location","None")
+    snapshots = list_deployment_snapshots(client_properties, ClientID, LOOKER_PROJECT_NAME)
+    debug("Available snapshots for Project {}: \n{}".format(LOOKER_PROJECT_NAME, '\n'.join(snapshots)), _INFO)
 
-    # TO DO check if CONTENT_TARGET_DIR exists before processing content
-    if visualization_extn_dir != "None":
-        try:
-            os.makedirs(visualization_extn_dir, exist_ok=True)
-        except OSError as e:
-            debug("Cannot create Visualization extensions folder {}".format(visualization_extn_dir), _ERROR)
-            debug("Error: {}".format(str(e)), _ERROR)
-            debug("Traceback: {}".format(traceback.format_exc()))
+    deployed_snapshot = get_deployed_snapshot(client_properties, ClientID, LOOKER_PROJECT_NAME)
+    if snapshot_id is None:
+        if deployed_snapshot is None or snapshots.index(deployed_snapshot) == 0:
+            debug("There is no previous deployment to roll back to", _ERROR)
             exit(1)
-    else:
-        debug("Visualization extension directory is not defined", _WARNING)
+        snapshot_id = snapshots[snapshots.index(deployed_snapshot) - 1]
+    elif snapshot_id not in snapshots:
+        debug("Snapshot {} does not exist".format(snapshot_id), _ERROR)
+        exit(1)
 
-    # Check if Looker Project directory exists, create empty directory if it does not
-    if os.path.isdir(CONTENT_TARGET_DIR):
-        for fi in combined_content:
-            if not (re.search("\S+[.]js$", fi)):
-                content_target_final_dir = CONTENT_TARGET_DIR
-                try:
-                    shutil.copy2(fi, content_target_final_dir)
-                except IOError:
-                    debug("Unable to copy file {} to folder {}".format(fi, content_target_final_dir), _ERROR)
-            else:
-                # Vizualization extensions files exist
-                debug("Vizualization extension file {} exists".format(fi), _INFO)
-                if visualization_extn_dir != "None":
-                    debug("Vizualization extension directory is defined: {}".format(visualization_extn_dir), _DEBUG)
-
-                    content_target_final_dir = visualization_extn_dir
-                    debug("Copying Visualization extension file {} into folder {}".format(fi, content_target_final_dir), _INFO)
-
-                    try:
-                        shutil.copy2(fi, content_target_final_dir)
-                    except IOError:
-                        debug("Unable to copy file {} to folder {}".format(fi, content_target_final_dir), _ERROR)
-                else:
-                    #content_target_final_dir = CONTENT_TARGET_DIR
-                    debug("Visualization extension directory is not defined", _WARNING)
-                    debug("Visualization extension file {} will not be copied".format(fi), _WARNING)
+    debug("Rolling back Project {} to snapshot {}".format(LOOKER_PROJECT_NAME, snapshot_id), _INFO)
+    if os.path.isdir(CLIENT_PROJECT_DEPLOYMENT_DIR):
+        deployment_dir_snapshot = create_deployment_snapshot(client_properties, ClientID, LOOKER_PROJECT_NAME,
+                                                             CLIENT_PROJECT_DEPLOYMENT_DIR, deployed=False)
+        shutil.rmtree(CLIENT_PROJECT_DEPLOYMENT_DIR)
+        if deployed_snapshot is None:
+            deployed_snapshot = deployment_dir_snapshot
 
-    else:
-        debug("Folder {} does not exist. Creating it".format(CONTENT_TARGET_DIR), _INFO)
-        os.mkdir(CONTENT_TARGET_DIR)
-        for fi in combined_content:
-            if not (re.search("\S+[.]js$", fi)):
-                content_target_final_dir = CONTENT_TARGET_DIR
+    restore_deployment_snapshot(client_properties, ClientID, LOOKER_PROJECT_NAME, snapshot_id, CLIENT_PROJECT_DEPLOYMENT_DIR)
+
+    if not publish_content_targets(client_properties, CLIENT_PROJECT_DEPLOYMENT_DIR, LOOKER_PROJECT_NAME):
+        debug("Content was not published into folder {}".format(CONTENT_TARGET_DIR), _ERROR)
+        exit(1)
+
+    # Publish keeps files it does not produce, files added by rolled back deployment are removed.
+    # Visualization extensions are shared between projects and are not removed
+    if deployed_snapshot is not None and deployed_snapshot != snapshot_id:
+        removed_files = set(read_deployment_snapshot(client_properties, ClientID, LOOKER_PROJECT_NAME,
+                                                     deployed_snapshot)["files"]) - \
+                        set(read_deployment_snapshot(client_properties, ClientID, LOOKER_PROJECT_NAME,
+                                                     snapshot_id)["files"])
+        for fi in sorted(fi for fi in removed_files if not is_viz_extn_file(fi)):
+            for publish_target in get_publish_targets(client_properties):
                 try:
-                    shutil.copy2(fi, content_target_final_dir)
-                except IOError:
-                    debug("Unable to copy file {} to folder {}".format(fi, content_target_final_dir), _ERROR)
-            else:
-                # Vizualization extensions files exist
-                debug("Vizualization extension file {} exists".format(fi), _INFO)
-                if visualization_extn_dir != "None":
-                    debug("Vizualization extension directory is defined: {}".format(visualization_extn_dir), _DEBUG)
+                    os.unlink(os.path.join(publish_target["looker_location"], LOOKER_PROJECT_NAME, fi))
+                except FileNotFoundError:
+                    pass
+            debug(" Removed {}".format(fi), _INFO)
 
-                    content_target_final_dir = visualization_extn_dir
-                    debug("Copying Visualization extension file {} into folder {}".format(fi, content_target_final_dir), _INFO)
+    set_deployed_snapshot(client_properties, ClientID, LOOKER_PROJECT_NAME, snapshot_id)
 
-                    try:
-                        shutil.copy2(fi, content_target_final_dir)
-                    except IOError:
-                        debug("Unable to copy file {} to folder {}".format(fi, content_target_final_dir), _ERROR)
+    # Restored content replaces the last build, verify compares Project folder with the latest manifest
+    _DEPLOYED_CONTENT.update(client_id=ClientID, snapshot_id=snapshot_id, content_files=dict(), content_sources=dict())
+    write_json_build_manifests(client_properties, get_date_timestamp())
+    debug("***** Looker Project {} was rolled back to snapshot {}".format(LOOKER_PROJECT_NAME, snapshot_id), _INFO)
 
-                else:
-                    debug("Vizualization extension directory is not defined", _WARNING)
-                    debug("Visualization extension file {} will not be copied".format(fi), _WARNING)
+def watch_deployment(client_properties, client_deployment_dir, ClientID, db_connection_name):
+    """
+    Function deploys content offline and then watches COPS pre-cloned PS and OOB Prod working copies
+    until interrupted. Changed files are rendered with the same transforms as offline deployment
+    and only files whose rendered content changed are published into Looker Project folder.
+    All selected files are rendered again if deployed file names or replacement tokens change,
+    as transforms of other files depend on them. Deployed content is kept as snapshot and
+    JSON build manifest is written when watch mode stops.
+    :param client_properties:
+    :param client_deployment_dir:
+    :param ClientID:
+    :param db_connection_name:
+    :return:
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
 
-    # We need to compare provided PS content with that of deployed.
-    debug("*********************************************************************")
-    if ps_files:
-        debug("PS content was provided, will perform content check", _INFO)
-        debug("Comparing provided PS content vs. deployed PS content", _INFO)
-        debug("PS Model Files will be checked", _INFO)
-        debug("Application tokens processed: \n\t{}".format('\n\t'.join(app_tokens)), _INFO)
-        debug("Checking PS Model files", _INFO)
+    if not client_properties.get("prod_repo_local_dir"):
+        debug("Watch mode requires COPS pre-cloned working copies. Define prod_repo_local_dir property", _ERROR)
+        exit(1)
 
-        ps_models_repo = [f for f in ps_files if re.search('^(c_)\S+model[.]lkml', f)]
-        #ps_models_repo = [f for f in ps_files if re.search('^(c_)\S+model[.]lkml', f)]
-        debug("PS Repository Model Files list: \n\t{}".format('\n\t'.join(ps_models_repo)), _INFO)
+    with deployment_stage("offline_deployment"):
+        offline_deployment(client_properties, client_deployment_dir, ClientID, db_connection_name)
+    generate_build_manifest(client_properties)
 
-        # Retrieve PS deployed content
-        #ps_models = [f for f in ps_files if re.search('^(c_\S*{0})\S+model[.]lkml'.format([tk for tk in app_tokens]), f)]
-        ps_models_deployed = [f for f in get_files(os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR), fpath=False) if re.search('^(c_)\S+model[.]lkml', f)]
-        debug("PS Deployed Model Files list: \n\t{}".format('\n\t'.join(ps_models_deployed)), _INFO)
+    ps_source, prod_source = get_offline_content_sources(client_properties, client_deployment_dir)
+    content_sources = [content_source for content_source in (ps_source, prod_source) if content_source is not None]
+    replacement_tokens = get_replacement_tokens(client_properties, ps_source, prod_source)
+    render_context = plan_render(client_properties, ps_source, prod_source, replacement_tokens, ClientID,
+                                 db_connection_name, CLIENT_PROJECT_DEPLOYMENT_DIR)
 
-        # Compare Provided and Deployed Model files and compile a report
-        ps_models_not_deployed = set(ps_models_repo).difference(ps_models_deployed)
-        if ps_models_not_deployed:
-            debug("Some PS Model files were not deployed", _WARNING)
-            debug("Not deployed PS Model files: \n\t{}".format('\n\t'.join(ps_models_not_deployed)), _WARNING)
-            debug("Possible reasons: \n\
-                  1. PS Model file name is missing application token.\n\
-                  2. PS Model File name does not comply with Model File naming convention: \n\
-                      \tc_<zero or more characters><APPLICATION_TOKEN><zero or more characters>.model.lkml", _WARNING)
-            debug("Check PS Model file names", _WARNING)
-        else:
-            debug("All PS Model Files were deployed", _INFO)
-            debug("***** Looker offline project {} deployment completed successfully".format(looker_project_name),
-                  _INFO)
+    debounce_seconds = int(client_properties.get("watch_debounce_ms", 200)) / 1000.0
+    watcher = get_content_watcher(client_properties, [content_source.directory for content_source in content_sources])
+    debug("Watching {} for changes ({}). Press Ctrl+C to stop".format(
+        ', '.join(str(content_source) for content_source in content_sources), watcher), _INFO)
+    try:
+        while True:
+            changed_files = watcher.wait_changes(debounce_seconds)
+            redeploy_start = time.perf_counter()
+            try:
+                if client_properties["replacement_tokens_file_name"] in (fi for directory, fi in changed_files):
+                    replacement_tokens = get_replacement_tokens(client_properties, ps_source, prod_source)
+                    changed_files = None
+                render_context = redeploy_content(client_properties, render_context,
+                                                  plan_render(client_properties, ps_source, prod_source,
+                                                              replacement_tokens, ClientID, db_connection_name,
+                                                              CLIENT_PROJECT_DEPLOYMENT_DIR),
+                                                  changed_files)
+            except (ProcessException, OSError, UnicodeDecodeError, ValueError) as e:
+                debug("Unable to redeploy changed content, waiting for next change: {}".format(str(e)), _ERROR)
+                continue
+            debug("Redeployed changes in {:.0f} ms".format((time.perf_counter() - redeploy_start) * 1000), _INFO)
+    except KeyboardInterrupt:
+        debug("Watch mode is stopped", _INFO)
+    finally:
+        watcher.close()
+
+    snapshot_id = create_deployment_snapshot(client_properties, ClientID, LOOKER_PROJECT_NAME, CLIENT_PROJECT_DEPLOYMENT_DIR)
+    apply_snapshot_retention(client_properties, ClientID, LOOKER_PROJECT_NAME)
+    _DEPLOYED_CONTENT.update(snapshot_id=snapshot_id, content_files=get_content_files_origin(render_context["render_plan"]))
+    write_json_build_manifests(client_properties, get_date_timestamp())
+
+def redeploy_content(client_properties, previous_context, render_context, changed_files):
+    """
+    Function renders selected files read from changed source files and publishes files
+    whose rendered content differs from deployed content. Files no longer selected are removed.
+    Deployed files are replaced, never written in place: they may be hardlinked to content store objects.
+    :param client_properties:
+    :param previous_context: render context of deployed content
+    :param render_context: render context planned from current content
+    :param changed_files: set of (content folder, file name) of changed source files, None - all files changed
+    :return: render context of deployed content
+    """
+    previous_plan = previous_context["render_plan"]
+    render_plan = render_context["render_plan"]
+    render_all = changed_files is None or set(previous_plan) != set(render_plan)
+
+    render_records = list()
+    for fi, content_record in render_plan.items():
+        transform_names = [content_transform[0] for content_transform in content_record["transforms"]]
+        previous_names = [content_transform[0] for content_transform in previous_plan[fi]["transforms"]] \
+            if fi in previous_plan else None
+        if render_all or transform_names != previous_names or \
+                (content_record["source"].directory, content_record["source_name"]) in changed_files:
+            render_records.append(content_record)
+
+    lookml_trees = get_lookml_tree_cache(client_properties) \
+        if client_properties.get("lookml_transforms", "line") == 'parsed' else None
+    changed_records = list()
+    for content_record in transform_content(render_records, lookml_trees):
+        if content_record["data"] is None:
+            content_record["data"] = content_record["source"].read_file(content_record["source_name"])
+        deployed_file = os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR, content_record["name"])
+        try:
+            with open(deployed_file, 'rb') as deployed_fh:
+                if deployed_fh.read() == content_record["data"]:
+                    continue
+            os.unlink(deployed_file)
+        except FileNotFoundError:
+            pass
+        changed_records.append(content_record)
+
+    content_store_dir = get_content_store_dir(client_properties) \
+        if client_properties.get("output_mode", "copy") == 'link' else None
+    written_files = write_content(changed_records, CLIENT_PROJECT_DEPLOYMENT_DIR, content_store_dir)
+
+    link_files = client_properties.get("output_mode", "copy") == 'link'
+    publish_targets = get_publish_targets(client_properties)
+    for fi in written_files:
+        deployed_file = os.path.join(CLIENT_PROJECT_DEPLOYMENT_DIR, fi)
+        for publish_target in publish_targets:
+            if is_viz_extn_file(fi):
+                if publish_target.get("looker_viz_extn_location", "None") != "None":
+                    replace_file(deployed_file, os.path.join(publish_target["looker_viz_extn_location"], fi), link_files)
+            else:
+                replace_file(deployed_file, os.path.join(publish_target["looker_location"], LOOKER_PROJECT_NAME, fi),
+                             link_files)
+        debug(" Published {}".format(fi), _INFO)
+
+    # Visualization extensions are shared between projects and are not removed
+    for fi in set(previous_plan) - set(render_plan):
+        target_dirs = [CLIENT_PROJECT_DEPLOYMENT_DIR]
+        if not is_viz_extn_file(fi):
+            target_dirs += [os.path.join(publish_target["looker_location"], LOOKER_PROJECT_NAME)
+                            for publish_target in publish_targets]
+        for target_dir in target_dirs:
+            try:
+                os.unlink(os.path.join(target_dir, fi))
+            except FileNotFoundError:
+                pass
+        debug(" Removed {}".format(fi), _INFO)
 
-        debug("*********************************************************************")
-    else:
-        # Generate deployment summary.
-        if deployment_summary(client_properties, CLIENT_PROJECT_DEPLOYMENT_DIR):
-            debug("***** Looker offline project {} deployment completed successfully".format(looker_project_name), _INFO)
-        else:
-            debug("***** Not all content was deployed. Check your deployment", _WARNING)
+    debug("Rendered {} files, published {}, removed {}".format(len(render_records), len(written_files),
+                                                               len(set(previous_plan) - set(render_plan))), _INFO)
+    return render_context
 
 def deployment_summary(client_properties, client_project_deployment_dir):
     """
@@ -2316,7 +5086,7 @@ def deployment_summary(client_properties, client_project_deployment_dir):
 
     apps_installed = client_properties["product_apps"]
     # Get content
-    deployed_content = get_files(client_project_deployment_dir, fpath=False)
+    deployed_content = _FILE_CATALOG.iter_files(client_project_deployment_dir)
     debug("***** Deployment summary", _INFO)
     debug("     Product installed: {}".format(product_installed))
     debug("     Applications installed: {}".format(apps_installed))
@@ -2346,47 +5116,379 @@ def deployment_summary(client_properties, client_project_deployment_dir):
         debug("This content is missing: {}".format(missing_content_elements), _WARNING)
         return False
 
+class FileCatalog(object):
+    """
+    Catalog of files in directories (one level, no sub directories) built with os.scandir.
+    Listing is cached with directory entries, entries cache their stat data.
+    Cached listing is used until directory is replaced or its modification time changes.
+    Listings of directories modified less than _CATALOG_RACY_NS ago are not cached, as files
+    added within the same file system timestamp tick would not change modification time.
+    """
+    def __init__(self):
+        self._listings = dict()
+
+    def entries(self, directory):
+        """
+        :param directory:
+        :return: list of os.DirEntry of files in directory, empty list if directory does not exist
+        """
+        try:
+            dir_stat = os.stat(directory)
+        except (FileNotFoundError, NotADirectoryError):
+            return list()
+        dir_version = (dir_stat.st_dev, dir_stat.st_ino, dir_stat.st_mtime_ns)
+
+        cached_listing = self._listings.get(directory)
+        if cached_listing is not None and cached_listing[0] == dir_version:
+            return cached_listing[1]
+
+        try:
+            with os.scandir(directory) as dir_entries:
+                file_entries = [entry for entry in dir_entries if not entry.is_dir()]
+        except (FileNotFoundError, NotADirectoryError):
+            return list()
+
+        if time.time_ns() - dir_stat.st_mtime_ns > _CATALOG_RACY_NS:
+            self._listings[directory] = (dir_version, file_entries)
+        else:
+            self._listings.pop(directory, None)
+        return file_entries
+
+    def iter_files(self, directory, fnpatterns=None, fpath=False):
+        """
+        :param directory:
+        :param fnpatterns: list of file name regex patterns, file matching any pattern is returned once
+        :param fpath: True - file path, False - file name
+        :return: generator of file names or paths in directory order
+        """
+        match_fnpattern = None
+        if fnpatterns:
+            debug("Matching file name patterns: {}".format(fnpatterns), _DEBUG)
+            match_fnpattern = re.compile('|'.join('(?:{0})'.format(fnp) for fnp in fnpatterns))
+        for entry in self.entries(directory):
+            if match_fnpattern is None or match_fnpattern.search(entry.name):
+                yield entry.path if fpath else entry.name
+
+    def list_files(self, directory, fnpatterns=None, fpath=False):
+        """
+        :param directory:
+        :param fnpatterns: list of file name regex patterns
+        :param fpath: True - file path, False - file name
+        :return: list of file names or paths
+        """
+        return list(self.iter_files(directory, fnpatterns, fpath))
+
+    def invalidate(self, directory=None):
+        """
+        :param directory: directory to drop from cache, None - all directories
+        :return:
+        """
+        if directory is None:
+            self._listings.clear()
+        else:
+            self._listings.pop(directory, None)
+
+# Directory listings shared by whole deployment run
+_FILE_CATALOG = FileCatalog()
+
 def get_files(directory, *fnpattern, fpath = False):
     """
     Args:
-        directory - starting directory to list files
+        directory - directory to list files, sub directories are not listed
         fpath - flag indicates whether to return file path and name or just name
             False - returns only list of filenames
             True  - returns fully qualified list of filenames: path/filename
-        Function generates the file names in a directory
-        tree by walking the tree either top-down or bottom-up. For each
-        directory in the tree rooted at directory top (including top itself),
-        it yields a 3-tuple (dirpath, dirnames, filenames).
         fnpattern - list of file name patterns. If defined, returns list of
-            files whose names match pattern specified
-    """
-    file_paths = []  # List stores filenames with or without path.
-    #file_paths_pattern = []
-
-    # Walk directory tree.
-    #for root, directories, files in os.listdir(directory):
-    for root, directories, files in os.walk(directory, topdown=True):
-        directories.clear() # in combination with topdown=True prevents all dir traversing.
-        for filename in files:
-            if fpath:
-                # Join the two strings in order to form the full filepath.
-                filepath = os.path.join(root, filename)
-                file_paths.append(filepath)
-            else:
-                file_paths.append(filename)
+            files whose names match any pattern specified, every file once
+    """
+    return _FILE_CATALOG.list_files(directory, fnpattern[0] if fnpattern else None, fpath)
 
-    if fnpattern:
-        fnpattern_list = list(fnpattern)
-        file_paths_pattern = list()
-        for fnp in fnpattern_list[0]:
-            debug("Matching file name pattern: {}".format(fnp), _DEBUG)
-            match_prefix = re.compile('.*({0}).*'.format(fnp))
-            [file_paths_pattern.append(fn) for fn in file_paths if match_prefix.match(fn)]
+class ContentSource(object):
+    """
+    Looker content files of a repository. Offline deployment lists, reads and copies
+    files through content source regardless where the files are stored.
+    """
+    def list_files(self):
+        """
+        :return: list of file names in repository root folder
+        """
+        raise NotImplementedError
+
+    def read_file(self, file_name):
+        """
+        :param file_name:
+        :return: file content bytes
+        """
+        raise NotImplementedError
+
+    def has_file(self, file_name):
+        """
+        :param file_name:
+        :return: True if file exists in repository root folder
+        """
+        return file_name in self.list_files()
+
+    def copy_file(self, file_name, target_dir):
+        """
+        :param file_name:
+        :param target_dir:
+        :return:
+        """
+        with open(os.path.join(target_dir, file_name), 'wb') as target_fh:
+            target_fh.write(self.read_file(file_name))
+
+    def close(self):
+        return None
+
+
+class DirectoryContentSource(ContentSource):
+    """
+    Content files of a working tree checkout or COPS pre-cloned folder
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def __str__(self):
+        return self.directory
+
+    def list_files(self):
+        return get_files(self.directory, fpath=False)
+
+    def has_file(self, file_name):
+        return os.path.isfile(os.path.join(self.directory, file_name))
+
+    def read_file(self, file_name):
+        with open(os.path.join(self.directory, file_name), 'rb') as source_fh:
+            return source_fh.read()
+
+    def copy_file(self, file_name, target_dir):
+        shutil.copy2(os.path.join(self.directory, file_name), target_dir)
+
+
+class GitContentSource(ContentSource):
+    """
+    Content files read directly from git objects of a local repository commit.
+    No working tree is written, blobs are streamed by a single git cat-file --batch process.
+    """
+    def __init__(self, git_dir, revision, git_timeout=60):
+        self.git_dir = git_dir
+        self.git_timeout = git_timeout
+        self.commit = run_git_command(["rev-parse", "--verify", "{}^{{commit}}".format(revision)],
+                                      cwd=git_dir, timeout=git_timeout).strip()
+        self._blobs = None
+        self._cat_file = None
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return "{}@{}".format(self.git_dir, self.commit[:12])
+
+    def list_files(self):
+        if self._blobs is None:
+            self._blobs = OrderedDict()
+            tree_entries = run_git_command(["ls-tree", "-z", self.commit], cwd=self.git_dir, timeout=self.git_timeout)
+            for entry in tree_entries.split('\0'):
+                if not entry:
+                    continue
+                entry_info, file_name = entry.split('\t', 1)
+                entry_mode, entry_type, entry_sha = entry_info.split()
+                # Sub-folders and symbolic links are not deployed
+                if entry_type == 'blob' and entry_mode != '120000':
+                    self._blobs[file_name] = entry_sha
+        return list(self._blobs)
+
+    def has_file(self, file_name):
+        self.list_files()
+        return file_name in self._blobs
+
+    def read_file(self, file_name):
+        self.list_files()
+        if file_name not in self._blobs:
+            raise ProcessException("File {} does not exist in commit {}".format(file_name, self.commit))
+
+        with self._lock:
+            if self._cat_file is None:
+                self._cat_file = subprocess.Popen(["git", "cat-file", "--batch"], cwd=self.git_dir,
+                                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            self._cat_file.stdin.write((self._blobs[file_name] + '\n').encode())
+            self._cat_file.stdin.flush()
+            # Batch output: <sha> blob <size>\n<content>\n
+            blob_header = self._cat_file.stdout.readline().split()
+            if len(blob_header) != 3 or blob_header[1] != b'blob':
+                raise ProcessException("Unable to read file {} from {}: {}".format(file_name, self.git_dir, blob_header))
+            blob_data = self._cat_file.stdout.read(int(blob_header[2]))
+            self._cat_file.stdout.read(1)
+        return blob_data
+
+    def close(self):
+        with self._lock:
+            if self._cat_file is not None:
+                self._cat_file.stdin.close()
+                self._cat_file.wait()
+                self._cat_file = None
+
+class MemoryContentSource(ContentSource):
+    """
+    Content files held in memory. Product content is loaded once and shared
+    with batch render worker processes.
+    """
+    def __init__(self, files, description):
+        self.files = files
+        self.description = description
+
+    @classmethod
+    def load(cls, content_source):
+        """
+        :param content_source: ContentSource to read all files from
+        :return: MemoryContentSource
+        """
+        files = OrderedDict((fi, content_source.read_file(fi)) for fi in content_source.list_files())
+        return cls(files, str(content_source))
+
+    def __str__(self):
+        return self.description
+
+    def list_files(self):
+        return list(self.files)
+
+    def has_file(self, file_name):
+        return file_name in self.files
+
+    def read_file(self, file_name):
+        if file_name not in self.files:
+            raise ProcessException("File {} does not exist in {}".format(file_name, self.description))
+        return self.files[file_name]
+
+class ContentWatcher(object):
+    """
+    Watches files in content folders (one level, no sub directories) by polling file size
+    and modification time. Hidden files are not watched.
+    """
+    def __init__(self, directories, poll_interval=1.0):
+        self.directories = directories
+        self.poll_interval = poll_interval
+        self._file_states = {directory: self._scan(directory) for directory in directories}
+
+    def __str__(self):
+        return "polling every {} seconds".format(self.poll_interval)
+
+    @staticmethod
+    def _scan(directory):
+        file_states = dict()
+        deployed_files = scan_deployed_files(directory) or dict()
+        for fi, file_stat in deployed_files.items():
+            if not fi.startswith('.'):
+                file_states[fi] = (file_stat.st_size, file_stat.st_mtime_ns)
+        return file_states
+
+    def _poll_changes(self):
+        changes = set()
+        for directory in self.directories:
+            file_states = self._scan(directory)
+            previous_states = self._file_states[directory]
+            changes.update((directory, fi) for fi in set(file_states) | set(previous_states)
+                           if file_states.get(fi) != previous_states.get(fi))
+            self._file_states[directory] = file_states
+        return changes
+
+    def wait_changes(self, debounce_seconds):
+        """
+        Function blocks until files change and no further change follows within debounce period.
+        :param debounce_seconds:
+        :return: set of (directory, file name) of changed, created and removed files
+        """
+        changes = set()
+        last_change = None
+        while True:
+            time.sleep(min(self.poll_interval, debounce_seconds) if changes else self.poll_interval)
+            new_changes = self._poll_changes()
+            if new_changes:
+                changes |= new_changes
+                last_change = time.monotonic()
+            elif changes and time.monotonic() - last_change >= debounce_seconds:
+                return changes
+
+    def close(self):
+        return None
 
-        file_paths.clear()
-        file_paths = list(file_paths_pattern)
 
-    return file_paths
+class InotifyContentWatcher(ContentWatcher):
+    """
+    Watches files in content folders with Linux inotify, no folder is scanned while waiting.
+    Files are reported when written and closed, moved or removed, so editors saving
+    through temporary file and rename are reported once per save.
+    """
+    def __init__(self, directories):
+        self.directories = directories
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._inotify_add_watch = libc.inotify_add_watch
+        self._inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+        self._watches = dict()
+        try:
+            for directory in directories:
+                wd = self._inotify_add_watch(self._fd, os.fsencode(directory), _IN_CLOSE_WRITE | _IN_MOVED_FROM |
+                                             _IN_MOVED_TO | _IN_DELETE | _IN_ONLYDIR)
+                if wd < 0:
+                    err = ctypes.get_errno()
+                    raise OSError(err, os.strerror(err), directory)
+                self._watches[wd] = directory
+        except OSError:
+            self.close()
+            raise
+
+    def __str__(self):
+        return "inotify"
+
+    def _read_events(self):
+        changes = set()
+        while True:
+            try:
+                event_data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return changes
+            offset = 0
+            while offset < len(event_data):
+                wd, mask, cookie, name_length = _INOTIFY_EVENT.unpack_from(event_data, offset)
+                file_name = os.fsdecode(event_data[offset + _INOTIFY_EVENT.size:
+                                                   offset + _INOTIFY_EVENT.size + name_length].rstrip(b'\0'))
+                offset += _INOTIFY_EVENT.size + name_length
+                if mask & _IN_Q_OVERFLOW:
+                    # Events were lost, every file is reported as changed
+                    debug("inotify event queue overflow, all files will be redeployed", _WARNING)
+                    for directory in self.directories:
+                        changes.update((directory, fi) for fi in self._scan(directory))
+                elif wd in self._watches and file_name and not file_name.startswith('.'):
+                    changes.add((self._watches[wd], file_name))
+
+    def wait_changes(self, debounce_seconds):
+        changes = set()
+        while True:
+            ready_fds, _, _ = select.select([self._fd], [], [], debounce_seconds if changes else None)
+            if not ready_fds:
+                return changes
+            changes |= self._read_events()
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def get_content_watcher(client_properties, directories):
+    """
+    :param client_properties:
+    :param directories: content folders to watch
+    :return: InotifyContentWatcher, ContentWatcher polling folders if inotify is not available
+    """
+    try:
+        return InotifyContentWatcher(directories)
+    except (OSError, AttributeError) as e:
+        debug("inotify is not available, content folders will be polled: {}".format(str(e)), _WARNING)
+    return ContentWatcher(directories, float(client_properties.get("watch_poll_interval", 1)))
 
 def access_cofiguration(access_config_file, client_properties, in_access_token, ClientID):
     """
@@ -2487,11 +5589,11 @@ def access_cofiguration(access_config_file, client_properties, in_access_token,
         else:
             debug("There is no Group for Role Name/ID {}/{}".format(role_name, role_id))
 
-def match_replace_token(client_properties, replacement_tokens_prop, client_project_deployment_dir):
+def match_replace_token(client_properties, replacement_tokens_prop):
     """
-    :param in_string:
-    :param in_pattern:
-    :return: True/False
+    :param client_properties:
+    :param replacement_tokens_prop: PS or OOB replacement tokens configuration
+    :return: list of token content transforms for Model and Dashboard files
     """
     debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
     debug("Performing token replacement", _INFO)
@@ -2501,23 +5603,17 @@ def match_replace_token(client_properties, replacement_tokens_prop, client_proje
     replacement_token_map = replacement_tokens_prop[product_deployed].get("replace_token_map")
     debug("Replacement tokens and values:\n{}".format(replacement_token_map))
 
-    file_name_pattern = ["model.lkml", "dashboard.lookml"]
-    process_files = get_files(client_project_deployment_dir, file_name_pattern, fpath=True)
-
+    token_transforms = list()
     if replacement_token_map is not None:
-        #debug("User requested tokens replacement", _INFO)
         for replace_token, replace_value in replacement_token_map.items():
             replace_token = token_indicator+replace_token+token_indicator
             debug(" Replace Token: {} with Value: {}".format(replace_token, replace_value), _INFO)
-
-            match_token = re.compile(r'(.*)({0})(.*)'.format(replace_token))
-
-            with fileinput.input(files=(process_files), inplace=True) as rfh1:
-                for line in rfh1:
-                    print(match_token.sub(r'\1{0}\3'.format(replace_value), line), end='')
+            token_transforms.append(get_token_transform(replace_token, replace_value))
     else:
         debug("No user input. Replacing tokens with default values", _INFO)
 
+    return token_transforms
+
 
 def generate_build_manifest(client_properties):
     """
@@ -2526,7 +5622,8 @@ def generate_build_manifest(client_properties):
     """
     debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
     # Create and open build manifest file for writing
-    build_manifest_file_name = "modn_looker_build{}.properties".format(get_date_timestamp())
+    build_timestamp = get_date_timestamp()
+    build_manifest_file_name = "modn_looker_build{}.properties".format(build_timestamp)
     build_manifest_file = os.path.join(CONTENT_TARGET_DIR, build_manifest_file_name)
     # Collect repositories information
     prod_repo = client_properties["prod_repo"]
@@ -2546,7 +5643,7 @@ def generate_build_manifest(client_properties):
     # Will get list of model files ready to be copied into target project directory.
     # this seems the most reliable.
     ["model.lkml", "dashboard.lookml"]
-    model_files = get_files(CLIENT_PROJECT_DEPLOYMENT_DIR, ["model[.]lkml"])
+    model_files = _FILE_CATALOG.list_files(CLIENT_PROJECT_DEPLOYMENT_DIR, ["model[.]lkml"])
 
     with open(build_manifest_file, 'a') as build_manifest:
         build_manifest.write("Build started at: {}\n".format(build_start_dt))
@@ -2559,8 +5656,305 @@ def generate_build_manifest(client_properties):
         build_manifest.write("Models deployed: \n")
         for mi in model_files:
             build_manifest.write("  "+mi+'\n')
+        build_manifest.write("Stage timings: \n")
+        for stage in _DEPLOYMENT_STAGES:
+            if stage["parent"] is None:
+                build_manifest.write("  {}: {:.3f}s wall, {:.3f}s CPU, {} files, {}\n".format(
+                    stage["stage"], stage["wall_seconds"], stage["cpu_seconds"], stage["files"], stage["status"]))
         build_manifest.write("Build completed at: {}\n".format(get_date_timestamp(current_time=True)))
 
+    write_json_build_manifests(client_properties, build_timestamp)
+
+def write_json_build_manifests(client_properties, build_timestamp, project_name=None, deployed_content=None, api_objects=None):
+    """
+    Function writes JSON build manifest into Looker Project folder of every publish target.
+    :param client_properties:
+    :param build_timestamp: manifest file name timestamp
+    :param project_name: Looker Project name, LOOKER_PROJECT_NAME if not defined
+    :param deployed_content: dictionary with the keys of _DEPLOYED_CONTENT, _DEPLOYED_CONTENT if not defined
+    :param api_objects: Looker objects created by deployment, _DEPLOYED_API_OBJECTS if not defined
+    :return:
+    """
+    project_name = project_name or LOOKER_PROJECT_NAME
+    for publish_target in get_publish_targets(client_properties):
+        generate_json_build_manifest(publish_target, os.path.join(publish_target["looker_location"], project_name,
+                                                                  "modn_looker_build{}.json".format(build_timestamp)),
+                                     project_name, deployed_content, api_objects)
+
+def generate_json_build_manifest(client_properties, build_manifest_file, project_name=None, deployed_content=None,
+                                 api_objects=None):
+    """
+    Function writes JSON build manifest: every deployed file with its size, modification time,
+    content hash, origin repository and commit and applied transforms, and Looker objects
+    created by deployment. Hashes are taken from deployment snapshot, deployed files are not read.
+    :param client_properties: client properties of publish target
+    :param build_manifest_file: manifest file in Looker Project folder
+    :param project_name: Looker Project name, LOOKER_PROJECT_NAME if not defined
+    :param deployed_content: dictionary with the keys of _DEPLOYED_CONTENT, _DEPLOYED_CONTENT if not defined
+    :param api_objects: Looker objects created by deployment, _DEPLOYED_API_OBJECTS if not defined
+    :return:
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+
+    content_target_dir = os.path.dirname(build_manifest_file)
+    project_name = project_name or LOOKER_PROJECT_NAME
+    deployed_content = _DEPLOYED_CONTENT if deployed_content is None else deployed_content
+    api_objects = _DEPLOYED_API_OBJECTS if api_objects is None else api_objects
+
+    ClientID = deployed_content.get("client_id")
+    snapshot_id = deployed_content.get("snapshot_id")
+    content_files = deployed_content.get("content_files", dict())
+    # Content installed from bundle has no snapshot, bundle holds file hashes
+    snapshot_files = deployed_content.get("bundle_files", dict())
+    if snapshot_id is not None:
+        snapshot_files = read_deployment_snapshot(client_properties, ClientID, project_name, snapshot_id)["files"]
+
+    repositories = dict()
+    for origin, source_info in deployed_content.get("content_sources", dict()).items():
+        repositories[origin] = dict(source_info)
+    if "OOB" in repositories:
+        repositories["OOB"].update(repository=client_properties["prod_repo"],
+                                   branch=client_properties["prod_repo_branch"] or None)
+    if "PS" in repositories:
+        repositories["PS"].update(repository=client_properties["ps_repo"],
+                                  branch=client_properties["ps_repo_branch"] or None)
+
+    viz_extn_dir = client_properties.get("looker_viz_extn_location", "None")
+    manifest_files = dict()
+    for fi in sorted(set(snapshot_files) | set(content_files)):
+        # Visualization extensions are published into shared folder, the same rule as publish_content
+        if is_viz_extn_file(fi) and viz_extn_dir != "None":
+            file_target, target_file = "viz_extension", os.path.join(viz_extn_dir, fi)
+        else:
+            file_target, target_file = "project", os.path.join(content_target_dir, fi)
+        try:
+            file_stat = os.stat(target_file)
+        except OSError:
+            file_stat = None
+        file_origin = content_files.get(fi, dict())
+        manifest_files[fi] = {"target": file_target,
+                              "size": snapshot_files[fi]["size"] if fi in snapshot_files else (file_stat.st_size if file_stat else None),
+                              "mtime_ns": file_stat.st_mtime_ns if file_stat else None,
+                              "hash": snapshot_files[fi]["hash"] if fi in snapshot_files else None,
+                              "origin": file_origin.get("origin"),
+                              "source_name": file_origin.get("source_name"),
+                              "transforms": file_origin.get("transforms", list())}
+
+    build_manifest = {"manifest_version": 1,
+                      "hash_algorithm": "sha256",
+                      "build_started_at": build_start_dt,
+                      "build_completed_at": get_date_timestamp(current_time=True),
+                      "client_id": ClientID,
+                      "project_name": project_name,
+                      "product_prefix": client_properties["product_prefix"],
+                      "single_tenant_deployment": client_properties["single_tenant_deployment"],
+                      "content_target_dir": content_target_dir,
+                      "viz_extn_dir": viz_extn_dir,
+                      "snapshot_id": snapshot_id,
+                      "repositories": repositories,
+                      "files": manifest_files,
+                      "api_objects": api_objects}
+
+    temp_file = build_manifest_file + '.tmp{}'.format(os.getpid())
+    with open(temp_file, 'w') as mfh:
+        json.dump(build_manifest, mfh, indent=3, sort_keys=True)
+    os.replace(temp_file, build_manifest_file)
+    debug("JSON build manifest is written into {}".format(build_manifest_file), _INFO)
+
+_BUILD_MANIFEST_PATTERN = re.compile(r'^modn_looker_build_[0-9_]+[.]json$')
+
+def scan_deployed_files(directory):
+    """
+    :param directory:
+    :return: dictionary file name: os.stat_result of files in directory, None if directory does not exist
+    """
+    deployed_files = dict()
+    try:
+        with os.scandir(directory) as dir_entries:
+            for entry in dir_entries:
+                try:
+                    if entry.is_file():
+                        deployed_files[entry.name] = entry.stat()
+                except FileNotFoundError:
+                    # File removed while folder is scanned
+                    pass
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return deployed_files
+
+def verify_deployed_content(content_target_dir, hash_executor, full_hash=False):
+    """
+    Function compares Looker Project folder with its latest JSON build manifest of every product,
+    products deployed into the same Project folder write their own manifests.
+    Files with size and modification time recorded in manifest are not read. Files with the same size
+    but different modification time are hashed in hash_executor, all files are hashed if full_hash is True.
+    Files listed only in older manifests are reported as stale, publish does not remove them.
+    Drift report statuses:
+        clean - folder content matches manifests, stale files may be present
+        drifted - files are modified, missing or not deployed by any build
+        no_manifest - folder does not contain JSON build manifest
+        invalid_manifest - latest JSON build manifest cannot be read
+        no_project_folder - folder does not exist
+    :param content_target_dir: Looker Project folder
+    :param hash_executor: concurrent.futures.Executor
+    :param full_hash: True - every file is hashed
+    :return: drift report dictionary
+    """
+    drift_report = {"content_target_dir": content_target_dir, "manifest": None, "manifests": list(), "client_id": None,
+                    "snapshot_id": None, "status": "clean", "files_checked": 0, "files_hashed": 0,
+                    "modified": list(), "missing": list(), "unexpected": list(), "stale": list(), "touched": list()}
+
+    deployed_files = scan_deployed_files(content_target_dir)
+    if deployed_files is None:
+        drift_report["status"] = "no_project_folder"
+        return drift_report
+
+    manifest_names = [fi for fi in deployed_files if _BUILD_MANIFEST_PATTERN.match(fi)]
+    if not manifest_names:
+        drift_report["status"] = "no_manifest"
+        return drift_report
+
+    # Manifest timestamps sort in build order, the newest manifest of every product is verified
+    manifest_files = dict()
+    product_manifests = dict()
+    older_files = set()
+    for manifest_name in sorted(manifest_names, reverse=True):
+        manifest_file = os.path.join(content_target_dir, manifest_name)
+        try:
+            with open(manifest_file, 'r') as mfh:
+                build_manifest = json.load(mfh)
+            build_files = build_manifest["files"]
+        except (OSError, ValueError, KeyError) as e:
+            if drift_report["manifest"] is None:
+                drift_report.update(manifest=manifest_file, status="invalid_manifest", error=str(e))
+                return drift_report
+            debug("Older build manifest {} cannot be read: {}".format(manifest_file, str(e)), _WARNING)
+            continue
+        if drift_report["manifest"] is None:
+            drift_report.update(manifest=manifest_file, client_id=build_manifest.get("client_id"),
+                                snapshot_id=build_manifest.get("snapshot_id"))
+        product_prefix = build_manifest.get("product_prefix")
+        if product_prefix in product_manifests:
+            older_files.update(build_files)
+            continue
+        product_manifests[product_prefix] = manifest_file
+        for fi, file_info in build_files.items():
+            # File deployed by newer build of another product is verified against the newer build
+            if fi not in manifest_files:
+                manifest_files[fi] = dict(file_info, viz_extn_dir=build_manifest["viz_extn_dir"])
+    drift_report["manifests"] = sorted(product_manifests.values())
+
+    suspect_files = dict()
+    for fi, file_info in manifest_files.items():
+        drift_report["files_checked"] += 1
+        if file_info["target"] == 'viz_extension':
+            target_file = os.path.join(file_info["viz_extn_dir"], fi)
+            try:
+                file_stat = os.stat(target_file)
+            except OSError:
+                file_stat = None
+        else:
+            target_file = os.path.join(content_target_dir, fi)
+            file_stat = deployed_files.get(fi)
+
+        if file_stat is None:
+            drift_report["missing"].append(fi)
+        elif file_info["size"] is not None and file_stat.st_size != file_info["size"]:
+            drift_report["modified"].append(fi)
+        elif full_hash or file_stat.st_mtime_ns != file_info["mtime_ns"] or file_info["size"] is None:
+            suspect_files[fi] = (target_file, file_info["hash"], file_stat.st_mtime_ns != file_info["mtime_ns"])
+
+    hash_futures = {hash_executor.submit(get_file_hash, target_file): fi
+                    for fi, (target_file, file_hash, file_touched) in suspect_files.items()}
+    for hash_future in concurrent.futures.as_completed(hash_futures):
+        fi = hash_futures[hash_future]
+        target_file, file_hash, file_touched = suspect_files[fi]
+        try:
+            deployed_hash = hash_future.result()
+        except OSError:
+            drift_report["missing"].append(fi)
+            continue
+        drift_report["files_hashed"] += 1
+        if deployed_hash != file_hash:
+            drift_report["modified"].append(fi)
+        elif file_touched:
+            # Content is unchanged, only modification time differs
+            drift_report["touched"].append(fi)
+
+    for fi in deployed_files:
+        if fi not in manifest_files and not fi.startswith("modn_looker_build"):
+            drift_report["stale" if fi in older_files else "unexpected"].append(fi)
+    for drift_kind in ("modified", "missing", "unexpected", "stale", "touched"):
+        drift_report[drift_kind].sort()
+    if drift_report["modified"] or drift_report["missing"] or drift_report["unexpected"]:
+        drift_report["status"] = "drifted"
+    return drift_report
+
+def verify_deployments(client_properties, content_target_dirs, drift_report_file):
+    """
+    Function verifies Looker Project folders against latest JSON build manifests of their products in parallel
+    and writes drift report.
+    :param client_properties:
+    :param content_target_dirs: list of Looker Project folders
+    :param drift_report_file: JSON drift report file name
+    :return: True if no Project folder has drifted, False otherwise
+    """
+    debug("*** Function call - {}".format(sys._getframe().f_code.co_name), _INFO)
+
+    full_hash = client_properties.get("verify_full_hash", "N") == 'Y'
+    verify_workers = int(client_properties.get("verify_workers", 0)) or min(32, (os.cpu_count() or 1) * 4)
+    debug("Verifying {} Project folders with {} workers".format(len(content_target_dirs), verify_workers), _INFO)
+
+    verify_start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=verify_workers) as hash_executor, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=verify_workers) as scan_executor:
+        drift_reports = list(scan_executor.map(
+            lambda content_target_dir: verify_deployed_content(content_target_dir, hash_executor, full_hash),
+            content_target_dirs))
+    verify_seconds = time.perf_counter() - verify_start
+    add_stage_files(sum(drift_report["files_checked"] for drift_report in drift_reports))
+
+    status_counts = dict()
+    for drift_report in drift_reports:
+        status_counts[drift_report["status"]] = status_counts.get(drift_report["status"], 0) + 1
+        if drift_report["status"] == 'drifted':
+            debug("Project folder {} has drifted from {}: modified {}, missing {}, unexpected {}".format(
+                drift_report["content_target_dir"], drift_report["manifest"], drift_report["modified"],
+                drift_report["missing"], drift_report["unexpected"]), _WARNING)
+        elif drift_report["status"] != 'clean':
+            debug("Project folder {} cannot be verified: {}".format(drift_report["content_target_dir"],
+                                                                    drift_report["status"]), _WARNING)
+        else:
+            debug("Project folder {} is clean: {} files checked, {} hashed".format(
+                drift_report["content_target_dir"], drift_report["files_checked"], drift_report["files_hashed"]), _INFO)
+        if drift_report["stale"]:
+            debug("Project folder {} has files of earlier builds: {}".format(drift_report["content_target_dir"],
+                                                                            drift_report["stale"]), _INFO)
+
+    with open(drift_report_file, 'w') as rfh:
+        json.dump({"verified_at": get_date_timestamp(current_time=True),
+                   "verify_seconds": round(verify_seconds, 3),
+                   "full_hash": full_hash,
+                   "summary": status_counts,
+                   "files_checked": sum(r["files_checked"] for r in drift_reports),
+                   "files_hashed": sum(r["files_hashed"] for r in drift_reports),
+                   "projects": drift_reports}, rfh, indent=3)
+    debug("Verified {} Project folders in {:.2f} seconds: {}. Drift report is written into {}".format(
+        len(drift_reports), verify_seconds, status_counts, drift_report_file), _INFO)
+    return status_counts.get("drifted", 0) == 0
+
+def get_fleet_content_target_dirs(client_properties):
+    """
+    :param client_properties:
+    :return: sorted list of Looker Project folders under looker_location. Staging, release
+    and Visualization extensions folders are not listed
+    """
+    looker_location = client_properties["looker_location"]
+    viz_extn_dir = os.path.normpath(client_properties.get("looker_viz_extn_location", "None"))
+    with os.scandir(looker_location) as dir_entries:
+        return sorted(entry.path for entry in dir_entries
+                      if entry.is_dir() and not entry.name.startswith('.') and os.path.normpath(entry.path) != viz_extn_dir)
+
 
 
 
@@ -2618,7 +6012,26 @@ def main():
     parseArgs.add_argument('-deployment_flag', type=str,
                            help='Performs install and configuration or only post-install configuration',
                            required=False,
-                           default='install', choices=['install', 'update_user_attributes', 'access_config'])
+                           default='install', choices=['install', 'update_user_attributes', 'access_config', 'rollback', 'batch_render',
+                                                        'verify', 'watch', 'bundle', 'install_bundle'])
+
+    parseArgs.add_argument('-snapshot_id', type=str,
+                           help='Snapshot to roll back to with -deployment_flag rollback. Defaults to previous deployment',
+                           required=False, default=None)
+
+    parseArgs.add_argument('-tenant_manifest', type=argparse.FileType('r', encoding='UTF-8'),
+                           help='Please provide json formatted tenant manifest file name for -deployment_flag batch_render',
+                           required=False, default=None)
+
+    parseArgs.add_argument('-bundle_file', type=str,
+                           help='Deployment bundle file written by -deployment_flag bundle and installed by '
+                                '-deployment_flag install_bundle',
+                           required=False, default=None)
+
+    parseArgs.add_argument('-verify_scope', type=str,
+                           help='With -deployment_flag verify: tenant - Project folder of CLIENT_ID, '
+                                'fleet - all Project folders under looker_location',
+                           required=False, default='tenant', choices=['tenant', 'fleet'])
 
     args = parseArgs.parse_args()
 
@@ -2631,7 +6044,7 @@ def main():
     # Enforce ClientID naming convention:
     # 1. It cannot contain special characters and slashes
     # 2. It cannot be longer than 30 characters
-    if re.search(r'[/@#%^\\\-]+', ClientID) or (len(ClientID) > 30):
+    if not is_valid_client_id(ClientID):
         debug("ClientID contains invalid characters or too long. Please enter valid ClientID", _ERROR)
         debug("Deployment will be aborted")
         exit(1)
@@ -2712,9 +6125,73 @@ def main():
     # debug("********** Started Looker Environment deployment at {} **********".format(get_date_timestamp(current_time=True)))
     debug("********** Started Looker Environment deployment at {} **********".format(build_start_dt))
 
+    # Stage report is written next to log file, also when deployment is aborted
+    stage_report_file = os.path.splitext(log_file_name)[0] + "_stages.json"
+    atexit.register(write_stage_report, stage_report_file,
+                    {"client_id": ClientID, "deployment_flag": deployment_flag, "started_at": build_start_dt})
+
 
 # Start deployment
 
+    # Rollback re-materializes content from content store and does not require Looker API
+    if deployment_flag == 'rollback':
+        with deployment_stage("rollback"):
+            rollback_deployment(client_prop, CLIENT_DEPLOYMENT_DIR, ClientID, args.snapshot_id)
+        return
+
+    # Batch render renders offline content for all tenants in manifest and does not require Looker API
+    if deployment_flag == 'batch_render':
+        if args.tenant_manifest is None:
+            debug("Tenant manifest is required for batch render. Use -tenant_manifest parameter", _ERROR)
+            exit(1)
+        check_prod_apps_models(client_prop)
+        with deployment_stage("batch_render"):
+            batch_rendered = batch_render(client_prop, CLIENT_DEPLOYMENT_DIR, get_json_prop(args.tenant_manifest))
+        if not batch_rendered:
+            exit(1)
+        return
+
+    # Bundle renders content into deployment bundle on build host and does not require Looker API
+    if deployment_flag == 'bundle':
+        check_prod_apps_models(client_prop)
+        bundle_file = args.bundle_file or os.path.join(CLIENT_DEPLOYMENT_DIR, "{}{}.tar.gz".format(
+            get_looker_project_name(client_prop, ClientID), get_date_timestamp()))
+        with deployment_stage("offline_deployment"):
+            offline_deployment(client_prop, CLIENT_DEPLOYMENT_DIR, ClientID, get_db_connection_name(client_prop, ClientID),
+                               bundle_file=bundle_file)
+        return
+
+    # Bundle is installed on Looker node without rendering and does not require Looker API
+    if deployment_flag == 'install_bundle':
+        if args.bundle_file is None:
+            debug("Deployment bundle is required for install_bundle. Use -bundle_file parameter", _ERROR)
+            exit(1)
+        with deployment_stage("install_bundle"):
+            bundle_installed = install_bundle(client_prop, args.bundle_file, ClientID)
+        if not bundle_installed:
+            exit(1)
+        return
+
+    # Watch redeploys changed content of COPS pre-cloned working copies and does not require Looker API
+    if deployment_flag == 'watch':
+        check_prod_apps_models(client_prop)
+        watch_deployment(client_prop, CLIENT_DEPLOYMENT_DIR, ClientID, get_db_connection_name(client_prop, ClientID))
+        return
+
+    # Verify compares deployed content with build manifests and does not require Looker API
+    if deployment_flag == 'verify':
+        if args.verify_scope == 'fleet':
+            content_target_dirs = get_fleet_content_target_dirs(client_prop)
+        else:
+            content_target_dirs = [os.path.join(client_prop["looker_location"],
+                                                get_looker_project_name(client_prop, ClientID))]
+        with deployment_stage("verify"):
+            deployments_verified = verify_deployments(client_prop, content_target_dirs,
+                                                      os.path.splitext(log_file_name)[0] + "_drift.json")
+        if not deployments_verified:
+            exit(1)
+        return
+
     # Check defined properties for consistency
     check_prod_apps_models(client_prop)
 
@@ -2726,12 +6203,13 @@ def main():
     # We need to create db connectons before creating models so models will be valid right after deployment
         # Create connection
         # "Creating new db connection"
-        db_conn_name = looker_create_dbconnection(client_prop, current_access_token, ClientID)
-        debug("Checking just created connection: {}".format(db_conn_name), _DEBUG)
+        with deployment_stage("db_connection"):
+            db_conn_name = looker_create_dbconnection(client_prop, current_access_token, ClientID)
+            debug("Checking just created connection: {}".format(db_conn_name), _DEBUG)
 
-        # Test connection
-        debug("Testing created connection", _INFO)
-        looker_test_dbconnection(client_prop, current_access_token, db_conn_name)
+            # Test connection
+            debug("Testing created connection", _INFO)
+            looker_test_dbconnection(client_prop, current_access_token, db_conn_name)
 
     # Code base deployment. This is complete deployment (project is conected to customer github repo)
         if client_prop["project_mode"] == 'remote':
@@ -2777,7 +6255,8 @@ def main():
 
         else:
             if client_prop["project_mode"] == 'offline':
-                offline_deployment(client_prop, CLIENT_DEPLOYMENT_DIR, ClientID, db_conn_name)
+                with deployment_stage("offline_deployment"):
+                    offline_deployment(client_prop, CLIENT_DEPLOYMENT_DIR, ClientID, db_conn_name)
 
     # Clean up sequence. It deletes Models, db connection, Modle Sets, User Roles
         if args.cleanup == 'Y':
@@ -2790,75 +6269,78 @@ def main():
 
         # Configure LookML Models
         debug("Configure LookML Models", _INFO)
-        looker_create_lookml_model(client_prop, CLIENT_PROJECT_DEPLOYMENT_DIR, current_access_token, db_conn_name, LOOKER_PROJECT_NAME)
+        with deployment_stage("lookml_models"):
+            looker_create_lookml_model(client_prop, CLIENT_PROJECT_DEPLOYMENT_DIR, current_access_token, db_conn_name, LOOKER_PROJECT_NAME)
 
     # TO DO - add model checking for has_content attribute
 
         # *** Configure Data Access ***
-        product_deployed = client_prop["product_prefix"]
-        create_roles = client_prop[product_deployed]["roles"]
-        if create_roles:
-            debug("Product {} requires Roles {} configuration".format(product_deployed.upper(), create_roles), _INFO)
-            debug("The following steps will be performed:", _INFO)
-            debug("     1. Create Model Sets", _INFO)
-            debug("     2. Create Permission Sets", _INFO)
-            debug("     3. Create Roles based on Model and Permission Sets", _INFO)
-            debug("**********************************************************************")
-            # Get LookML models
-            debug("Getting LookML Models configured on Looker instance for Product", _INFO)
-            current_lookml_models = looker_get_lookml_models(client_prop, current_access_token, ClientID)
-
-            # Create Model Sets - one per available model per Client
-            debug("Creating Model Sets", _INFO)
-            looker_create_model_set(client_prop, current_access_token, current_lookml_models, ClientID)
-
-            # Getting existing Model Sets
-            debug("Getting Model Sets", _INFO)
-            current_model_sets = looker_get_model_sets(client_prop, current_access_token, current_lookml_models, ClientID)
-
-            # Create Permission Sets (App User and App Power User)
-            debug("Creating Permission Sets", _INFO)
-            looker_create_permission_set(client_prop, current_access_token)
-
-            # Get All Permission Sets
-            debug("Getting Permission Sets", _INFO)
-            current_permission_sets = looker_get_permission_sets(client_prop, current_access_token)
-
-            # Create Roles per Application (Model Set/Permission Set)
-            debug("Creating Roles", _INFO)
-            looker_create_role(client_prop, current_access_token, current_lookml_models, current_model_sets, current_permission_sets, ClientID)
-
-            groups_config = client_prop.get("groups", "None")
-            if groups_config != 'None':
-                create_groups = client_prop[product_deployed]["groups"]
-                if create_groups:
-                #if product_deployed == 'cdm':
-                    debug("Product {} requires Groups creation and Role-Group assignment".format(product_deployed.upper()), _INFO)
-
-                    debug(" Creating Groups", _INFO)
-                    looker_create_group(client_prop, current_access_token, ClientID)
-
-                    debug("Getting Groups", _INFO)
-                    current_groups = looker_get_groups(client_prop, current_access_token, ClientID)
-
-                    debug("Getting Roles for Group assignment", _INFO)
-                    current_roles = looker_get_roles(client_prop, current_access_token, ClientID)
-
-                    #debug("     Getting Groups for Role", _INFO)
-                    #looker_get_role_groups(client_prop, current_access_token, 99)
-
-                    debug("Assigning Groups to Roles", _INFO)
-                    looker_update_role_groups(client_prop, current_access_token, ClientID, current_roles, current_groups)
+        with deployment_stage("data_access"):
+            product_deployed = client_prop["product_prefix"]
+            create_roles = client_prop[product_deployed]["roles"]
+            if create_roles:
+                debug("Product {} requires Roles {} configuration".format(product_deployed.upper(), create_roles), _INFO)
+                debug("The following steps will be performed:", _INFO)
+                debug("     1. Create Model Sets", _INFO)
+                debug("     2. Create Permission Sets", _INFO)
+                debug("     3. Create Roles based on Model and Permission Sets", _INFO)
+                debug("**********************************************************************")
+                # Get LookML models
+                debug("Getting LookML Models configured on Looker instance for Product", _INFO)
+                current_lookml_models = looker_get_lookml_models(client_prop, current_access_token, ClientID)
+
+                # Create Model Sets - one per available model per Client
+                debug("Creating Model Sets", _INFO)
+                looker_create_model_set(client_prop, current_access_token, current_lookml_models, ClientID)
+
+                # Getting existing Model Sets
+                debug("Getting Model Sets", _INFO)
+                current_model_sets = looker_get_model_sets(client_prop, current_access_token, current_lookml_models, ClientID)
+
+                # Create Permission Sets (App User and App Power User)
+                debug("Creating Permission Sets", _INFO)
+                looker_create_permission_set(client_prop, current_access_token)
+
+                # Get All Permission Sets
+                debug("Getting Permission Sets", _INFO)
+                current_permission_sets = looker_get_permission_sets(client_prop, current_access_token)
+
+                # Create Roles per Application (Model Set/Permission Set)
+                debug("Creating Roles", _INFO)
+                looker_create_role(client_prop, current_access_token, current_lookml_models, current_model_sets, current_permission_sets, ClientID)
+
+                groups_config = client_prop.get("groups", "None")
+                if groups_config != 'None':
+                    create_groups = client_prop[product_deployed]["groups"]
+                    if create_groups:
+                    #if product_deployed == 'cdm':
+                        debug("Product {} requires Groups creation and Role-Group assignment".format(product_deployed.upper()), _INFO)
+
+                        debug(" Creating Groups", _INFO)
+                        looker_create_group(client_prop, current_access_token, ClientID)
+
+                        debug("Getting Groups", _INFO)
+                        current_groups = looker_get_groups(client_prop, current_access_token, ClientID)
+
+                        debug("Getting Roles for Group assignment", _INFO)
+                        current_roles = looker_get_roles(client_prop, current_access_token, ClientID)
+
+                        #debug("     Getting Groups for Role", _INFO)
+                        #looker_get_role_groups(client_prop, current_access_token, 99)
+
+                        debug("Assigning Groups to Roles", _INFO)
+                        looker_update_role_groups(client_prop, current_access_token, ClientID, current_roles, current_groups)
+                    else:
+                        debug("Groups are not configured for Product {}".format(product_deployed.upper()), _INFO)
                 else:
-                    debug("Groups are not configured for Product {}".format(product_deployed.upper()), _INFO)
-            else:
-                debug("Product {} does not require Group configuration".format(product_deployed.upper()), _INFO)
+                    debug("Product {} does not require Group configuration".format(product_deployed.upper()), _INFO)
         # *** End of Configure Data Access ***
 
 
 
         debug("Creating User Attributes", _INFO)
-        looker_create_user_attribute(client_prop, current_access_token, ClientID)
+        with deployment_stage("create_user_attributes"):
+            looker_create_user_attribute(client_prop, current_access_token, ClientID)
 
     # End of Deployment phase
 
@@ -2868,10 +6350,11 @@ def main():
     if (deployment_flag == 'update_user_attributes' or deployment_flag == 'install'):
         debug("Performing post-install updates", _INFO)
         debug(" Updating User Attributes", _INFO)
-        user_attr = looker_get_user_attributes(client_prop, current_access_token, ClientID)
-        debug("Server User Attributes: {}".format(user_attr))
-        # Update user attributes
-        looker_update_user_attribute(client_prop, current_access_token, user_attr)
+        with deployment_stage("update_user_attributes"):
+            user_attr = looker_get_user_attributes(client_prop, current_access_token, ClientID)
+            debug("Server User Attributes: {}".format(user_attr))
+            # Update user attributes
+            looker_update_user_attribute(client_prop, current_access_token, user_attr)
 
 
     # Access configuration sequence
@@ -2883,7 +6366,8 @@ def main():
         debug("File {} exists, application will create access configuration".format(_access_config_file), _INFO)
         try:
             access_config_file = open(_access_config_file, encoding='UTF-8')
-            access_cofiguration(access_config_file, client_prop, current_access_token, ClientID)
+            with deployment_stage("access_configuration"):
+                access_cofiguration(access_config_file, client_prop, current_access_token, ClientID)
         except IOError:
             debug("Cannot read file {}".format(_access_config_file), _ERROR)
 
@@ -0,0 +1,625 @@
+import os
+import re
+import pickle
+import hashlib
+import tempfile
+
+# Bump when parsed tree layout changes, invalidates cached trees
+_LOOKML_PARSER_VERSION = 2
+
+_TOKEN_PATTERN = re.compile(r'''
+     (?P<ws>\s+)
+    |(?P<comment>\#[^\n]*)
+    |(?P<string>"(?:[^"\\]|\\.)*")
+    |(?P<colon>:)
+    |(?P<lbrace>\{)
+    |(?P<rbrace>\})
+    |(?P<lbracket>\[)
+    |(?P<rbracket>\])
+    |(?P<comma>,)
+    |(?P<ident>[^\s{}\[\],:"\#]+)
+''', re.VERBOSE | re.DOTALL)
+
+# Tokens which are neither content nor structure
+_TRIVIA = ('ws', 'comment', 'marker')
+# Tokens holding LookML values
+_VALUE_TOKENS = ('string', 'sql', 'ident', 'text')
+
+# Dashboard (YAML LookML) tokens
+_DASHBOARD_KEY = re.compile(r'[^\s\-\[\]{}"\'#|>,:][^:\n#]*?(?=:(?:[ \t\r]|\n|$))')
+_DASHBOARD_INLINE_WS = re.compile(r'[ \t\r]*')
+_DASHBOARD_COMMENT = re.compile(r'#[^\n]*')
+_DASHBOARD_STRING = re.compile(r'"(?:[^"\\]|\\.)*"|\'(?:[^\']|\'\')*\'', re.DOTALL)
+_DASHBOARD_PLAIN = re.compile(r'[^\n]*?(?=[ \t\r]*(?:\n|$)|[ \t]+#)')
+_DASHBOARD_FLOW_ITEM = re.compile(r'[^,\[\]{}\n"\']+')
+_DASHBOARD_FLOW_KEY = re.compile(r'"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\n]|\'\')*\'|[^,\[\]{}:\n"\'#]*[^,\[\]{}:\n"\'#\s](?=[ \t]*:)')
+_DASHBOARD_BLOCK_HEADER = re.compile(r'[|>][-+0-9]*[^\n]*')
+
+
+class LookmlSyntaxError(ValueError):
+    pass
+
+
+class LookmlToken(object):
+    """
+    Token keeps exact source text, so the tree is serialized back without any change
+    """
+    __slots__ = ('type', 'text')
+
+    def __init__(self, type, text):
+        self.type = type
+        self.text = text
+
+    def __repr__(self):
+        return "LookmlToken({!r}, {!r})".format(self.type, self.text)
+
+    def dump(self):
+        return self.text
+
+
+class LookmlNode(object):
+    """
+    LookML tree node:
+        root  - file
+        pair  - key: value
+        block - key: name { ... } or key: { ... }, in dashboard files key: followed by indented entries
+        list  - key: [ ... ]
+        item  - - entry of dashboard files sequence
+    Tokens hold node source in order: key, colon, trivia, value tokens and child nodes.
+    """
+    __slots__ = ('kind', 'key', 'name', 'tokens')
+
+    def __init__(self, kind, key=None):
+        self.kind = kind
+        self.key = key
+        self.name = None
+        self.tokens = list()
+
+    def __repr__(self):
+        return "LookmlNode({!r}, {!r}, {!r})".format(self.kind, self.key, self.name)
+
+    def dump(self):
+        return ''.join(token.dump() for token in self.tokens)
+
+    def children(self):
+        """
+        :return: child nodes in source order
+        """
+        return [token for token in self.tokens if isinstance(token, LookmlNode)]
+
+    def value_tokens(self):
+        """
+        :return: own value tokens - string, sql and ident tokens of the node except the key
+        """
+        return [token for token in self.tokens[1:] if isinstance(token, LookmlToken) and token.type in _VALUE_TOKENS]
+
+
+def is_sql_key(key):
+    """
+    :param key: LookML parameter name
+    :return: True if parameter value is raw text terminated by ;;
+    """
+    return key == 'html' or key.startswith('sql') or key.endswith('_sql') or key.endswith('expression')
+
+
+def tokenize_lookml(content_text):
+    """
+    :param content_text:
+    :return: list of LookmlToken, joined token texts are equal to content text
+    Raises:
+        LookmlSyntaxError: if text cannot be tokenized
+    """
+    tokens = list()
+    last_ident = None
+    pos = 0
+    while pos < len(content_text):
+        if tokens and tokens[-1].type == 'colon' and last_ident is not None and is_sql_key(last_ident):
+            # Raw value ends with ;;
+            end = content_text.find(';;', pos)
+            if end < 0:
+                raise LookmlSyntaxError("Value of {} is not terminated with ;;".format(last_ident))
+            tokens.append(LookmlToken('sql', content_text[pos:end + 2]))
+            pos = end + 2
+            last_ident = None
+            continue
+
+        token_match = _TOKEN_PATTERN.match(content_text, pos)
+        if token_match is None:
+            raise LookmlSyntaxError("Unexpected character {!r} at line {}".format(content_text[pos],
+                                                                               content_text.count('\n', 0, pos) + 1))
+        token_type = token_match.lastgroup
+        tokens.append(LookmlToken(token_type, token_match.group()))
+        if token_type == 'ident':
+            last_ident = token_match.group()
+        elif token_type not in _TRIVIA and token_type != 'colon':
+            last_ident = None
+        pos = token_match.end()
+    return tokens
+
+
+def parse_lookml(content_text):
+    """
+    Function parses LookML model, view or explore file into lossless tree.
+    :param content_text:
+    :return: root LookmlNode, root.dump() is equal to content text
+    Raises:
+        LookmlSyntaxError: if text is not valid LookML
+    """
+    tokens = tokenize_lookml(content_text)
+    root = LookmlNode('root')
+    pos = _parse_statements(tokens, 0, root, None)
+    if pos != len(tokens):
+        raise LookmlSyntaxError("Unexpected {}".format(tokens[pos].text))
+    return root
+
+
+def _skip_trivia(tokens, pos, target):
+    while pos < len(tokens) and tokens[pos].type in _TRIVIA:
+        target.append(tokens[pos])
+        pos += 1
+    return pos
+
+
+def _parse_statements(tokens, pos, parent, closing):
+    """
+    Parses key: value statements into parent node until closing token type.
+    :return: position of closing token or end of tokens
+    """
+    while True:
+        pos = _skip_trivia(tokens, pos, parent.tokens)
+        if pos >= len(tokens):
+            if closing is not None:
+                raise LookmlSyntaxError("Block {} is not closed".format(parent.key))
+            return pos
+        if tokens[pos].type == closing:
+            return pos
+        if tokens[pos].type != 'ident':
+            raise LookmlSyntaxError("Expected parameter name, found {}".format(tokens[pos].text))
+        pos = _parse_pair(tokens, pos, parent)
+
+
+def _parse_pair(tokens, pos, parent):
+    """
+    Parses key: value statement starting at key token and appends node to parent.
+    :return: position after statement
+    """
+    node = LookmlNode('pair', tokens[pos].text)
+    node.tokens.append(tokens[pos])
+    parent.tokens.append(node)
+
+    pos = _skip_trivia(tokens, pos + 1, node.tokens)
+    if pos >= len(tokens) or tokens[pos].type != 'colon':
+        raise LookmlSyntaxError("Expected : after {}".format(node.key))
+    node.tokens.append(tokens[pos])
+
+    pos = _skip_trivia(tokens, pos + 1, node.tokens)
+    if pos >= len(tokens):
+        raise LookmlSyntaxError("Missing value of {}".format(node.key))
+
+    token = tokens[pos]
+    if token.type == 'lbrace':
+        return _parse_block(tokens, pos, node)
+    elif token.type == 'lbracket':
+        return _parse_list(tokens, pos, node)
+    elif token.type in _VALUE_TOKENS:
+        node.tokens.append(token)
+        pos += 1
+        if token.type != 'sql':
+            # Named block - key: name {
+            trivia = list()
+            next_pos = _skip_trivia(tokens, pos, trivia)
+            if next_pos < len(tokens) and tokens[next_pos].type == 'lbrace':
+                node.name = token.text
+                node.tokens.extend(trivia)
+                return _parse_block(tokens, next_pos, node)
+        return pos
+    raise LookmlSyntaxError("Unexpected {} in value of {}".format(token.text, node.key))
+
+
+def _parse_block(tokens, pos, node):
+    node.kind = 'block'
+    node.tokens.append(tokens[pos])
+    pos = _parse_statements(tokens, pos + 1, node, 'rbrace')
+    node.tokens.append(tokens[pos])
+    return pos + 1
+
+
+def _parse_list(tokens, pos, node):
+    node.kind = 'list'
+    node.tokens.append(tokens[pos])
+    pos += 1
+    while True:
+        pos = _skip_trivia(tokens, pos, node.tokens)
+        if pos >= len(tokens):
+            raise LookmlSyntaxError("List {} is not closed".format(node.key))
+        token = tokens[pos]
+        if token.type == 'rbracket':
+            node.tokens.append(token)
+            return pos + 1
+        elif token.type == 'ident':
+            # Pair item - field: value
+            trivia = list()
+            next_pos = _skip_trivia(tokens, pos + 1, trivia)
+            if next_pos < len(tokens) and tokens[next_pos].type == 'colon':
+                pos = _parse_pair(tokens, pos, node)
+                continue
+            node.tokens.append(token)
+            pos += 1
+        elif token.type in ('string', 'comma'):
+            node.tokens.append(token)
+            pos += 1
+        else:
+            raise LookmlSyntaxError("Unexpected {} in list {}".format(token.text, node.key))
+
+
+def parse_dashboard(content_text):
+    """
+    Function parses dashboard file (YAML LookML) into lossless tree of the same nodes as LookML files:
+    mappings with scalar values are pair nodes, mappings with nested entries and flow mappings are
+    block nodes, flow sequences are list nodes and sequence entries are item nodes. Plain scalars are ident tokens,
+    quoted scalars string tokens and block scalars text tokens.
+    :param content_text:
+    :return: root LookmlNode, root.dump() is equal to content text
+    Raises:
+        LookmlSyntaxError: if text is not in YAML subset used by dashboard files
+    """
+    root = LookmlNode('root')
+    # Open containers: [node, indentation of node key, indentation of its entries, entries are sequence]
+    stack = [[root, -1, None, False]]
+    pos = 0
+    while pos < len(content_text):
+        line_end = content_text.find('\n', pos)
+        if line_end < 0:
+            line_end = len(content_text)
+        line = content_text[pos:line_end]
+        entry = line.lstrip(' ')
+        indent = len(line) - len(entry)
+        try:
+            if not entry.strip() or entry.startswith('#') or entry.rstrip() in ('---', '...'):
+                _append_dashboard_trivia(content_text, pos, line_end, stack[-1][0].tokens)
+            else:
+                if entry.startswith('\t'):
+                    raise LookmlSyntaxError("Tab in indentation")
+                is_item = entry.startswith('-') and (len(entry) == 1 or entry[1] in ' \t\r')
+                container = _get_dashboard_container(stack, indent, is_item)
+                if indent:
+                    container.tokens.append(LookmlToken('ws', line[:indent]))
+                if is_item:
+                    end = _parse_dashboard_item(content_text, pos + indent, indent, container, stack)
+                else:
+                    end = _parse_dashboard_entry(content_text, pos + indent, indent, container, stack)
+                # Quoted scalar may continue on next lines
+                line_end = content_text.find('\n', end)
+                if line_end < 0:
+                    line_end = len(content_text)
+                if end != line_end:
+                    raise LookmlSyntaxError("Unexpected {!r}".format(content_text[end:line_end]))
+        except LookmlSyntaxError as e:
+            raise LookmlSyntaxError("{} at line {}".format(str(e), content_text.count('\n', 0, pos) + 1))
+        if line_end < len(content_text):
+            stack[-1][0].tokens.append(LookmlToken('ws', '\n'))
+        pos = line_end + 1
+    return root
+
+
+def _append_dashboard_trivia(content_text, pos, line_end, target):
+    """
+    Appends whitespace, comment or document marker line without its line break to target tokens.
+    """
+    line = content_text[pos:line_end]
+    entry = line.lstrip(' \t')
+    if len(entry) < len(line):
+        target.append(LookmlToken('ws', line[:len(line) - len(entry)]))
+    if entry.startswith('#'):
+        target.append(LookmlToken('comment', entry))
+    elif entry.strip():
+        target.append(LookmlToken('marker', entry))
+    elif entry:
+        target.append(LookmlToken('ws', entry))
+
+
+def _get_dashboard_container(stack, indent, is_item):
+    """
+    Closes containers the line at indent does not belong to.
+    :return: container node of the line
+    """
+    while True:
+        level = stack[-1]
+        node, key_indent, entries_indent, is_sequence = level
+        if entries_indent is None:
+            # The first entry of container, sequence may have the same indentation as its key
+            if node.kind == 'root' or indent > key_indent or (indent == key_indent and is_item and node.kind == 'block'):
+                level[2], level[3] = indent, is_item
+                return node
+        elif indent == entries_indent and is_item == is_sequence:
+            return node
+        elif indent > entries_indent:
+            raise LookmlSyntaxError("Unexpected indentation")
+        if node.kind == 'root':
+            raise LookmlSyntaxError("Unexpected indentation")
+        stack.pop()
+
+
+def _parse_dashboard_item(content_text, pos, indent, container, stack):
+    """
+    Parses - sequence entry and appends item node to container.
+    :return: position of line end
+    """
+    node = LookmlNode('item')
+    node.tokens.append(LookmlToken('dash', '-'))
+    container.tokens.append(node)
+    pos = _append_dashboard_inline_trivia(content_text, pos + 1, node.tokens)
+    if pos >= len(content_text) or content_text[pos] == '\n':
+        # Entries follow on next lines
+        stack.append([node, indent, None, False])
+        return pos
+    if _DASHBOARD_KEY.match(content_text, pos):
+        # Mapping starts on the same line, its entries are aligned with the first key
+        entries_indent = pos - content_text.rfind('\n', 0, pos) - 1
+        stack.append([node, indent, entries_indent, False])
+        return _parse_dashboard_entry(content_text, pos, entries_indent, node, stack)
+    if content_text[pos] == '-':
+        raise LookmlSyntaxError("Nested sequence is not supported")
+    return _parse_dashboard_value(content_text, pos, indent, node)
+
+
+def _parse_dashboard_entry(content_text, pos, indent, container, stack):
+    """
+    Parses key: value mapping entry and appends node to container.
+    :return: position of line end
+    """
+    key_match = _DASHBOARD_KEY.match(content_text, pos)
+    if key_match is None:
+        raise LookmlSyntaxError("Expected key")
+    key = key_match.group().rstrip()
+    node = LookmlNode('pair', key)
+    node.tokens.append(LookmlToken('ident', key))
+    if len(key) < len(key_match.group()):
+        node.tokens.append(LookmlToken('ws', key_match.group()[len(key):]))
+    node.tokens.append(LookmlToken('colon', ':'))
+    container.tokens.append(node)
+
+    pos = _append_dashboard_inline_trivia(content_text, key_match.end() + 1, node.tokens)
+    if pos >= len(content_text) or content_text[pos] == '\n':
+        # Entries follow on next lines
+        node.kind = 'block'
+        stack.append([node, indent, None, False])
+        return pos
+    return _parse_dashboard_value(content_text, pos, indent, node)
+
+
+def _parse_dashboard_value(content_text, pos, indent, node):
+    """
+    Parses scalar or flow sequence value of node.
+    :param indent: indentation of node, block scalar lines are indented more
+    :return: position of line end
+    """
+    char = content_text[pos]
+    if char in ('"', "'"):
+        value_match = _DASHBOARD_STRING.match(content_text, pos)
+        if value_match is None:
+            raise LookmlSyntaxError("String is not terminated")
+        node.tokens.append(LookmlToken('string', value_match.group()))
+        pos = value_match.end()
+    elif char in ('[', '{'):
+        pos = _parse_dashboard_flow(content_text, pos, node)
+    elif char in ('|', '>'):
+        pos = _parse_dashboard_block_scalar(content_text, pos, indent, node)
+    elif char in ('&', '*', '!'):
+        raise LookmlSyntaxError("Unsupported YAML syntax {!r}".format(char))
+    else:
+        value_match = _DASHBOARD_PLAIN.match(content_text, pos)
+        if not value_match.group():
+            raise LookmlSyntaxError("Expected value of {}".format(node.key))
+        node.tokens.append(LookmlToken('ident', value_match.group()))
+        pos = value_match.end()
+    return _append_dashboard_inline_trivia(content_text, pos, node.tokens)
+
+
+def _parse_dashboard_flow(content_text, pos, node):
+    """
+    Parses flow sequence [ ... ] into list node or flow mapping { ... } into block node.
+    Nested flow collections are child nodes without key, flow mapping entries are pair nodes.
+    :return: position after closing bracket
+    """
+    is_mapping = content_text[pos] == '{'
+    node.kind = 'block' if is_mapping else 'list'
+    node.tokens.append(LookmlToken('lbrace' if is_mapping else 'lbracket', content_text[pos]))
+    closing = '}' if is_mapping else ']'
+    pos += 1
+    while True:
+        pos = _append_dashboard_inline_trivia(content_text, pos, node.tokens)
+        if pos >= len(content_text):
+            raise LookmlSyntaxError("Flow collection {} is not closed".format(node.key))
+        char = content_text[pos]
+        if char == '\n':
+            node.tokens.append(LookmlToken('ws', char))
+            pos += 1
+        elif char == closing:
+            node.tokens.append(LookmlToken('rbrace' if is_mapping else 'rbracket', char))
+            return pos + 1
+        elif char == ',':
+            node.tokens.append(LookmlToken('comma', char))
+            pos += 1
+        elif is_mapping:
+            pos = _parse_dashboard_flow_entry(content_text, pos, node)
+        else:
+            pos = _parse_dashboard_flow_value(content_text, pos, node)
+
+
+def _parse_dashboard_flow_entry(content_text, pos, container):
+    key_match = _DASHBOARD_FLOW_KEY.match(content_text, pos)
+    if key_match is None:
+        raise LookmlSyntaxError("Expected key in {}".format(container.key))
+    key = key_match.group().strip('"\'')
+    node = LookmlNode('pair', key)
+    node.tokens.append(LookmlToken('ident' if key == key_match.group() else 'string', key_match.group()))
+    container.tokens.append(node)
+    pos = _append_dashboard_inline_trivia(content_text, key_match.end(), node.tokens)
+    if content_text[pos:pos + 1] != ':':
+        raise LookmlSyntaxError("Expected : after {}".format(key))
+    node.tokens.append(LookmlToken('colon', ':'))
+    pos = _append_dashboard_inline_trivia(content_text, pos + 1, node.tokens)
+    return _parse_dashboard_flow_value(content_text, pos, node)
+
+
+def _parse_dashboard_flow_value(content_text, pos, node):
+    """
+    Parses scalar or nested flow collection into node.
+    :return: position after value
+    """
+    char = content_text[pos] if pos < len(content_text) else ''
+    if char in ('[', '{'):
+        child = LookmlNode('list')
+        node.tokens.append(child)
+        return _parse_dashboard_flow(content_text, pos, child)
+    if char in ('"', "'"):
+        value_match = _DASHBOARD_STRING.match(content_text, pos)
+        if value_match is None:
+            raise LookmlSyntaxError("String is not terminated")
+        node.tokens.append(LookmlToken('string', value_match.group()))
+        return value_match.end()
+    value_match = _DASHBOARD_FLOW_ITEM.match(content_text, pos)
+    if value_match is None or not value_match.group().strip():
+        raise LookmlSyntaxError("Unexpected {!r} in {}".format(char, node.key))
+    value = value_match.group().rstrip()
+    node.tokens.append(LookmlToken('ident', value))
+    return pos + len(value)
+
+
+def _parse_dashboard_block_scalar(content_text, pos, indent, node):
+    """
+    Block scalar is one text token of header and all following lines indented more than node,
+    blank lines after the last such line are left to trivia.
+    """
+    end = _DASHBOARD_BLOCK_HEADER.match(content_text, pos).end()
+    line_end = end
+    while line_end < len(content_text):
+        next_end = content_text.find('\n', line_end + 1)
+        if next_end < 0:
+            next_end = len(content_text)
+        line = content_text[line_end + 1:next_end]
+        if line.strip() and len(line) - len(line.lstrip(' ')) <= indent:
+            break
+        if line.strip():
+            end = next_end
+        line_end = next_end
+    node.tokens.append(LookmlToken('text', content_text[pos:end]))
+    return end
+
+
+def _append_dashboard_inline_trivia(content_text, pos, target):
+    """
+    Appends whitespace and comment up to line end to target tokens.
+    :return: position after trivia
+    """
+    ws_match = _DASHBOARD_INLINE_WS.match(content_text, pos)
+    if ws_match.group():
+        target.append(LookmlToken('ws', ws_match.group()))
+    comment_match = _DASHBOARD_COMMENT.match(content_text, ws_match.end())
+    if comment_match is None:
+        return ws_match.end()
+    target.append(LookmlToken('comment', comment_match.group()))
+    return comment_match.end()
+
+
+def walk_lookml(node, parent=None):
+    """
+    :param node: LookmlNode
+    :param parent: parent of node
+    :return: generator of (parent, node) for node and all its descendants in source order
+    """
+    yield parent, node
+    for child in node.children():
+        yield from walk_lookml(child, node)
+
+
+class LookmlTreeCache(object):
+    """
+    Parsed LookML trees cached in memory and on disk by content hash, so files shared by
+    tenants and runs are parsed once. Every lookup returns a new copy of the tree,
+    which can be transformed in place.
+    """
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self._trees = dict()
+        self._errors = dict()
+
+    def parse(self, content_text, dashboard=False):
+        """
+        :param content_text:
+        :param dashboard: True - text is dashboard file (YAML LookML)
+        :return: root LookmlNode
+        Raises:
+            LookmlSyntaxError: if text is not valid LookML
+        """
+        content_hash = hashlib.sha256("{}\0{}\0{}".format(_LOOKML_PARSER_VERSION, 'dashboard' if dashboard else 'lookml',
+                                                          content_text).encode('utf-8')).hexdigest()
+        if content_hash in self._errors:
+            raise LookmlSyntaxError(self._errors[content_hash])
+
+        tree_data = self._trees.get(content_hash)
+        if tree_data is None and self.cache_dir is not None:
+            tree_data = self._read_tree(content_hash)
+        if tree_data is None:
+            try:
+                tree = parse_dashboard(content_text) if dashboard else parse_lookml(content_text)
+            except LookmlSyntaxError as e:
+                self._errors[content_hash] = str(e)
+                raise
+            tree_data = pickle.dumps(tree, pickle.HIGHEST_PROTOCOL)
+            if self.cache_dir is not None:
+                self._write_tree(content_hash, tree_data)
+        self._trees[content_hash] = tree_data
+        return pickle.loads(tree_data)
+
+    def _tree_file(self, content_hash):
+        return os.path.join(self.cache_dir, content_hash[:2], content_hash + '.pickle')
+
+    def _read_tree(self, content_hash):
+        try:
+            with open(self._tree_file(content_hash), 'rb') as tree_fh:
+                tree_data = tree_fh.read()
+            pickle.loads(tree_data)
+            return tree_data
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, TypeError):
+            return None
+
+    def _write_tree(self, content_hash, tree_data):
+        tree_file = self._tree_file(content_hash)
+        try:
+            os.makedirs(os.path.dirname(tree_file), exist_ok=True)
+            temp_fd, temp_file = tempfile.mkstemp(prefix=content_hash + '.tmp', dir=os.path.dirname(tree_file))
+            with os.fdopen(temp_fd, 'wb') as temp_fh:
+                temp_fh.write(tree_data)
+            os.replace(temp_file, tree_file)
+        except OSError:
+            # Cache is an optimization only
+            pass
+
+
+def get_node_values(node):
+    """
+    :param node: LookmlNode
+    :return: list of own string, ident and text values of node, strings without quotes
+    """
+    return [token.text[1:-1] if token.type == 'string' else token.text
+            for token in node.value_tokens() if token.type != 'sql']
+
+
+def get_node_text(node):
+    """
+    :param node: LookmlNode
+    :return: text of string and sql values of node and all its descendants
+    """
+    return '\n'.join(token.text for parent, child in walk_lookml(node)
+                     for token in child.value_tokens() if token.type != 'ident')
+
+
+def find_lookml_nodes(node, key):
+    """
+    :param node: LookmlNode
+    :param key: LookML parameter name
+    :return: list of (parent, node) for all descendant nodes with the key
+    """
+    return [(parent, child) for parent, child in walk_lookml(node) if child.key == key]
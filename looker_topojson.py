@@ -0,0 +1,235 @@
+import os
+import json
+import math
+import hashlib
+import tempfile
+
+# Bump when simplified output changes, invalidates cached topologies
+_TOPOJSON_SIMPLIFY_VERSION = 1
+
+
+class TopologyError(ValueError):
+    pass
+
+
+def decode_arcs(topology):
+    """
+    :param topology: TopoJSON Topology
+    :return: list of arcs with absolute positions, quantized delta encoded arcs are decoded
+    """
+    transform = topology.get("transform")
+    if transform is None:
+        return [[list(position) for position in arc] for arc in topology["arcs"]]
+
+    (kx, ky), (dx, dy) = transform["scale"], transform["translate"]
+    arcs = list()
+    for arc in topology["arcs"]:
+        x = y = 0
+        positions = list()
+        for position in arc:
+            x += position[0]
+            y += position[1]
+            positions.append([x * kx + dx, y * ky + dy] + list(position[2:]))
+        arcs.append(positions)
+    return arcs
+
+
+def get_point_geometries(geometry):
+    """
+    :param geometry: TopoJSON geometry object
+    :return: generator of Point and MultiPoint geometries, their positions are not stored in arcs
+    """
+    if geometry.get("type") == "GeometryCollection":
+        for child in geometry.get("geometries", list()):
+            yield from get_point_geometries(child)
+    elif geometry.get("type") in ("Point", "MultiPoint"):
+        yield geometry
+
+
+def _segment_distance(position, start, end):
+    """
+    :return: distance of position from segment start - end
+    """
+    sx, sy = start[0], start[1]
+    ex, ey = end[0] - sx, end[1] - sy
+    px, py = position[0] - sx, position[1] - sy
+    segment_length = ex * ex + ey * ey
+    if segment_length == 0:
+        return math.hypot(px, py)
+    t = max(0.0, min(1.0, (px * ex + py * ey) / segment_length))
+    return math.hypot(px - t * ex, py - t * ey)
+
+
+def _simplify_line(positions, tolerance):
+    """
+    Douglas-Peucker simplification, end positions are always kept.
+    """
+    keep = [False] * len(positions)
+    keep[0] = keep[-1] = True
+    ranges = [(0, len(positions) - 1)]
+    while ranges:
+        start, end = ranges.pop()
+        max_distance, max_index = 0.0, None
+        for i in range(start + 1, end):
+            distance = _segment_distance(positions[i], positions[start], positions[end])
+            if distance > max_distance:
+                max_distance, max_index = distance, i
+        if max_index is not None and max_distance > tolerance:
+            keep[max_index] = True
+            ranges.append((start, max_index))
+            ranges.append((max_index, end))
+    return [position for position, kept in zip(positions, keep) if kept]
+
+
+def simplify_arc(positions, tolerance):
+    """
+    Function simplifies arc to tolerance. Arc ends are kept, so arcs shared by neighbouring
+    geometries stay connected. Closed arcs are kept as valid rings of at least 4 positions.
+    :param positions: absolute positions
+    :param tolerance: maximal distance of removed position from simplified arc in coordinate units
+    :return: simplified positions
+    """
+    if tolerance <= 0 or len(positions) <= 2:
+        return positions
+    if positions[0][:2] != positions[-1][:2]:
+        return _simplify_line(positions, tolerance)
+
+    # Ring is split at position farthest from its start
+    far_index = max(range(1, len(positions) - 1),
+                    key=lambda i: math.hypot(positions[i][0] - positions[0][0], positions[i][1] - positions[0][1]))
+    ring = _simplify_line(positions[:far_index + 1], tolerance)[:-1] + _simplify_line(positions[far_index:], tolerance)
+    return ring if len(ring) >= 4 else positions
+
+
+def simplify_topology(content_text, quantization, tolerance):
+    """
+    Function simplifies arcs of TopoJSON Topology to tolerance and quantizes positions.
+    :param content_text:
+    :param quantization: number of distinct values per dimension, 0 - positions are not quantized
+    :param tolerance: simplification tolerance in coordinate units, 0 - arcs are not simplified
+    :return: (compact Topology text, statistics) or (None, None) if text is not TopoJSON Topology
+    Raises:
+        TopologyError: if text is not valid JSON or Topology cannot be decoded
+    """
+    try:
+        topology = json.loads(content_text)
+    except ValueError as e:
+        raise TopologyError("Invalid JSON: {}".format(str(e)))
+    if not isinstance(topology, dict) or topology.get("type") != "Topology" or not isinstance(topology.get("arcs"), list):
+        return None, None
+
+    try:
+        transform = topology.get("transform")
+        arcs = decode_arcs(topology)
+        point_geometries = [geometry for layer in topology.get("objects", dict()).values()
+                            for geometry in get_point_geometries(layer)]
+        for geometry in point_geometries:
+            # Quantized points are not delta encoded
+            positions = [geometry["coordinates"]] if geometry["type"] == "Point" else geometry["coordinates"]
+            if transform is not None:
+                (kx, ky), (dx, dy) = transform["scale"], transform["translate"]
+                for position in positions:
+                    position[0:2] = [position[0] * kx + dx, position[1] * ky + dy]
+
+        simplified_arcs = [simplify_arc(arc, tolerance) for arc in arcs]
+
+        if quantization > 1:
+            all_positions = [position for arc in simplified_arcs for position in arc] + \
+                            [position for geometry in point_geometries for position in
+                             ([geometry["coordinates"]] if geometry["type"] == "Point" else geometry["coordinates"])]
+            if all_positions:
+                x0, x1 = min(p[0] for p in all_positions), max(p[0] for p in all_positions)
+                y0, y1 = min(p[1] for p in all_positions), max(p[1] for p in all_positions)
+            else:
+                x0 = x1 = y0 = y1 = 0
+            kx = (x1 - x0) / (quantization - 1) or 1
+            ky = (y1 - y0) / (quantization - 1) or 1
+            topology["transform"] = {"scale": [kx, ky], "translate": [x0, y0]}
+
+            encoded_arcs = list()
+            for arc in simplified_arcs:
+                encoded_arc = list()
+                last_x = last_y = 0
+                for i, position in enumerate(arc):
+                    x, y = int(round((position[0] - x0) / kx)), int(round((position[1] - y0) / ky))
+                    # Positions merged by quantization are removed, arc keeps both ends
+                    if encoded_arc and x == last_x and y == last_y and 0 < i < len(arc) - 1:
+                        continue
+                    encoded_arc.append([x - last_x, y - last_y] + list(position[2:]))
+                    last_x, last_y = x, y
+                encoded_arcs.append(encoded_arc)
+            topology["arcs"] = encoded_arcs
+            for geometry in point_geometries:
+                positions = [geometry["coordinates"]] if geometry["type"] == "Point" else geometry["coordinates"]
+                for position in positions:
+                    position[0:2] = [int(round((position[0] - x0) / kx)), int(round((position[1] - y0) / ky))]
+        else:
+            topology.pop("transform", None)
+            topology["arcs"] = simplified_arcs
+    except (KeyError, TypeError, IndexError, ValueError) as e:
+        raise TopologyError("Invalid Topology: {}".format(str(e)))
+
+    topology_text = json.dumps(topology, separators=(',', ':'))
+    topology_stats = {"input_size": len(content_text.encode('utf-8')),
+                      "output_size": len(topology_text.encode('utf-8')),
+                      "arcs": len(arcs),
+                      "input_positions": sum(len(arc) for arc in arcs),
+                      "output_positions": sum(len(arc) for arc in topology["arcs"])}
+    return topology_text, topology_stats
+
+
+class TopologyCache(object):
+    """
+    Simplified topologies cached in memory and on disk by hash of input text and settings,
+    so files shared by tenants and runs are simplified once.
+    """
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir
+        self._entries = dict()
+
+    def simplify(self, content_text, quantization, tolerance):
+        """
+        :param content_text:
+        :param quantization:
+        :param tolerance:
+        :return: (compact Topology text, statistics, True if result was cached) or (None, None, cached) if text is not TopoJSON Topology
+        Raises:
+            TopologyError: if text is not valid JSON or Topology cannot be decoded
+        """
+        content_hash = hashlib.sha256("{}\0{}\0{!r}\0{}".format(_TOPOJSON_SIMPLIFY_VERSION, quantization, float(tolerance),
+                                                                content_text).encode('utf-8')).hexdigest()
+        cached = True
+        entry = self._entries.get(content_hash)
+        if entry is None and self.cache_dir is not None:
+            entry = self._read_entry(content_hash)
+        if entry is None:
+            cached = False
+            topology_text, topology_stats = simplify_topology(content_text, quantization, tolerance)
+            entry = {"topology": topology_text, "stats": topology_stats}
+            if self.cache_dir is not None:
+                self._write_entry(content_hash, entry)
+        self._entries[content_hash] = entry
+        return entry["topology"], entry["stats"], cached
+
+    def _entry_file(self, content_hash):
+        return os.path.join(self.cache_dir, content_hash[:2], content_hash + '.json')
+
+    def _read_entry(self, content_hash):
+        try:
+            with open(self._entry_file(content_hash), 'r') as entry_fh:
+                entry = json.load(entry_fh)
+            return entry if "topology" in entry and "stats" in entry else None
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _write_entry(self, content_hash, entry):
+        entry_file = self._entry_file(content_hash)
+        try:
+            os.makedirs(os.path.dirname(entry_file), exist_ok=True)
+            temp_fd, temp_file = tempfile.mkstemp(prefix=content_hash + '.tmp', dir=os.path.dirname(entry_file))
+            with os.fdopen(temp_fd, 'w') as temp_fh:
+                json.dump(entry, temp_fh)
+            os.replace(temp_file, entry_file)
+        except OSError:
+            # Cache is an optimization only
+            pass
@@ -0,0 +1,242 @@
+import re
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    # Brotli siblings are written only if brotli module is installed
+    brotli = None
+
+# Bump when minified output changes, changes content hashed file names
+_VIZ_BUILD_VERSION = 1
+
+_WORD_CHARS = re.compile(r'[A-Za-z0-9_$\\\u0080-￿]')
+# Keywords after which / starts regular expression, not division
+_REGEX_KEYWORDS = ('return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void', 'throw',
+                   'case', 'do', 'else', 'yield', 'await')
+_PUNCTUATORS = ('>>>=', '...', '===', '!==', '**=', '<<=', '>>=', '>>>', '&&=', '||=', '??=',
+                '=>', '==', '!=', '<=', '>=', '&&', '||', '??', '?.', '++', '--', '+=', '-=', '*=', '/=',
+                '%=', '&=', '|=', '^=', '<<', '>>', '**')
+# Line break before these tokens never terminates statement
+_CONTINUATION_TOKENS = (';', ',', '.', ')', ']', '}', ':', '?', '=')
+
+
+class JsSyntaxError(ValueError):
+    pass
+
+
+def is_word_char(char):
+    return _WORD_CHARS.match(char) is not None
+
+
+def tokenize_js(content_text, pos=0, in_template=False):
+    """
+    Function splits JavaScript into tokens: ws, comment, string, template, regex, word and punct.
+    Numbers are split into word and punct tokens, it does not change whitespace around them.
+    :param content_text:
+    :param pos: start position
+    :param in_template: True - tokenize template substitution until its closing brace
+    :return: (list of (token type, text), end position)
+    Raises:
+        JsSyntaxError: if string, template, comment or regular expression is not terminated
+    """
+    tokens = list()
+    brace_depth = 0
+    last_significant = None
+    length = len(content_text)
+    while pos < length:
+        char = content_text[pos]
+        start = pos
+        if char.isspace():
+            while pos < length and content_text[pos].isspace():
+                pos += 1
+            tokens.append(('ws', content_text[start:pos]))
+            continue
+        if content_text.startswith('//', pos):
+            end = content_text.find('\n', pos)
+            pos = length if end < 0 else end
+            tokens.append(('comment', content_text[start:pos]))
+            continue
+        if content_text.startswith('/*', pos):
+            end = content_text.find('*/', pos + 2)
+            if end < 0:
+                raise JsSyntaxError("Comment is not terminated")
+            pos = end + 2
+            tokens.append(('comment', content_text[start:pos]))
+            continue
+
+        if char in ('"', "'"):
+            pos += 1
+            while pos < length and content_text[pos] != char:
+                if content_text[pos] == '\n':
+                    raise JsSyntaxError("String is not terminated at line {}".format(content_text.count('\n', 0, start) + 1))
+                pos += 2 if content_text[pos] == '\\' else 1
+            if pos >= length:
+                raise JsSyntaxError("String is not terminated at line {}".format(content_text.count('\n', 0, start) + 1))
+            pos += 1
+            token = ('string', content_text[start:pos])
+        elif char == '`':
+            pos = _scan_template(content_text, pos + 1)
+            token = ('template', content_text[start:pos])
+        elif char == '/' and _regex_allowed(last_significant):
+            pos = _scan_regex(content_text, pos + 1)
+            token = ('regex', content_text[start:pos])
+        elif is_word_char(char):
+            while pos < length and is_word_char(content_text[pos]):
+                pos += 2 if content_text[pos] == '\\' else 1
+            token = ('word', content_text[start:pos])
+        else:
+            punctuator = next((p for p in _PUNCTUATORS if content_text.startswith(p, pos)), char)
+            if in_template and punctuator == '}':
+                if brace_depth == 0:
+                    return tokens, pos
+                brace_depth -= 1
+            elif punctuator == '{':
+                brace_depth += 1
+            pos += len(punctuator)
+            token = ('punct', punctuator)
+        tokens.append(token)
+        last_significant = token
+
+    if in_template:
+        raise JsSyntaxError("Template substitution is not terminated")
+    return tokens, pos
+
+
+def _regex_allowed(last_significant):
+    if last_significant is None:
+        return True
+    token_type, text = last_significant
+    if token_type == 'word':
+        return text in _REGEX_KEYWORDS
+    if token_type == 'punct':
+        return text not in (')', ']', '++', '--')
+    return False
+
+
+def _scan_template(content_text, pos):
+    """
+    :return: position after closing backtick, substitutions are skipped with nested templates
+    """
+    while pos < len(content_text):
+        char = content_text[pos]
+        if char == '\\':
+            pos += 2
+        elif char == '`':
+            return pos + 1
+        elif content_text.startswith('${', pos):
+            # Closing brace of substitution is consumed here
+            pos = tokenize_js(content_text, pos + 2, in_template=True)[1] + 1
+        else:
+            pos += 1
+    raise JsSyntaxError("Template literal is not terminated")
+
+
+def _scan_regex(content_text, pos):
+    """
+    :return: position after regular expression flags
+    """
+    in_class = False
+    while pos < len(content_text):
+        char = content_text[pos]
+        if char == '\n':
+            break
+        if char == '\\':
+            pos += 2
+            continue
+        if char == '[':
+            in_class = True
+        elif char == ']':
+            in_class = False
+        elif char == '/' and not in_class:
+            pos += 1
+            while pos < len(content_text) and is_word_char(content_text[pos]):
+                pos += 1
+            return pos
+        pos += 1
+    raise JsSyntaxError("Regular expression is not terminated")
+
+
+def is_preserved_comment(comment_text):
+    """
+    :param comment_text:
+    :return: True for license comments /*! ... */, @license and @preserve
+    """
+    return comment_text.startswith('/*!') or '@license' in comment_text or '@preserve' in comment_text
+
+
+def minify_js(content_text):
+    """
+    Function minifies JavaScript without changing its tokens: comments except license comments
+    are removed, whitespace is collapsed and debugger statements are stripped. Line breaks are kept
+    where they can terminate statement, so automatic semicolon insertion is not changed.
+    :param content_text:
+    :return: minified text
+    Raises:
+        JsSyntaxError: if text cannot be tokenized
+    """
+    tokens = tokenize_js(content_text)[0]
+
+    significant = list()
+    separator = None
+    for token_type, text in tokens:
+        if token_type == 'ws':
+            separator = '\n' if '\n' in text or separator == '\n' else (separator or ' ')
+        elif token_type == 'comment' and not is_preserved_comment(text):
+            separator = '\n' if '\n' in text or separator == '\n' else (separator or ' ')
+        else:
+            significant.append((token_type, text, separator))
+            separator = None
+
+    # Dead debugger statements, the semicolon is kept as empty statement
+    significant = [token for i, token in enumerate(significant)
+                   if not (token[0] == 'word' and token[1] == 'debugger'
+                           and (i == 0 or significant[i - 1][1] not in ('.', '?.'))
+                           and i + 1 < len(significant) and significant[i + 1][1] == ';')]
+
+    output = list()
+    previous = None
+    for token_type, text, separator in significant:
+        if previous is not None:
+            previous_type, previous_text = previous
+            if separator == '\n' and not (text in _CONTINUATION_TOKENS or
+                                          (previous_type == 'punct' and previous_text not in (')', ']', '}', '++', '--'))):
+                output.append('\n')
+            elif separator is not None and _space_required(previous_text, text):
+                output.append(' ')
+            elif token_type == 'comment' or previous_type == 'comment':
+                output.append('\n')
+        output.append(text)
+        previous = (token_type, text)
+    return ''.join(output) + '\n'
+
+
+def _space_required(previous_text, text):
+    last_char, first_char = previous_text[-1], text[0]
+    if is_word_char(last_char) and (is_word_char(first_char) or first_char == '.'):
+        return True
+    if last_char == first_char and last_char in '+-':
+        return True
+    # Neither comment start nor HTML comment is created
+    return '/' in (last_char, first_char) or (last_char == '<' and first_char == '!')
+
+
+def get_viz_encodings(encodings):
+    """
+    :param encodings: requested precompression encodings - gz and br
+    :return: encodings supported by installed modules
+    """
+    return [encoding for encoding in encodings if encoding == 'gz' or (encoding == 'br' and brotli is not None)]
+
+
+def compress_content(content_data, encoding):
+    """
+    :param content_data: bytes
+    :param encoding: gz or br
+    :return: compressed bytes, gzip output does not depend on time, so identical input gives identical file
+    """
+    if encoding == 'gz':
+        return gzip.compress(content_data, compresslevel=9, mtime=0)
+    if encoding == 'br':
+        return brotli.compress(content_data)
+    raise ValueError("Unsupported encoding {}".format(encoding))